@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("common.athena_utils")
+
+_FINISHED_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+# rows per DataFrame handed to the writer by run_athena_pipeline
+DEFAULT_CHUNKSIZE = int(os.environ.get("ATHENA_CHUNKSIZE", "500000"))
+
+
+def wait_for_query(
+    query_execution_id: str,
+    athena_client=None,
+    initial_delay: float = 0.25,
+    max_delay: float = 5.0,
+) -> Dict[str, Any]:
+    """
+    Waits for an Athena query, polling often at first and backing off for long queries.
+
+    Parameters:
+    - query_execution_id (str): Id returned by start_query_execution.
+    - athena_client: boto3 Athena client to use. A new one is created if None.
+    - initial_delay (float): Seconds before the first status check.
+    - max_delay (float): Upper bound of the (doubling) delay between checks.
+
+    Returns:
+    - Dict[str, Any]: The QueryExecution of the succeeded query.
+    """
+    athena_client = athena_client or boto3.client("athena")
+    delay = initial_delay
+    while True:
+        time.sleep(delay)
+        execution = athena_client.get_query_execution(
+            QueryExecutionId=query_execution_id
+        )["QueryExecution"]
+        state = execution["Status"]["State"]
+        if state in _FINISHED_STATES:
+            break
+        delay = min(delay * 2, max_delay)
+
+    if state != "SUCCEEDED":
+        reason = execution["Status"].get("StateChangeReason", "")
+        raise RuntimeError(f"Athena query {query_execution_id} {state}: {reason}")
+    logger.info(f"Athena query {query_execution_id} succeeded")
+    return execution
+
+
+def _read_marker(s3_client, bucket: str, key: str) -> Optional[Dict[str, Any]]:
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(body)
+
+
+def read_athena_query(
+    sql: str,
+    database: str,
+    s3_output: str,
+    max_cache_seconds: int = 0,
+    chunksize: Optional[int] = None,
+    athena_client=None,
+    s3_client=None,
+    workgroup: Optional[str] = None,
+):
+    """
+    Runs a query as UNLOAD to Parquet and reads the result from S3, reusing the
+    result of an identical query that succeeded within max_cache_seconds.
+
+    Athena's own result reuse does not apply to UNLOAD, so results are stored
+    under a prefix derived from the database and SQL, next to a marker written
+    once the query succeeds.
+
+    Parameters:
+    - sql (str): SELECT statement to run, a trailing semicolon is dropped.
+    - database (str): Athena database the query runs in.
+    - s3_output (str): S3 location (s3://bucket/prefix) for query results.
+    - max_cache_seconds (int): Age up to which a previous result is reused. 0 disables reuse.
+    - chunksize (int): If set, an iterator of DataFrames with about this many rows is returned.
+    - athena_client: boto3 Athena client to use. A new one is created if None.
+    - s3_client: boto3 S3 client to use. A new one is created if None.
+    - workgroup (str): Athena workgroup the query runs in. The default workgroup if None.
+
+    Returns:
+    - pd.DataFrame | Iterator[pd.DataFrame]: Query result.
+    """
+    athena_client = athena_client or boto3.client("athena")
+    s3_client = s3_client or boto3.client("s3")
+    # UNLOAD takes a single statement, so a terminating semicolon must not end up inside it
+    sql = sql.strip().rstrip(";").rstrip()
+
+    digest = hashlib.sha256(f"{database}\n{sql}".encode()).hexdigest()
+    s3_output = s3_output.rstrip("/")
+    result_path = f"{s3_output}/unload/{digest}/"
+    bucket, _, prefix = s3_output.replace("s3://", "").partition("/")
+    marker_key = f"{prefix}/unload/{digest}.json".lstrip("/")
+
+    marker = _read_marker(s3_client, bucket, marker_key) if max_cache_seconds else None
+    age = time.time() - marker["finished_at"] if marker is not None else float("inf")
+    if age <= max_cache_seconds:
+        logger.info(
+            f"Reusing result of query {marker['query_execution_id']} ({age:.0f}s old)"
+        )
+    else:
+        # UNLOAD needs an empty target location
+        s3_client.delete_object(Bucket=bucket, Key=marker_key)
+        wr.s3.delete_objects(result_path)
+        params = {"WorkGroup": workgroup} if workgroup else {}
+        res = athena_client.start_query_execution(
+            QueryString=f"UNLOAD ({sql}) TO '{result_path}' WITH (format = 'PARQUET', compression = 'SNAPPY')",
+            QueryExecutionContext={"Database": database},
+            ResultConfiguration={"OutputLocation": f"{s3_output}/output/"},
+            **params,
+        )
+        query_execution_id = res["QueryExecutionId"]
+        logger.info("Execution ID: " + query_execution_id)
+        wait_for_query(query_execution_id, athena_client)
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=marker_key,
+            Body=json.dumps(
+                {
+                    "query_execution_id": query_execution_id,
+                    "finished_at": datetime.now(timezone.utc).timestamp(),
+                }
+            ),
+        )
+
+    if not wr.s3.list_objects(result_path):
+        # UNLOAD writes no file for an empty result
+        return iter([]) if chunksize else pd.DataFrame()
+    return wr.s3.read_parquet(result_path, chunked=chunksize or False)
+
+
+def read_sql(sql_path: str) -> str:
+    logger.info("Reading sql file... ")
+    with open(sql_path, "r") as sql_file:
+        return sql_file.read()
+
+
+def _chunk_writes(
+    chunk: pd.DataFrame,
+    mode: str,
+    partition_cols: Optional[List[str]],
+    written: set,
+) -> Iterator[Tuple[pd.DataFrame, str]]:
+    """
+    Yields the parts of a chunk with the write mode each needs, so that data
+    written by an earlier chunk of the same run is never replaced.
+    """
+    if mode == "append":
+        yield chunk, mode
+        return
+
+    if mode == "overwrite_partitions" and partition_cols:
+        keys = pd.MultiIndex.from_frame(chunk[partition_cols].astype(str))
+        seen = keys.isin(list(written))
+        written.update(keys.unique())
+        if not seen.all():
+            yield chunk[~seen], mode
+        if seen.any():
+            yield chunk[seen], "append"
+        return
+
+    # overwrite, or overwrite_partitions of an unpartitioned table
+    yield chunk, "append" if written else mode
+    written.add(None)
+
+
+def run_athena_pipeline(
+    sql: str,
+    database: str,
+    s3_output: str,
+    write: Callable[..., Any],
+    transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    mode: str = "overwrite",
+    partition_cols: Optional[List[str]] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    workgroup: Optional[str] = None,
+) -> int:
+    """
+    Reads a query result chunk by chunk and hands each chunk to a writer, so the
+    full result never has to fit in memory.
+
+    The first write of a table (or of each partition, for overwrite_partitions)
+    uses the requested mode and later writes of the same data append to it.
+    There is no rollback: if a chunk fails after an overwrite, the target holds
+    the chunks written so far until the next successful run replaces them. This
+    is logged as an error before the failure is raised.
+
+    Parameters:
+    - sql (str): SELECT statement to run.
+    - database (str): Athena database the query runs in.
+    - s3_output (str): S3 location (s3://bucket/prefix) for query results.
+    - write (Callable): Called as write(df, mode=mode) for each chunk. Failures must raise.
+    - transform (Callable): Applied to each chunk before it is written.
+    - mode (str): awswrangler write mode of the whole run: overwrite, overwrite_partitions or append.
+    - partition_cols (List[str]): Partition columns of the target, used by overwrite_partitions.
+    - chunksize (int): Rows per chunk.
+    - workgroup (str): Athena workgroup the query runs in.
+
+    Returns:
+    - int: Number of rows written.
+    """
+    chunks: Iterable[pd.DataFrame] = read_athena_query(
+        sql, database, s3_output, chunksize=chunksize, workgroup=workgroup
+    )
+    written: set = set()
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        if transform is not None:
+            chunk = transform(chunk)
+        for part, part_mode in _chunk_writes(chunk, mode, partition_cols, written):
+            try:
+                res = write(part, mode=part_mode)
+            except Exception:
+                if rows and mode != "append":
+                    logger.error(
+                        f"Chunk {i} failed after {rows} rows were written ({mode}): "
+                        "the target holds a partial result until the next successful run"
+                    )
+                raise
+            logger.info(f"Chunk {i}: wrote {len(part)} rows ({part_mode}): {res}")
+            rows += len(part)
+    logger.info(f"Wrote {rows} rows")
+    return rows
@@ -0,0 +1,428 @@
+import logging
+import os
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger("common.imal_utils")
+
+# Date-only values (optionally with a midnight time), e.g. 2024-01-31 or 31/01/2024
+DATE_PATTERN = (
+    r"^(?:\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{4})"
+    r"(?:[ T]00:00(?::00(?:\.0+)?)?)?$"
+)
+DATE_SAMPLE_SIZE = 1000
+
+# Columns of a (table, column) already found not to hold dates, kept across
+# chunks and files. Positive verdicts are not cached, a later chunk may hold text.
+_date_column_cache = {}
+
+# Athena types of each table, seeded from the Glue catalog (i.e. from the first
+# successful load of the table) and extended only through apply_schema_registry
+_schema_registry = {}
+
+# Arrow types used by the staged writer for each Athena type
+ATHENA_TO_ARROW = {
+    "int": pa.int32(),
+    "bigint": pa.int64(),
+    "double": pa.float64(),
+    "float": pa.float32(),
+    "boolean": pa.bool_(),
+    "string": pa.string(),
+    "date": pa.date32(),
+    # awswrangler and the Spark readers of these tables use millisecond timestamps
+    "timestamp": pa.timestamp("ms"),
+}
+
+
+def is_date_column(series, cache_key=None):
+    """
+    Checks whether an object column only holds dates without a time part.
+    A sample is matched against DATE_PATTERN first, so text columns are
+    rejected without parsing. Candidates are then parsed in a single
+    pd.to_datetime call over the whole column.
+    :param series: The Pandas Series to check
+    :param cache_key: Optional key, e.g. (table, column), to cache a negative verdict under
+    :return: True if every non-null value is a date
+    """
+    if cache_key is not None and cache_key in _date_column_cache:
+        return _date_column_cache[cache_key]
+
+    values = series.dropna()
+    if values.empty:
+        return True
+
+    if len(values) > DATE_SAMPLE_SIZE:
+        sample = values.sample(DATE_SAMPLE_SIZE, random_state=0)
+    else:
+        sample = values
+    if not sample.astype(str).str.match(DATE_PATTERN).all():
+        is_date = False
+    else:
+        parsed = pd.to_datetime(values.astype(str), errors="coerce", dayfirst=True)
+        is_date = bool(parsed.notna().all() and (parsed == parsed.dt.normalize()).all())
+
+    if cache_key is not None and not is_date:
+        _date_column_cache[cache_key] = is_date
+    return is_date
+
+
+def get_registered_schema(athena_table, database="datalake_raw"):
+    """
+    Returns the registered schema of a table, reading it from the Glue catalog
+    the first time the table is seen. Tables that don't exist yet start empty
+    and are seeded by their first chunk.
+    :param athena_table: Target Athena Glue table name
+    :param database: Glue database holding the table
+    :return: Dict of column -> Athena type, shared across chunks and files
+    """
+    if athena_table not in _schema_registry:
+        try:
+            table_types = wr.catalog.get_table_types(
+                database=database, table=athena_table
+            )
+        except Exception as e:
+            logger.warning(f"Could not read registered schema of {athena_table}: {e}")
+            table_types = None
+        _schema_registry[athena_table] = {
+            col: athena_type
+            for col, athena_type in (table_types or {}).items()
+            if col not in ("date", "timestamp_extracted")
+        }
+        logger.info(
+            f"Registered schema of {athena_table}: {len(_schema_registry[athena_table])} column(s)"
+        )
+    return _schema_registry[athena_table]
+
+
+def apply_schema_registry(df, athena_schema, registry, athena_table):
+    """
+    Aligns a chunk with the registered schema of its table. Unregistered columns
+    holding only nulls are dropped, since their type can't be known yet; other
+    unregistered columns are added to the registry, which is the only way a
+    table schema evolves.
+    :return: The aligned athena schema and dataframe
+    """
+    new_columns = {}
+    empty_columns = []
+    for col, athena_type in athena_schema.items():
+        if col in registry or col in ("date", "timestamp_extracted"):
+            continue
+        if df[col].isna().all():
+            empty_columns.append(col)
+        else:
+            new_columns[col] = athena_type
+
+    if empty_columns:
+        logger.info(
+            f"Skipping unregistered all-null column(s) of {athena_table}: {empty_columns}"
+        )
+        df = df.drop(columns=empty_columns)
+        athena_schema = {
+            c: t for c, t in athena_schema.items() if c not in empty_columns
+        }
+    if new_columns:
+        logger.info(
+            f"Evolving schema of {athena_table}, adding column(s): {new_columns}"
+        )
+        registry.update(new_columns)
+    return athena_schema, df
+
+
+def get_schema(
+    df,
+    date_string: str,
+    known_schema: Optional[dict] = None,
+    athena_table: Optional[str] = None,
+):
+    """
+    Accepts a Pandas Dataframe, casts each column to correct datatype, and produces
+    the Athena schema for each column in a dict.
+    :param df: The Pandas Dataframe
+    :param date_string: Day of the source file, YYYYMMDD, written to the 'date' partition
+    :param known_schema: Athena types already registered for the table, not re-inferred
+    :param athena_table: Target table, used to cache date column detection
+    :return: The athena schema and new pandas dataframe
+    """
+    known_schema = known_schema or {}
+    df = df.rename(columns=str.lower)
+    dtype_mapping = {
+        "int64": "int",
+        "int32": "int",
+        "float64": "double",
+        "float32": "double",
+        "bool": "boolean",
+        "object": "string",
+        "datetime64": "timestamp",
+        "timedelta": "string",
+        "category": "string",
+    }
+    athena_schema = {}
+    for col in df.columns:
+        dtype = str(df[col].dtype)
+        if col in known_schema:
+            athena_schema[col] = known_schema[col]
+        elif dtype == "object" and is_date_column(
+            df[col], cache_key=(athena_table, col) if athena_table else None
+        ):
+            athena_schema[col] = "date"
+        elif dtype.startswith("datetime64") or dtype.startswith("timedelta"):
+            dtype = dtype.split("[")[0]
+            athena_schema[col] = dtype_mapping.get(dtype, "string")
+        else:
+            mapped_dtype = dtype_mapping.get(dtype, "string")
+            athena_schema[col] = mapped_dtype
+    for col in df.columns:
+        if athena_schema[col] in ("date", "timestamp"):
+            # A registered date column keeps its type for the whole file, so a
+            # stray value such as "N/A" in a later chunk is nulled, not fatal.
+            parsed = pd.to_datetime(df[col], dayfirst=True, errors="coerce")
+            unparsed = int((parsed.isna() & df[col].notna()).sum())
+            if unparsed:
+                logger.warning(
+                    "Column %s: %d value(s) are not valid %ss and were set to null",
+                    col,
+                    unparsed,
+                    athena_schema[col],
+                )
+            df[col] = parsed
+    logger.info("Finished setting up schema.")
+    df["date"] = date_string
+    athena_schema["date"] = "date"
+
+    df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    athena_schema["timestamp_extracted"] = "timestamp"
+
+    return athena_schema, df
+
+
+def to_arrow_type(athena_type):
+    """
+    Returns the Arrow type the staged writer uses for an Athena type.
+    :param athena_type: Athena type, e.g. from the table's registered schema
+    :return: The pyarrow DataType
+    """
+    try:
+        return ATHENA_TO_ARROW[athena_type]
+    except KeyError:
+        raise ValueError(f"No Arrow type for Athena type {athena_type!r}") from None
+
+
+class StagedParquetWriter:
+    """
+    Writes every chunk of one source file into a few large Parquet files under
+    a single 'date' partition, then updates the Glue catalog once on commit()
+    instead of once per chunk. Small chunks are buffered until they make a row
+    group of row_group_rows rows or row_group_size_mb, so Athena scans a few
+    large row groups rather than one per chunk.
+    """
+
+    def __init__(
+        self,
+        s3_bucket,
+        athena_table,
+        date_string,
+        database="datalake_raw",
+        target_file_size_mb=128,
+        row_group_rows=128 * 1024,
+        row_group_size_mb=128,
+    ):
+        self.s3_bucket = s3_bucket
+        self.athena_table = athena_table
+        self.database = database
+        self.partition_value = datetime.strptime(date_string, "%Y%m%d").strftime(
+            "%Y-%m-%d"
+        )
+        self.partition_prefix = f"{athena_table}/date={self.partition_value}/"
+        self.target_file_size = target_file_size_mb * 1024 * 1024
+        self.row_group_rows = row_group_rows
+        self.row_group_size = row_group_size_mb * 1024 * 1024
+        self.athena_schema = {}
+        self.files = []
+        self._writer = None
+        self._arrow_schema = None
+        self._local_path = None
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+    def write(self, df, athena_schema):
+        """
+        Buffers a chunk for the current row group, rolling over to a new file
+        when the current one reaches the target size or the chunk adds columns.
+        :return: True if the chunk was staged
+        """
+        try:
+            columns_types = {
+                wr.catalog.sanitize_column_name(col): athena_type
+                for col, athena_type in athena_schema.items()
+                if col != "date"
+            }
+            df = df.drop(columns=["date"]).rename(
+                columns=wr.catalog.sanitize_column_name
+            )
+            arrow_schema = pa.schema(
+                [(col, to_arrow_type(t)) for col, t in columns_types.items()]
+            )
+            table = pa.Table.from_pandas(df[list(columns_types)], preserve_index=False)
+            table = table.cast(arrow_schema)
+
+            # New columns start a new file, row groups of a file share a schema
+            if self._writer is not None and not self._arrow_schema.equals(arrow_schema):
+                self._upload_current_file()
+            if self._writer is None:
+                fd, self._local_path = tempfile.mkstemp(suffix=".snappy.parquet")
+                os.close(fd)
+                self._writer = pq.ParquetWriter(
+                    self._local_path,
+                    arrow_schema,
+                    compression="snappy",
+                    coerce_timestamps="ms",
+                )
+                self._arrow_schema = arrow_schema
+
+            self._pending.append(table)
+            self._pending_rows += table.num_rows
+            self._pending_bytes += table.nbytes
+            self.athena_schema.update(columns_types)
+            if (
+                self._pending_rows >= self.row_group_rows
+                or self._pending_bytes >= self.row_group_size
+            ):
+                self._write_row_group()
+                if os.path.getsize(self._local_path) >= self.target_file_size:
+                    self._upload_current_file()
+            return True
+        except Exception as e:
+            logger.error("Athena schema:  %s", athena_schema)
+            logger.error(f"Failed staging chunk for {self.athena_table}: {e}")
+            return False
+
+    def commit(self):
+        """
+        Uploads the last file and registers the schema and partition in the
+        Glue catalog once.
+        :return: True if the file was committed
+        """
+        try:
+            self._upload_current_file()
+            if not self.files:
+                return True
+            path = f"s3://{self.s3_bucket}/{self.athena_table}/"
+            wr.catalog.create_parquet_table(
+                database=self.database,
+                table=self.athena_table,
+                path=path,
+                columns_types=self.athena_schema,
+                partitions_types={"date": "date"},
+                compression="snappy",
+                mode="append",
+            )
+            wr.catalog.add_parquet_partitions(
+                database=self.database,
+                table=self.athena_table,
+                partitions_values={
+                    f"s3://{self.s3_bucket}/{self.partition_prefix}": [
+                        self.partition_value
+                    ]
+                },
+                compression="snappy",
+            )
+            logger.info(f"Committed {len(self.files)} file(s) to {path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed committing staged files for {self.athena_table}: {e}")
+            return False
+
+    def abort(self):
+        """
+        Drops the file being written. Files already uploaded are left in place.
+        """
+        self._pending = []
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(self._local_path)
+            self._writer = None
+
+    def _write_row_group(self):
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._writer.write_table(table, row_group_size=table.num_rows)
+
+    def _upload_current_file(self):
+        if self._writer is None:
+            return
+        self._write_row_group()
+        self._writer.close()
+        self._writer = None
+        key = f"{self.partition_prefix}{uuid.uuid4().hex}.snappy.parquet"
+        try:
+            boto3.client("s3").upload_file(self._local_path, self.s3_bucket, key)
+        finally:
+            os.remove(self._local_path)
+        self.files.append(key)
+        logger.info(f"Uploaded staged file s3://{self.s3_bucket}/{key}")
+
+
+def append_to_buffers(buffers, item, row_count):
+    """
+    Appends one JSON record to column buffers holding row_count rows.
+    Columns first seen in this record are back-filled with None, columns
+    missing from the record get None.
+    """
+    for key, value in item.items():
+        column = buffers.get(key)
+        if column is None:
+            column = buffers[key] = [None] * row_count
+        column.append(value)
+    if len(item) < len(buffers):
+        for column in buffers.values():
+            if len(column) <= row_count:
+                column.append(None)
+
+
+def buffers_to_frame(buffers, arrow_schema=None):
+    """
+    Converts column buffers to a Pandas DataFrame through Arrow.
+    Columns already in arrow_schema are built with their fixed type, new ones
+    are inferred once and added to the schema.
+    :param buffers: Dict of column name -> list of values
+    :param arrow_schema: Arrow schema fixed by earlier chunks, or None
+    :return: The DataFrame and the updated Arrow schema
+    """
+    fields = {field.name: field for field in arrow_schema} if arrow_schema else {}
+    arrays = []
+    for name, values in buffers.items():
+        field = fields.get(name)
+        fixed_type = (
+            None if field is None or pa.types.is_null(field.type) else field.type
+        )
+        try:
+            array = pa.array(values, type=fixed_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            try:
+                array = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+                array = pa.array(
+                    [None if v is None else str(v) for v in values], type=pa.string()
+                )
+            if fixed_type is not None:
+                logger.warning(
+                    f"Column {name} no longer fits {fixed_type}, using {array.type}"
+                )
+        fields[name] = pa.field(name, array.type)
+        arrays.append(array)
+
+    table = pa.Table.from_arrays(arrays, names=list(buffers))
+    return table.to_pandas(), pa.schema(list(fields.values()))
@@ -0,0 +1,69 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional
+
+import boto3
+
+logger = logging.getLogger("common.s3_utils")
+
+
+def list_s3_keys(
+    bucket: str,
+    prefix: str,
+    s3_client=None,
+    key_filter: Optional[Callable[[str], bool]] = None,
+) -> Iterable[str]:
+    """
+    Yields the keys under a prefix, following list_objects_v2 pagination so
+    prefixes holding more than 1,000 objects are listed completely.
+
+    Parameters:
+    - bucket (str): Bucket to list.
+    - prefix (str): Key prefix to list.
+    - s3_client: boto3 S3 client to use. A new one is created if None.
+    - key_filter (Callable[[str], bool]): Optional predicate, only matching keys are yielded.
+
+    Returns:
+    - Iterable[str]: Matching keys, in S3 (lexicographic) order.
+    """
+    s3_client = s3_client or boto3.client("s3")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key_filter is None or key_filter(key):
+                yield key
+
+
+def list_s3_keys_concurrently(
+    bucket: str,
+    prefixes: List[str],
+    s3_client=None,
+    key_filter: Optional[Callable[[str], bool]] = None,
+    max_workers: int = 16,
+) -> List[str]:
+    """
+    Lists several prefixes concurrently with a single shared S3 client.
+
+    Parameters:
+    - bucket (str): Bucket to list.
+    - prefixes (List[str]): Key prefixes to list.
+    - s3_client: boto3 S3 client to use. A new one is created if None.
+    - key_filter (Callable[[str], bool]): Optional predicate, only matching keys are returned.
+    - max_workers (int): Maximum number of concurrent listings.
+
+    Returns:
+    - List[str]: Matching keys, grouped in the order of the given prefixes.
+    """
+    if not prefixes:
+        return []
+    s3_client = s3_client or boto3.client("s3")
+
+    def _list(prefix):
+        return list(list_s3_keys(bucket, prefix, s3_client, key_filter))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(prefixes))) as executor:
+        results = list(executor.map(_list, prefixes))
+
+    logger.info(f"Listed {len(prefixes)} prefix(es) in s3://{bucket}")
+    return [key for keys in results for key in keys]
@@ -2,12 +2,30 @@ import ast
 import json
 import logging
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import awswrangler as wr
+import boto3
+import numpy as np
 import pandas as pd
+from botocore.exceptions import ClientError
 from awsglue.utils import getResolvedOptions
 
 from api_client import APIClient
@@ -19,9 +37,20 @@ _MANUAL_EVENT: Dict[str, Any] = {
     "portfolio_ids": [],
     "start_date": "",
     "end_date": "",
+    "resume": False,
 }
 
 REQUIRED_ARGS = ["BASE_URL", "NOMO_ALLFUNDS_READ_ONLY", "S3_RAW", "ATHENA_TABLE_NAMES"]
+# Resolved only when passed to the job, defaults live in ETLConfig
+OPTIONAL_ARGS = [
+    "MAX_WORKERS",
+    "REQUESTS_PER_SECOND",
+    "BATCH_SIZE",
+    "PERFORMANCE_DATE_RANGE",
+    "FLUSH_RECORDS",
+    "STATE_PATH",
+    "RESUME",
+]
 
 
 def setup_logger(
@@ -53,6 +82,110 @@ class ETLConfig:
     auth: str
     s3_raw: str
     athena_table_names: List[str]
+    max_workers: int = 1
+    requests_per_second: Optional[float] = None
+    batch_size: int = 1
+    performance_date_range: bool = False
+    flush_records: int = 100000
+    state_path: Optional[str] = None
+    resume: bool = False
+
+
+class RateLimiter:
+    """Spaces out calls shared by several threads to at most `rate` per second.
+
+    A rate of None or 0 disables limiting.
+    """
+
+    def __init__(self, rate: Optional[float] = None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class WriteError(Exception):
+    """A flush of StreamingTableWriter failed, holds the (portfolio, date) pairs lost."""
+
+    def __init__(self, pairs: List[Tuple[str, str]]):
+        super().__init__(f"Failed writing {len(pairs)} portfolio/date pairs")
+        self.pairs = pairs
+
+
+class UnattributedRecordsError(ValueError):
+    """A batched response holds records that cannot be split back out by 'portfolioId'."""
+
+
+class StreamingTableWriter:
+    """Buffers the raw records of a table and writes them in bounded chunks.
+
+    Records are added per (portfolio, date) pair and written with `save` on flush,
+    which the caller triggers per date partition or once `full` (flush_records rows
+    buffered). The buffer is turned into a frame and passed through `normalize`
+    together with the portfolio id of every row; pairs of portfolios `normalize`
+    dropped records of are left out of the write and rejected. The other flushed
+    pairs become committed; a failed write drops the buffer and raises WriteError
+    with the pairs it held.
+    """
+
+    def __init__(
+        self,
+        save: Callable[[pd.DataFrame], None],
+        flush_records: int,
+        normalize: Optional[
+            Callable[[pd.DataFrame, Sequence[str]], Tuple[pd.DataFrame, List[str]]]
+        ] = None,
+    ):
+        self.save = save
+        self.flush_records = max(1, flush_records)
+        self.normalize = normalize
+        self.buffer: List[Dict[str, Any]] = []
+        self.pending: List[Tuple[str, str]] = []
+        self.counts: List[int] = []
+        self.committed: List[Tuple[str, str]] = []
+        self.written = 0
+
+    @property
+    def full(self) -> bool:
+        return len(self.buffer) >= self.flush_records
+
+    def add(self, portfolio_id: str, date: str, records: List[Dict[str, Any]]) -> None:
+        self.buffer.extend(records)
+        self.pending.append((portfolio_id, date))
+        self.counts.append(len(records))
+
+    def flush(self) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """Write the buffered records and return the pairs committed and rejected by this flush."""
+        if not self.pending:
+            return [], []
+        buffer, pairs, counts = self.buffer, self.pending, self.counts
+        self.buffer, self.pending, self.counts = [], [], []
+        rejected: List[Tuple[str, str]] = []
+        try:
+            df = pd.DataFrame(buffer)
+            if self.normalize is not None:
+                portfolio_ids = np.repeat([pid for pid, _ in pairs], counts)
+                df, dropped = self.normalize(df, portfolio_ids)
+                if dropped:
+                    # write none of an incomplete pair so a rerun does not duplicate rows
+                    rejected = [pair for pair in pairs if pair[0] in dropped]
+                    pairs = [pair for pair in pairs if pair[0] not in dropped]
+                    df = df[~df["portfolio_id"].isin(dropped)]
+            self.save(df)
+        except Exception as exc:
+            raise WriteError(pairs + rejected) from exc
+        self.committed.extend(pairs)
+        self.written += len(df)
+        return pairs, rejected
 
 
 class AllFundsETL:
@@ -74,6 +207,9 @@ class AllFundsETL:
         self.config = config
         self.client = client
         self.logger = logger_ or logger
+        self.rate_limiter = RateLimiter(config.requests_per_second)
+        # turned off for the rest of the run if a batched response can't be split
+        self.batching = config.batch_size > 1
 
     # ---- Input helpers ----
     @staticmethod
@@ -120,19 +256,41 @@ class AllFundsETL:
 
     # ---- Normalization & persistence ----
     @staticmethod
-    def normalize_record(obj: Dict[str, Any], portfolio_id: str) -> Dict[str, Any]:
-        """Normalize a single API record to include required metadata and partition column 'date' (YYYYMMDD).
+    def normalize_frame(
+        df: pd.DataFrame, portfolio_ids: Sequence[str]
+    ) -> Tuple[pd.DataFrame, List[str]]:
+        """Normalize a frame of API records to include required metadata and partition column 'date' (YYYYMMDD).
 
         Rules:
-          - Preserve API original 'date' where possible as 'date_raw'.
-          - Ensure 'date' contains YYYYMMDD string used for Athena partition.
+          - 'date' and 'dateAsString' swap values: 'date' holds the YYYYMMDD string used
+            for the Athena partition and 'dateAsString' the API original 'date'.
+          - One 'timestamp_extracted' is stamped on the whole frame.
+          - 'portfolio_id' is set per row from portfolio_ids.
+          - Records without 'dateAsString' have no partition and are dropped with a
+            warning instead of failing the whole flush.
+
+        Returns the frame and the sorted portfolio ids records were dropped for.
         """
-        rec = dict(obj)  # shallow copy
-        rec["timestamp_extracted"] = datetime.now(timezone.utc)
-        rec["portfolio_id"] = portfolio_id
-        rec["date"] = rec["dateAsString"]
-        rec["dateAsString"] = obj["date"]
-        return rec
+        if df.empty:
+            return df, []
+        for column in ("date", "dateAsString"):
+            if column not in df.columns:
+                df[column] = None
+        columns = list(df.columns)
+        df = df.rename(columns={"date": "dateAsString", "dateAsString": "date"})
+        df = df[columns]
+        df["timestamp_extracted"] = datetime.now(timezone.utc)
+        df["portfolio_id"] = portfolio_ids
+        missing = df["date"].isna()
+        dropped = sorted(set(df.loc[missing, "portfolio_id"]))
+        if dropped:
+            logger.warning(
+                "Dropping %d record(s) without dateAsString for portfolios %s",
+                int(missing.sum()),
+                dropped,
+            )
+            df = df[~missing]
+        return df, dropped
 
     def save_to_s3(self, df: pd.DataFrame, athena_table: str) -> None:
         """Write DataFrame to S3/Glue catalog as parquet with partitioning.
@@ -172,12 +330,19 @@ class AllFundsETL:
             raise
 
     # ---- Table-specific fetchers ----
+    @staticmethod
+    def as_portfolio_ids(portfolio_id: Union[str, List[str]]) -> List[str]:
+        """Return the request 'portfolioIds' list for one portfolio id or a batch."""
+        if isinstance(portfolio_id, str):
+            return [portfolio_id]
+        return list(portfolio_id)
+
     def fetch_open_positions(
-        self, portfolio_id: str, date: str
+        self, portfolio_id: Union[str, List[str]], date: str
     ) -> List[Dict[str, Any]]:
         body = {
             "date": date,
-            "portfolioIds": [portfolio_id],
+            "portfolioIds": self.as_portfolio_ids(portfolio_id),
             "currency": "USD",
             "lang": "EN",
         }
@@ -194,11 +359,16 @@ class AllFundsETL:
         )
         return records
 
-    def fetch_performance(self, portfolio_id: str, date: str) -> List[Dict[str, Any]]:
+    def fetch_performance(
+        self,
+        portfolio_id: Union[str, List[str]],
+        date: str,
+        date_to: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
         body = {
             "dateFrom": date,
-            "dateTo": date,
-            "portfolioIds": [portfolio_id],
+            "dateTo": date_to or date,
+            "portfolioIds": self.as_portfolio_ids(portfolio_id),
             "currency": "USD",
             "annualPerformance": False,
             "monthlyPerformance": False,
@@ -218,12 +388,227 @@ class AllFundsETL:
         )
         return records
 
+    def fetch_records(
+        self,
+        athena_table: str,
+        portfolio_ids: List[str],
+        date: str,
+        date_to: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Fetch one date of a table for one or more portfolios in a single request.
+
+        date_to asks the performance endpoint for the whole date..date_to window.
+        Waits for the rate limiter first, called from the worker threads of process_table.
+        """
+        self.rate_limiter.wait()
+        self.logger.info(
+            "Fetching %s for portfolios %s on date %s%s",
+            athena_table,
+            portfolio_ids,
+            date,
+            f" to {date_to}" if date_to else "",
+        )
+        if athena_table == "allfunds_transactions_open_positions":
+            records = self.fetch_open_positions(portfolio_ids, date)
+        else:
+            records = self.fetch_performance(portfolio_ids, date, date_to)
+        self.logger.info(
+            "Fetched %d records for portfolios %s on %s",
+            len(records or []),
+            portfolio_ids,
+            date,
+        )
+        return records or []
+
+    @staticmethod
+    def build_batches(portfolio_ids: List[str], batch_size: int) -> List[List[str]]:
+        """Group portfolio ids into request batches of at most batch_size."""
+        batch_size = max(1, batch_size)
+        return [
+            portfolio_ids[i : i + batch_size]
+            for i in range(0, len(portfolio_ids), batch_size)
+        ]
+
+    @staticmethod
+    def split_by_portfolio(
+        records: List[Dict[str, Any]], batch: List[str]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Split the records of a batched response back out by their 'portfolioId'.
+
+        Raises UnattributedRecordsError for records that cannot be attributed to a
+        portfolio of the batch.
+        """
+        grouped: Dict[str, List[Dict[str, Any]]] = {pid: [] for pid in batch}
+        for record in records:
+            portfolio_id = str(record.get("portfolioId"))
+            if portfolio_id not in grouped:
+                raise UnattributedRecordsError(
+                    f"Record for unexpected portfolio {portfolio_id} in batch response"
+                )
+            grouped[portfolio_id].append(record)
+        return grouped
+
+    @staticmethod
+    def split_by_date(
+        records: List[Dict[str, Any]], dates: List[str]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Split the 'serie' of a date range response into daily rows by 'dateAsString'.
+
+        Records outside the requested dates are dropped.
+        """
+        grouped: Dict[str, List[Dict[str, Any]]] = {date: [] for date in dates}
+        for record in records:
+            day = grouped.get(str(record.get("dateAsString")))
+            if day is not None:
+                day.append(record)
+        return grouped
+
+    def fetch_batch(
+        self,
+        athena_table: str,
+        batch: List[str],
+        date: str,
+        date_to: Optional[str] = None,
+    ) -> Dict[str, Union[List[Dict[str, Any]], Exception]]:
+        """Fetch a batch of portfolios for one date or date range, split back out by portfolio.
+
+        A failed batch falls back to one request per portfolio. A response that can't
+        be split by portfolio also turns batching off for the rest of the run, so it
+        costs a single extra request. Values are the records of each portfolio, or the
+        exception its request raised.
+        """
+        if len(batch) > 1 and self.batching:
+            try:
+                records = self.fetch_records(athena_table, batch, date, date_to)
+                return self.split_by_portfolio(records, batch)
+            except UnattributedRecordsError as exc:
+                self.batching = False
+                self.logger.warning(
+                    "Batched %s response can't be split by portfolioId (%s), "
+                    "requesting one portfolio at a time for the rest of the run",
+                    athena_table,
+                    exc,
+                )
+            except Exception as exc:
+                self.logger.warning(
+                    "Batch of %d portfolios failed on %s (%s), retrying one by one",
+                    len(batch),
+                    date,
+                    exc,
+                )
+
+        results: Dict[str, Union[List[Dict[str, Any]], Exception]] = {}
+        for portfolio_id in batch:
+            try:
+                results[portfolio_id] = self.fetch_records(
+                    athena_table, [portfolio_id], date, date_to
+                )
+            except Exception as exc:
+                self.logger.error(
+                    "Error fetching for portfolio %s on date %s",
+                    portfolio_id,
+                    date,
+                    exc_info=exc,
+                )
+                results[portfolio_id] = exc
+        return results
+
+    # ---- Resume state ----
+    def _manifest_location(
+        self, athena_table: str, dates: List[str]
+    ) -> Tuple[str, str]:
+        bucket, prefix = self.config.state_path.replace("s3://", "").split("/", 1)
+        key = f"{prefix.rstrip('/')}/{athena_table}/{dates[0]}_{dates[-1]}.json"
+        return bucket, key
+
+    def read_committed(
+        self, athena_table: str, dates: List[str]
+    ) -> Dict[str, Set[str]]:
+        """Return the dates already committed per portfolio by a previous run of the same window."""
+        if not self.config.state_path:
+            return {}
+        bucket, key = self._manifest_location(athena_table, dates)
+        try:
+            body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                self.logger.info("No committed pairs found for %s", athena_table)
+                return {}
+            raise
+        committed = json.loads(body).get("committed", {})
+        return {pid: set(pid_dates) for pid, pid_dates in committed.items()}
+
+    def write_committed(
+        self, athena_table: str, dates: List[str], committed: Dict[str, Set[str]]
+    ) -> None:
+        """Persist the committed (portfolio, date) pairs so a rerun can skip them."""
+        if not self.config.state_path:
+            return
+        bucket, key = self._manifest_location(athena_table, dates)
+        body = {
+            "table": athena_table,
+            "committed": {pid: sorted(days) for pid, days in committed.items()},
+        }
+        try:
+            boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=json.dumps(body))
+        except Exception:
+            # the data itself is written; a stale manifest only costs a refetch
+            self.logger.exception(
+                "Failed to persist committed pairs to s3://%s/%s", bucket, key
+            )
+
     # ---- Orchestration ----
+    def iter_results(
+        self, athena_table: str, tasks: List[Tuple[Tuple[str, ...], Tuple[str, str]]]
+    ) -> Iterator[Tuple[Any, Dict[str, Union[List[Dict[str, Any]], Exception]]]]:
+        """Fetch the batch/window tasks concurrently and yield their results in order.
+
+        At most two tasks per worker are in flight, so memory stays bounded however
+        many pairs the backfill covers.
+        """
+        workers = max(1, min(self.config.max_workers, len(tasks)))
+        self.logger.info(
+            "Fetching %s for %d portfolio batch/date window pairs with %d workers",
+            athena_table,
+            len(tasks),
+            workers,
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def submit(task):
+                batch, (date_from, date_to) = task
+                date_to = date_to if date_to != date_from else None
+                return executor.submit(
+                    self.fetch_batch, athena_table, list(batch), date_from, date_to
+                )
+
+            pending_tasks = iter(tasks)
+            in_flight = deque()
+            for task in pending_tasks:
+                in_flight.append((task, submit(task)))
+                if len(in_flight) >= workers * 2:
+                    break
+            while in_flight:
+                task, future = in_flight.popleft()
+                next_task = next(pending_tasks, None)
+                if next_task is not None:
+                    in_flight.append((next_task, submit(next_task)))
+                yield task, future.result()
+
     def process_table(
-        self, athena_table: str, portfolio_ids: List[str], dates: List[str]
+        self,
+        athena_table: str,
+        portfolio_ids: List[str],
+        dates: List[str],
+        resume: bool = False,
     ) -> Dict[str, Any]:
         """Process a single configured athena table: fetch, normalize and persist.
 
+        Records are written per date partition, or every flush_records rows, instead of
+        once at the end. With resume, pairs committed by a previous run of the same dates
+        are skipped so only the failed ones are fetched again, and the committed pairs
+        are recorded after every flush.
+
         Returns a dict with processed and failed details for the table.
         """
         if athena_table not in (
@@ -232,54 +617,111 @@ class AllFundsETL:
         ):
             raise ValueError(f"Provided athena table not configured: {athena_table}")
 
-        all_records: List[Dict[str, Any]] = []
         processed: Dict[str, List[Dict[str, Any]]] = {}
         failed: Dict[str, List[Dict[str, Any]]] = {}
+        committed = self.read_committed(athena_table, dates) if resume else {}
+        writer = StreamingTableWriter(
+            lambda df: self.save_to_s3(df, athena_table),
+            self.config.flush_records,
+            normalize=self.normalize_frame,
+        )
 
-        for portfolio_id in portfolio_ids:
-            for date in dates:
-                try:
-                    self.logger.info(
-                        "Fetching %s for portfolio %s on date %s",
-                        athena_table,
-                        portfolio_id,
-                        date,
-                    )
-                    if athena_table == "allfunds_transactions_open_positions":
-                        records = self.fetch_open_positions(portfolio_id, date)
-                    else:
-                        records = self.fetch_performance(portfolio_id, date)
+        def fail_pairs(pairs: List[Tuple[str, str]], error: str) -> None:
+            for portfolio_id, date in pairs:
+                processed[portfolio_id] = [
+                    p for p in processed[portfolio_id] if p["date"] != date
+                ]
+                failed.setdefault(portfolio_id, []).append(
+                    {"date": date, "error": error}
+                )
+
+        def flush() -> None:
+            try:
+                pairs, rejected = writer.flush()
+            except WriteError as exc:
+                self.logger.error(
+                    "Failed writing %s", athena_table, exc_info=exc.__cause__
+                )
+                fail_pairs(exc.pairs, f"write failed: {exc.__cause__}")
+                return
+            # not committed, so a resumed run fetches these pairs again
+            fail_pairs(rejected, "records without dateAsString")
+            for portfolio_id, date in pairs:
+                committed.setdefault(portfolio_id, set()).add(date)
+            if pairs and resume:
+                self.write_committed(athena_table, dates, committed)
+
+        # performance supports ranges: one request covers the whole window
+        if (
+            self.config.performance_date_range
+            and athena_table == "allfunds_transactions_performance"
+            and len(dates) > 1
+        ):
+            self.logger.warning(
+                "Requesting %s as one %s..%s window: accReturn may be cumulative "
+                "from the window start rather than per day",
+                athena_table,
+                dates[0],
+                dates[-1],
+            )
+            windows = [(dates[0], dates[-1])]
+        else:
+            windows = [(date, date) for date in dates]
+
+        # tasks are ordered by window so each date partition is flushed once complete
+        tasks = []
+        for date_from, date_to in windows:
+            window_dates = {d for d in dates if date_from <= d <= date_to}
+            pending = [
+                pid
+                for pid in portfolio_ids
+                if not window_dates <= committed.get(pid, set())
+            ]
+            for batch in self.build_batches(pending, self.config.batch_size):
+                tasks.append((tuple(batch), (date_from, date_to)))
+        if resume:
+            self.logger.info(
+                "Resuming %s: %d portfolio/date pairs already committed",
+                athena_table,
+                sum(len(days) for days in committed.values()),
+            )
 
-                    normalized = [
-                        self.normalize_record(r, portfolio_id) for r in (records or [])
-                    ]
-                    all_records.extend(normalized)
+        current_window = None
+        for (batch, (date_from, date_to)), results in self.iter_results(
+            athena_table, tasks
+        ):
+            if current_window not in (None, (date_from, date_to)):
+                flush()
+            current_window = (date_from, date_to)
+
+            window_dates = [d for d in dates if date_from <= d <= date_to]
+            for portfolio_id in batch:
+                records = results[portfolio_id]
+                todo = [
+                    d for d in window_dates if d not in committed.get(portfolio_id, ())
+                ]
+                if isinstance(records, Exception):
+                    for date in todo:
+                        failed.setdefault(portfolio_id, []).append(
+                            {"date": date, "error": str(records)}
+                        )
+                    # continue processing other portfolios/dates
+                    continue
 
+                if date_to != date_from:
+                    daily = self.split_by_date(records, window_dates)
+                else:
+                    daily = {date_from: records}
+                for date in todo:
                     processed.setdefault(portfolio_id, []).append(
-                        {"date": date, "count": len(records)}
-                    )
-                    self.logger.info(
-                        "Fetched %d records for portfolio %s on %s",
-                        len(records),
-                        portfolio_id,
-                        date,
+                        {"date": date, "count": len(daily[date])}
                     )
-                except Exception as exc:
-                    self.logger.exception(
-                        "Error fetching for portfolio %s on date %s", portfolio_id, date
-                    )
-                    failed.setdefault(portfolio_id, []).append(
-                        {"date": date, "error": str(exc)}
-                    )
-                    # continue processing other portfolios/dates
-
-        df = pd.DataFrame(all_records)
-        if not df.empty:
-            df.reset_index(drop=True, inplace=True)
-
-        self.save_to_s3(df, athena_table)
+                    writer.add(portfolio_id, date, daily[date])
+                    if writer.full:
+                        flush()
+        flush()
 
-        return {"processed": processed, "failed": failed, "count": int(len(df))}
+        return {"processed": processed, "failed": failed, "count": writer.written}
 
     def run(self, manual_event: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Execute ETL flow and return a summary."""
@@ -299,13 +741,14 @@ class AllFundsETL:
         dates = self.build_date_list(
             manual_event.get("start_date"), manual_event.get("end_date")
         )
+        resume = bool(manual_event.get("resume")) or self.config.resume
 
         summary_processed: Dict[str, Any] = {}
         summary_failed: Dict[str, Any] = {}
         total_count = 0
 
         for table in tables:
-            result = self.process_table(table, portfolio_ids, dates)
+            result = self.process_table(table, portfolio_ids, dates, resume=resume)
             summary_processed[table] = result.get("processed", {})
             summary_failed[table] = result.get("failed", {})
             total_count += result.get("count", 0)
@@ -334,7 +777,8 @@ class AllFundsETL:
 
 
 def load_runtime_args() -> Dict[str, str]:
-    args = getResolvedOptions(sys.argv, REQUIRED_ARGS)
+    optional = [k for k in OPTIONAL_ARGS if f"--{k}" in sys.argv]
+    args = getResolvedOptions(sys.argv, REQUIRED_ARGS + optional)
     missing = [k for k in REQUIRED_ARGS if not args.get(k)]
     if missing:
         raise RuntimeError(f"Missing required args: {', '.join(missing)}")
@@ -358,6 +802,14 @@ def main() -> Dict[str, Any]:
             auth=runtime["NOMO_ALLFUNDS_READ_ONLY"],
             s3_raw=runtime["S3_RAW"],
             athena_table_names=ast.literal_eval(str(runtime["ATHENA_TABLE_NAMES"])),
+            max_workers=int(runtime.get("MAX_WORKERS") or 1),
+            requests_per_second=float(runtime.get("REQUESTS_PER_SECOND") or 0) or None,
+            batch_size=int(runtime.get("BATCH_SIZE") or 1),
+            performance_date_range=str(runtime.get("PERFORMANCE_DATE_RANGE")).lower()
+            == "true",
+            flush_records=int(runtime.get("FLUSH_RECORDS") or 100000),
+            state_path=runtime.get("STATE_PATH") or None,
+            resume=str(runtime.get("RESUME")).lower() == "true",
         )
 
         client = init_api_client(cfg.auth, cfg.base_url)
@@ -113,6 +113,8 @@ except Exception:
 # Unit tests
 # -----------------------
 ################################################################
+import json
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
@@ -259,6 +261,512 @@ class TestMainETL(unittest.TestCase):
             )
 
 
+def _make_etl(client, **config):
+    cfg = lf.ETLConfig(
+        base_url="https://example.com",
+        auth="secret",
+        s3_raw="unit-test-raw-bucket",
+        athena_table_names=["allfunds_transactions_performance"],
+        **config,
+    )
+    return lf.AllFundsETL(cfg, client)
+
+
+class TestConcurrentProcessTable(unittest.TestCase):
+    def test_pairs_are_fetched_concurrently(self):
+        # only passes if the four portfolio/date pairs are in flight together
+        barrier = threading.Barrier(4, timeout=5)
+
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            barrier.wait()
+            return [{"date": "2025-01-01", "dateAsString": json_body["dateFrom"]}]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, max_workers=4)
+
+        with patch.object(lf.wr.s3, "to_parquet") as to_parquet_mock:
+            result = etl.process_table(
+                "allfunds_transactions_performance",
+                ["p1", "p2"],
+                ["20250101", "20250102"],
+            )
+
+        self.assertEqual(result["count"], 4)
+        self.assertEqual(result["failed"], {})
+        self.assertEqual(
+            result["processed"]["p1"],
+            [{"date": "20250101", "count": 1}, {"date": "20250102", "count": 1}],
+        )
+        # one write per date partition
+        self.assertEqual(to_parquet_mock.call_count, 2)
+
+    def test_failed_pairs_are_reported_per_portfolio(self):
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            if (
+                json_body["portfolioIds"] == ["p2"]
+                and json_body["dateFrom"] == "20250102"
+            ):
+                raise RuntimeError("downstream error")
+            return []
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, max_workers=3)
+
+        with patch.object(lf.wr.s3, "to_parquet"):
+            result = etl.process_table(
+                "allfunds_transactions_performance",
+                ["p1", "p2"],
+                ["20250101", "20250102"],
+            )
+
+        self.assertEqual(
+            result["failed"],
+            {"p2": [{"date": "20250102", "error": "downstream error"}]},
+        )
+        self.assertEqual([d["date"] for d in result["processed"]["p2"]], ["20250101"])
+        self.assertEqual(len(result["processed"]["p1"]), 2)
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = lf.RateLimiter(rate=50)
+        with patch.object(lf.time, "monotonic", return_value=100.0), patch.object(
+            lf.time, "sleep"
+        ) as sleep_mock:
+            for _ in range(6):
+                limiter.wait()
+
+        # six calls at the same instant: the first goes through, the others wait
+        # for their 20ms slot
+        delays = [c.args[0] for c in sleep_mock.call_args_list]
+        self.assertEqual(len(delays), 5)
+        for delay, expected in zip(delays, [0.02, 0.04, 0.06, 0.08, 0.1]):
+            self.assertAlmostEqual(delay, expected)
+
+    def test_rate_limiter_disabled_without_rate(self):
+        limiter = lf.RateLimiter(None)
+        with patch.object(lf.time, "sleep") as sleep_mock:
+            limiter.wait()
+        sleep_mock.assert_not_called()
+
+
+class TestBatchedRequests(unittest.TestCase):
+    def test_batches_are_split_by_portfolio(self):
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            return [
+                {"portfolioId": pid, "date": "2025-01-01", "dateAsString": "20250101"}
+                for pid in json_body["portfolioIds"]
+            ]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, batch_size=2)
+
+        with patch.object(lf.wr.s3, "to_parquet") as to_parquet_mock:
+            result = etl.process_table(
+                "allfunds_transactions_open_positions", ["p1", "p2", "p3"], ["20250101"]
+            )
+
+        # two requests for three portfolios
+        self.assertEqual(client.post.call_count, 2)
+        self.assertEqual(
+            client.post.call_args_list[0].kwargs["json_body"]["portfolioIds"],
+            ["p1", "p2"],
+        )
+        self.assertEqual(result["count"], 3)
+        self.assertEqual(set(result["processed"]), {"p1", "p2", "p3"})
+        df = to_parquet_mock.call_args.kwargs["df"]
+        self.assertEqual(list(df["portfolio_id"]), ["p1", "p2", "p3"])
+
+    def test_failed_batch_falls_back_to_single_portfolios(self):
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            portfolio_ids = json_body["portfolioIds"]
+            if len(portfolio_ids) > 1 or portfolio_ids == ["p2"]:
+                raise RuntimeError("bad portfolio")
+            return [{"date": "2025-01-01", "dateAsString": "20250101"}]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, batch_size=3)
+
+        with patch.object(lf.wr.s3, "to_parquet"):
+            result = etl.process_table(
+                "allfunds_transactions_performance", ["p1", "p2", "p3"], ["20250101"]
+            )
+
+        # one batch request, then one request per portfolio
+        self.assertEqual(client.post.call_count, 4)
+        self.assertEqual(set(result["processed"]), {"p1", "p3"})
+        self.assertEqual(
+            result["failed"], {"p2": [{"date": "20250101", "error": "bad portfolio"}]}
+        )
+
+    def test_unattributable_records_fall_back(self):
+        with self.assertRaises(lf.UnattributedRecordsError):
+            lf.AllFundsETL.split_by_portfolio([{"portfolioId": "p9"}], ["p1", "p2"])
+
+    def test_consolidated_response_turns_batching_off(self):
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            # no 'portfolioId' on the records of a batched request
+            return [{"date": "2025-01-01", "dateAsString": "20250101"}]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, batch_size=2)
+
+        with patch.object(lf.wr.s3, "to_parquet"), patch.object(
+            etl.logger, "warning"
+        ) as warning_mock:
+            result = etl.process_table(
+                "allfunds_transactions_performance",
+                ["p1", "p2", "p3", "p4"],
+                ["20250101"],
+            )
+
+        # one batch request, then single requests only: no retry per batch
+        self.assertEqual(client.post.call_count, 5)
+        self.assertEqual(warning_mock.call_count, 1)
+        self.assertFalse(etl.batching)
+        self.assertEqual(result["count"], 4)
+        self.assertEqual(result["failed"], {})
+
+
+class TestPerformanceDateRange(unittest.TestCase):
+    dates = ["20250101", "20250102", "20250103"]
+
+    def test_one_request_per_batch_for_the_whole_window(self):
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            return [
+                {"portfolioId": pid, "date": "2025-01-01", "dateAsString": day}
+                for pid in json_body["portfolioIds"]
+                for day in ["20241231"] + self.dates
+            ]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, batch_size=2, performance_date_range=True)
+
+        with patch.object(lf.wr.s3, "to_parquet") as to_parquet_mock:
+            result = etl.process_table(
+                "allfunds_transactions_performance", ["p1", "p2"], self.dates
+            )
+
+        client.post.assert_called_once()
+        body = client.post.call_args.kwargs["json_body"]
+        self.assertEqual((body["dateFrom"], body["dateTo"]), ("20250101", "20250103"))
+        # the day before the window is dropped
+        self.assertEqual(result["count"], 6)
+        self.assertEqual(
+            result["processed"]["p2"],
+            [{"date": day, "count": 1} for day in self.dates],
+        )
+        df = to_parquet_mock.call_args.kwargs["df"]
+        self.assertEqual(sorted(df["date"].unique()), self.dates)
+
+    def test_failed_window_fails_every_date(self):
+        client = MagicMock()
+        client.post.side_effect = RuntimeError("downstream error")
+        etl = _make_etl(client, performance_date_range=True)
+
+        with patch.object(lf.wr.s3, "to_parquet"):
+            result = etl.process_table(
+                "allfunds_transactions_performance", ["p1"], self.dates
+            )
+
+        self.assertEqual([f["date"] for f in result["failed"]["p1"]], self.dates)
+
+    def test_open_positions_keep_daily_requests(self):
+        client = MagicMock()
+        client.post.return_value = []
+        etl = _make_etl(client, performance_date_range=True)
+
+        with patch.object(lf.wr.s3, "to_parquet"):
+            etl.process_table(
+                "allfunds_transactions_open_positions", ["p1"], self.dates
+            )
+
+        self.assertEqual(client.post.call_count, 3)
+
+
+class TestStreamingWriter(unittest.TestCase):
+    dates = ["20250101", "20250102"]
+
+    @staticmethod
+    def _client():
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            return [
+                {"date": "2025-01-01", "dateAsString": json_body["date"], "n": i}
+                for i in range(3)
+            ]
+
+        client = MagicMock()
+        client.post.side_effect = post_side_effect
+        return client
+
+    def test_flushes_every_n_records(self):
+        etl = _make_etl(self._client(), flush_records=5)
+
+        with patch.object(lf.wr.s3, "to_parquet") as to_parquet_mock:
+            result = etl.process_table(
+                "allfunds_transactions_open_positions", ["p1", "p2", "p3"], self.dates
+            )
+
+        sizes = [len(c.kwargs["df"]) for c in to_parquet_mock.call_args_list]
+        # a flush once 5 rows are buffered, and at the end of each date partition
+        self.assertEqual(sizes, [6, 3, 6, 3])
+        self.assertEqual(result["count"], 18)
+
+    def test_failed_write_only_fails_its_pairs(self):
+        etl = _make_etl(self._client())
+
+        def to_parquet(df=None, **kwargs):
+            if set(df["date"]) == {"20250102"}:
+                raise IOError("s3 down")
+
+        with patch.object(lf.wr.s3, "to_parquet", side_effect=to_parquet):
+            result = etl.process_table(
+                "allfunds_transactions_open_positions", ["p1"], self.dates
+            )
+
+        self.assertEqual(
+            result["processed"], {"p1": [{"date": "20250101", "count": 3}]}
+        )
+        self.assertEqual(result["failed"]["p1"][0]["date"], "20250102")
+        self.assertIn("s3 down", result["failed"]["p1"][0]["error"])
+        self.assertEqual(result["count"], 3)
+
+    def test_committed_pairs_are_persisted_after_each_flush(self):
+        etl = _make_etl(self._client(), state_path="s3://state/allfunds/")
+        s3_mock = MagicMock()
+
+        with patch.object(lf.wr.s3, "to_parquet"), patch.object(
+            lf.boto3, "client", return_value=s3_mock
+        ), patch.object(etl, "read_committed", return_value={}):
+            etl.process_table(
+                "allfunds_transactions_open_positions",
+                ["p1"],
+                self.dates,
+                resume=True,
+            )
+
+        self.assertEqual(s3_mock.put_object.call_count, 2)
+        last = s3_mock.put_object.call_args.kwargs
+        self.assertEqual(
+            last["Key"],
+            "allfunds/allfunds_transactions_open_positions/20250101_20250102.json",
+        )
+        self.assertEqual(json.loads(last["Body"])["committed"], {"p1": self.dates})
+
+    def test_pairs_with_dropped_records_fail_and_are_not_committed(self):
+        client = self._client()
+        post = client.post.side_effect
+
+        def post_side_effect(endpoint=None, json_body=None, **kwargs):
+            records = post(endpoint=endpoint, json_body=json_body, **kwargs)
+            if json_body["date"] == "20250102":
+                del records[0]["dateAsString"]
+            return records
+
+        client.post.side_effect = post_side_effect
+        etl = _make_etl(client, state_path="s3://state/allfunds/")
+        s3_mock = MagicMock()
+
+        with patch.object(lf.wr.s3, "to_parquet") as to_parquet_mock, patch.object(
+            lf.boto3, "client", return_value=s3_mock
+        ), patch.object(etl, "read_committed", return_value={}), self.assertLogs(
+            lf.logger, level="WARNING"
+        ):
+            result = etl.process_table(
+                "allfunds_transactions_open_positions",
+                ["p1"],
+                self.dates,
+                resume=True,
+            )
+
+        to_parquet_mock.assert_called_once()
+        self.assertEqual(
+            result["processed"], {"p1": [{"date": "20250101", "count": 3}]}
+        )
+        self.assertEqual(
+            result["failed"],
+            {"p1": [{"date": "20250102", "error": "records without dateAsString"}]},
+        )
+        self.assertEqual(result["count"], 3)
+        last = s3_mock.put_object.call_args.kwargs
+        self.assertEqual(json.loads(last["Body"])["committed"], {"p1": ["20250101"]})
+
+    def test_committed_pairs_are_not_persisted_without_resume(self):
+        etl = _make_etl(self._client(), state_path="s3://state/allfunds/")
+        s3_mock = MagicMock()
+
+        with patch.object(lf.wr.s3, "to_parquet"), patch.object(
+            lf.boto3, "client", return_value=s3_mock
+        ):
+            etl.process_table(
+                "allfunds_transactions_open_positions", ["p1"], self.dates
+            )
+
+        s3_mock.put_object.assert_not_called()
+
+    def test_failed_manifest_write_does_not_fail_the_run(self):
+        etl = _make_etl(self._client(), state_path="s3://state/allfunds/")
+        s3_mock = MagicMock()
+        s3_mock.put_object.side_effect = IOError("s3 down")
+
+        with patch.object(lf.wr.s3, "to_parquet"), patch.object(
+            lf.boto3, "client", return_value=s3_mock
+        ), patch.object(etl, "read_committed", return_value={}):
+            result = etl.process_table(
+                "allfunds_transactions_open_positions",
+                ["p1"],
+                self.dates,
+                resume=True,
+            )
+
+        self.assertEqual(s3_mock.put_object.call_count, 2)
+        self.assertEqual(result["count"], 6)
+        self.assertEqual(result["failed"], {})
+
+    def test_resume_fetches_only_uncommitted_pairs(self):
+        client = self._client()
+        etl = _make_etl(client, state_path="s3://state/allfunds/")
+        committed = {"p1": {"20250101", "20250102"}, "p2": {"20250101"}}
+
+        with patch.object(lf.wr.s3, "to_parquet"), patch.object(
+            etl, "read_committed", return_value=committed
+        ), patch.object(etl, "write_committed"):
+            result = etl.process_table(
+                "allfunds_transactions_open_positions",
+                ["p1", "p2"],
+                self.dates,
+                resume=True,
+            )
+
+        bodies = [c.kwargs["json_body"] for c in client.post.call_args_list]
+        self.assertEqual(
+            [(b["portfolioIds"], b["date"]) for b in bodies], [(["p2"], "20250102")]
+        )
+        self.assertEqual(
+            result["processed"], {"p2": [{"date": "20250102", "count": 3}]}
+        )
+
+
+class TestNormalizeFrame(unittest.TestCase):
+    @staticmethod
+    def _records(n):
+        return [
+            {"date": "2025-01-01", "dateAsString": "20250101", "n": i} for i in range(n)
+        ]
+
+    def test_dates_are_swapped_and_metadata_added(self):
+        df, dropped = lf.AllFundsETL.normalize_frame(
+            pd.DataFrame(self._records(3)), ["p1", "p1", "p2"]
+        )
+
+        self.assertEqual(
+            list(df.columns),
+            ["date", "dateAsString", "n", "timestamp_extracted", "portfolio_id"],
+        )
+        self.assertEqual(set(df["date"]), {"20250101"})
+        self.assertEqual(set(df["dateAsString"]), {"2025-01-01"})
+        self.assertEqual(list(df["portfolio_id"]), ["p1", "p1", "p2"])
+        # one timestamp for the whole frame
+        self.assertEqual(df["timestamp_extracted"].nunique(), 1)
+        self.assertEqual(dropped, [])
+
+    def test_empty_frame_is_left_untouched(self):
+        df, dropped = lf.AllFundsETL.normalize_frame(pd.DataFrame([]), [])
+        self.assertTrue(df.empty)
+        self.assertEqual(dropped, [])
+
+    def test_writer_attributes_rows_to_their_portfolio(self):
+        saved = []
+        writer = lf.StreamingTableWriter(
+            saved.append, 100, normalize=lf.AllFundsETL.normalize_frame
+        )
+        writer.add("p1", "20250101", self._records(2))
+        writer.add("p2", "20250101", [])
+        writer.add("p3", "20250101", self._records(1))
+        committed, rejected = writer.flush()
+
+        self.assertEqual(list(saved[0]["portfolio_id"]), ["p1", "p1", "p3"])
+        self.assertEqual(len(committed), 3)
+        self.assertEqual(rejected, [])
+
+    def test_writer_rejects_pairs_with_dropped_records(self):
+        saved = []
+        writer = lf.StreamingTableWriter(
+            saved.append, 100, normalize=lf.AllFundsETL.normalize_frame
+        )
+        records = self._records(2)
+        del records[1]["dateAsString"]
+        writer.add("p1", "20250101", self._records(1))
+        writer.add("p2", "20250101", records)
+
+        with self.assertLogs(lf.logger, level="WARNING"):
+            committed, rejected = writer.flush()
+
+        # the valid record of p2 is not written either
+        self.assertEqual(list(saved[0]["portfolio_id"]), ["p1"])
+        self.assertEqual(committed, [("p1", "20250101")])
+        self.assertEqual(rejected, [("p2", "20250101")])
+        self.assertEqual(writer.committed, [("p1", "20250101")])
+
+    def test_records_without_date_as_string_are_dropped(self):
+        records = self._records(3)
+        del records[1]["dateAsString"]
+
+        with self.assertLogs(lf.logger, level="WARNING") as logs:
+            df, dropped = lf.AllFundsETL.normalize_frame(
+                pd.DataFrame(records), ["p1", "p2", "p3"]
+            )
+
+        self.assertEqual(list(df["portfolio_id"]), ["p1", "p3"])
+        self.assertEqual(list(df["n"]), [0, 2])
+        self.assertEqual(dropped, ["p2"])
+        self.assertIn("['p2']", logs.output[0])
+
+    def test_frame_without_date_as_string_column_is_dropped(self):
+        records = [{"date": "2025-01-01", "n": 0}]
+
+        with self.assertLogs(lf.logger, level="WARNING"):
+            df, dropped = lf.AllFundsETL.normalize_frame(pd.DataFrame(records), ["p1"])
+
+        self.assertTrue(df.empty)
+        self.assertEqual(dropped, ["p1"])
+
+    def test_matches_per_record_normalization_with_one_clock_call(self):
+        # the per-row dict copy and clock call this replaced
+        def per_record(records, portfolio_id):
+            rows = []
+            for obj in records:
+                rec = dict(obj)
+                rec["timestamp_extracted"] = lf.datetime.now(lf.timezone.utc)
+                rec["portfolio_id"] = portfolio_id
+                rec["date"] = rec["dateAsString"]
+                rec["dateAsString"] = obj["date"]
+                rows.append(rec)
+            return pd.DataFrame(rows)
+
+        def columnar(records, portfolio_id):
+            return lf.AllFundsETL.normalize_frame(
+                pd.DataFrame(records), [portfolio_id] * len(records)
+            )[0]
+
+        records = self._records(1000)
+        with patch.object(lf, "datetime", wraps=lf.datetime) as clock:
+            expected = per_record(records, "p1")
+            self.assertEqual(clock.now.call_count, len(records))
+            clock.now.reset_mock()
+            actual = columnar(records, "p1")
+            self.assertEqual(clock.now.call_count, 1)
+
+        pd.testing.assert_frame_equal(
+            actual.drop(columns="timestamp_extracted"),
+            expected.drop(columns="timestamp_extracted"),
+        )
+
+
 # Allow running tests directly
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,13 +1,37 @@
 import logging
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import Optional
 import awswrangler as wr
-import pandas as pd
 import boto3
 from awsglue.utils import getResolvedOptions
 import ijson
 
+# Case1: Execution inside AWS Glue (the common modules are shipped with --extra-py-files)
+if "--JOB_NAME" in sys.argv:
+    from imal_utils import (
+        StagedParquetWriter,
+        append_to_buffers,
+        apply_schema_registry,
+        buffers_to_frame,
+        get_registered_schema,
+        get_schema,
+    )
+    from s3_utils import list_s3_keys_concurrently
+
+# Case2: Local or test execution
+else:
+    from src.common.imal_utils import (
+        StagedParquetWriter,
+        append_to_buffers,
+        apply_schema_registry,
+        buffers_to_frame,
+        get_registered_schema,
+        get_schema,
+    )
+    from src.common.s3_utils import list_s3_keys_concurrently
+
 
 def setup_logger(
     name: Optional[str] = None,
@@ -48,59 +72,13 @@ def setup_logger(
 
 logger = setup_logger("imal-reporting-to-s3-raw")
 
-
-def is_date_column(series):
-    for item in series.dropna().unique():
-        try:
-            parsed_date = pd.to_datetime(str(item))
-            if parsed_date.time() != pd.Timestamp(0).time():
-                return False
-        except ValueError:
-            return False
-    return True
-
-
-def get_schema(df, date_string: str):
-    """
-    Accepts a Pandas Dataframe, casts each column to correct datatype, and produces
-    the Athena schema for each column in a dict.
-    :param df: The Pandas Dataframe
-    :return: The athena schema and new pandas dataframe
-    """
-    df = df.rename(columns=str.lower)
-    dtype_mapping = {
-        "int64": "int",
-        "int32": "int",
-        "float64": "double",
-        "float32": "double",
-        "bool": "boolean",
-        "object": "string",
-        "datetime64": "timestamp",
-        "timedelta": "string",
-        "category": "string",
-    }
-    athena_schema = {}
-    for col in df.columns:
-        dtype = str(df[col].dtype)
-        if dtype == "object" and is_date_column(df[col]):
-            athena_schema[col] = "date"
-        elif dtype.startswith("datetime64") or dtype.startswith("timedelta"):
-            dtype = dtype.split("[")[0]
-            athena_schema[col] = dtype_mapping.get(dtype, "string")
-        else:
-            mapped_dtype = dtype_mapping.get(dtype, "string")
-            athena_schema[col] = mapped_dtype
-    for col in df.columns:
-        if athena_schema[col] in ("date", "timestamp"):
-            df[col] = pd.to_datetime(df[col], dayfirst=True)
-    logger.info("Finished setting up schema.")
-    df["date"] = date_string
-    athena_schema["date"] = "date"
-
-    df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    athena_schema["timestamp_extracted"] = "timestamp"
-
-    return athena_schema, df
+# Prefer the C (yajl2) ijson backend, it parses several times faster than the
+# pure Python one that ijson silently falls back to.
+try:
+    ijson_backend = ijson.get_backend("yajl2_c")
+except ImportError:
+    logger.warning("ijson yajl2_c backend not available, using %s", ijson.backend)
+    ijson_backend = ijson
 
 
 def write_to_s3(
@@ -144,14 +122,33 @@ def write_to_s3(
 
 
 def process_chunk(
-    chunk_df, date_string, athena_table, partition_columns, s3_bucket, write_mode
+    chunk_df,
+    date_string,
+    athena_table,
+    partition_columns,
+    s3_bucket,
+    write_mode,
+    known_schema: Optional[dict] = None,
+    writer: Optional[StagedParquetWriter] = None,
 ):
     """
     Function to process each chunk and write to S3.
+    When known_schema (the table's registered schema) is given, registered
+    columns are cast to their registered type and the registry is evolved
+    with newly seen columns.
+    When writer is given, the chunk is staged instead of written directly.
     """
     logger.info(f"Processing chunk with shape: {chunk_df.shape}")
-    athena_schema, chunk_df = get_schema(chunk_df, date_string)
-    write_to_s3(
+    athena_schema, chunk_df = get_schema(
+        chunk_df, date_string, known_schema, athena_table
+    )
+    if known_schema is not None:
+        athena_schema, chunk_df = apply_schema_registry(
+            chunk_df, athena_schema, known_schema, athena_table
+        )
+    if writer is not None:
+        return writer.write(chunk_df, athena_schema)
+    return write_to_s3(
         chunk_df, athena_table, athena_schema, partition_columns, s3_bucket, write_mode
     )
 
@@ -163,6 +160,7 @@ def load_json_in_chunks(
     s3_bucket,
     date_string,
     chunk_size,
+    staged_write=False,
 ):
     """
     Stream and process a large JSON file from S3 in chunks using ijson.
@@ -172,12 +170,21 @@ def load_json_in_chunks(
     :param s3_bucket: S3 bucket to write data
     :param date_string: String of the day related to the chunk being processed
     :param chunk_size: Number of records per chunk to process
+    :param staged_write: Write all chunks into a few files and update the catalog once
+    :return: Number of records loaded, or None if the file failed to load
     """
     s3_client = boto3.client("s3")
 
     # Initialize required local vars
     bucket_name, key_name = abs_path.replace("s3://", "").split("/", 1)
     write_mode = "append"
+    records = 0
+    failed_chunks = 0
+    writer = (
+        StagedParquetWriter(s3_bucket, athena_table, date_string)
+        if staged_write
+        else None
+    )
 
     logger.info(f"Starting to stream and process file: {abs_path}")
 
@@ -186,45 +193,233 @@ def load_json_in_chunks(
         response = s3_client.get_object(Bucket=bucket_name, Key=key_name)
         content = response["Body"]
 
-        # Stream over the JSON items
-        chunk = []
-        parser = ijson.items(content, "item")
+        # Stream over the JSON items into column buffers
+        buffers = {}
+        row_count = 0
+        arrow_schema = None
+        known_schema = get_registered_schema(athena_table)
+        parser = ijson_backend.items(content, "item", use_float=True)
 
         for item in parser:
             # Loading item per item untill reaching the chuck size
-            chunk.append(item)
-            if len(chunk) >= chunk_size:
+            append_to_buffers(buffers, item, row_count)
+            row_count += 1
+            if row_count >= chunk_size:
                 # Convert the chunk to a DataFrame
-                chunk_df = pd.DataFrame(chunk)
-                process_chunk(
+                chunk_df, arrow_schema = buffers_to_frame(buffers, arrow_schema)
+                if not process_chunk(
                     chunk_df,
                     date_string,
                     athena_table,
                     partition_columns,
                     s3_bucket,
                     write_mode,
-                )
-                # Clear the chunk after processing
-                chunk.clear()
+                    known_schema,
+                    writer,
+                ):
+                    failed_chunks += 1
+                records += row_count
+                # Clear the buffers after processing, keeping the column lists
+                del chunk_df
+                for column in buffers.values():
+                    column.clear()
+                row_count = 0
                 # Change the write mode for the next chuncks
                 write_mode = "append"
 
         # Process any remaining records in the last chunk
-        if chunk:
-            chunk_df = pd.DataFrame(chunk)
-            process_chunk(
+        if row_count:
+            chunk_df, arrow_schema = buffers_to_frame(buffers, arrow_schema)
+            if not process_chunk(
                 chunk_df,
                 date_string,
                 athena_table,
                 partition_columns,
                 s3_bucket,
                 write_mode,
+                known_schema,
+                writer,
+            ):
+                failed_chunks += 1
+            records += row_count
+
+        if failed_chunks:
+            logger.error(
+                f"{failed_chunks} chunk(s) failed to write for file: {abs_path}"
             )
+            if writer is not None:
+                writer.abort()
+            return None
+
+        if writer is not None and not writer.commit():
+            return None
 
         logger.info(f"Finished processing file: {abs_path}")
+        return records
 
     except Exception as e:
         logger.error(f"Error while streaming and processing JSON from {abs_path}: {e}")
+        if writer is not None:
+            writer.abort()
+        return None
+
+
+# Backfills spanning at least this many days list each report prefix once and
+# filter the dates in memory, rather than listing one prefix per day
+PREFIX_LISTING_MIN_DAYS = 31
+
+
+def list_imal_objects(bucket_name, valid_files, start_date, end_date, s3_client=None):
+    """
+    Lists the JSON files of the given reports dated between start_date and
+    end_date. Short ranges list one prefix per report and day, longer ones list
+    each report prefix once and filter the dates in memory; either way the
+    listings are paginated and run concurrently.
+    :param bucket_name: Landing bucket to list
+    :param valid_files: Report names, e.g. CardTransactions
+    :param start_date: First day to load (datetime)
+    :param end_date: Last day to load (datetime)
+    :return: List of S3 keys, per report in date order
+    """
+    days = [
+        (start_date + timedelta(days=i)).strftime("%Y%m%d")
+        for i in range((end_date - start_date).days + 1)
+    ]
+    wanted = {
+        f"imal_reporting/{file_prefix}_{day}"
+        for file_prefix in valid_files
+        for day in days
+    }
+
+    def key_filter(key):
+        # Keys look like imal_reporting/<Report>_<YYYYMMDD>....json
+        report, _, rest = key.rsplit("/", 1)[-1].partition("_")
+        report_day = f"imal_reporting/{report}_{rest[:8]}"
+        return (
+            key.endswith(".json")
+            and report_day in wanted
+            and key.startswith(report_day)
+        )
+
+    if len(days) >= PREFIX_LISTING_MIN_DAYS:
+        prefixes = [f"imal_reporting/{file_prefix}_" for file_prefix in valid_files]
+    else:
+        prefixes = [
+            f"imal_reporting/{file_prefix}_{day}"
+            for file_prefix in valid_files
+            for day in days
+        ]
+
+    return list_s3_keys_concurrently(
+        bucket_name, prefixes, s3_client=s3_client, key_filter=key_filter
+    )
+
+
+def build_load_plan(objects_key, bucket_name):
+    """
+    Groups the listed JSON objects by their target Athena table, keeping the
+    listing order (oldest day first) inside each table.
+    :param objects_key: List of S3 keys to load
+    :param bucket_name: Landing bucket holding the keys
+    :return: Dict of target table -> list of (abs_path, date_string)
+    """
+    plan = {}
+    for object_key in objects_key:
+        filename = object_key.split("/")[1]
+        abs_path = f"s3://{bucket_name}/{object_key}"
+        match = filename.split("_")[0]
+        date_string = filename.split("_")[1][:8]
+
+        # Define target table
+        target_athena_glue_table = f"imal_reporting_{match.lower()}"
+        plan.setdefault(target_athena_glue_table, []).append((abs_path, date_string))
+    return plan
+
+
+def load_table_files(athena_table, files, s3_bucket, chunk_size, staged_write=False):
+    """
+    Loads every file of one table in order. Runs inside a worker process, so
+    all writes (and Glue catalog updates) for a table stay sequential.
+    :param athena_table: Target Athena Glue table name
+    :param files: List of (abs_path, date_string) to load in order
+    :param s3_bucket: S3 bucket to write data
+    :param chunk_size: Number of records per chunk to process
+    :param staged_write: Write each file through a StagedParquetWriter
+    :return: Summary dict for the table
+    """
+    summary = {"table": athena_table, "loaded": [], "failed": [], "records": 0}
+    for abs_path, date_string in files:
+        logger.info(f"Start loading:{abs_path}")
+        records = load_json_in_chunks(
+            abs_path,
+            athena_table,
+            ["date"],
+            s3_bucket,
+            date_string,
+            chunk_size=chunk_size,
+            staged_write=staged_write,
+        )
+        if records is None:
+            summary["failed"].append(abs_path)
+        else:
+            summary["loaded"].append(abs_path)
+            summary["records"] += records
+    logger.info("Finished writing to: %s", athena_table)
+    return summary
+
+
+def run_load_plan(plan, s3_bucket, max_workers, chunk_size=1000000, staged_write=False):
+    """
+    Loads the tables of a load plan in parallel with a bounded process pool.
+    Tables are loaded concurrently; files of the same table are never.
+    :param plan: Dict of target table -> list of (abs_path, date_string)
+    :param s3_bucket: S3 bucket to write data
+    :param max_workers: Maximum number of worker processes
+    :param chunk_size: Number of records per chunk to process
+    :param staged_write: Write each file through a StagedParquetWriter
+    :return: Combined summary across all tables
+    """
+    total_files = sum(len(files) for files in plan.values())
+    combined = {"tables": {}, "loaded": 0, "failed": [], "records": 0}
+    if not plan:
+        return combined
+
+    workers = max(1, min(max_workers, len(plan)))
+    logger.info(
+        f"Loading {total_files} file(s) over {len(plan)} table(s) with {workers} worker(s)"
+    )
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                load_table_files, table, files, s3_bucket, chunk_size, staged_write
+            ): table
+            for table, files in plan.items()
+        }
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Worker failed while loading {table}: {e}")
+                summary = {
+                    "table": table,
+                    "loaded": [],
+                    "failed": [abs_path for abs_path, _ in plan[table]],
+                    "records": 0,
+                }
+
+            combined["tables"][table] = summary
+            combined["loaded"] += len(summary["loaded"])
+            combined["failed"].extend(summary["failed"])
+            combined["records"] += summary["records"]
+            logger.info(
+                f"[{combined['loaded'] + len(combined['failed'])}/{total_files} files] "
+                f"{table}: {len(summary['loaded'])} loaded, {len(summary['failed'])} failed, "
+                f"{summary['records']} records"
+            )
+
+    return combined
 
 
 def main():
@@ -232,13 +427,23 @@ def main():
     # Step1: Initialize global vars
     args = getResolvedOptions(
         sys.argv,
-        ["S3_RAW", "bucket_name", "backfill", "start_date", "end_date", "valid_files"],
+        [
+            "S3_RAW",
+            "bucket_name",
+            "backfill",
+            "start_date",
+            "end_date",
+            "valid_files",
+            "max_workers",
+            "staged_write",
+        ],
     )
     s3_raw = args["S3_RAW"]
     bucket_name = args["bucket_name"]
     backfill = args["backfill"].lower() == "true"
     valid_files = args["valid_files"].split(",")
-    objects_key = []
+    max_workers = int(args["max_workers"])
+    staged_write = args["staged_write"].lower() == "true"
     if backfill:
         start_date = args["start_date"]
         end_date = args["end_date"]
@@ -255,50 +460,21 @@ def main():
         logger.info(f"Daily mode is ON. Start date:{today_str}, End date:{today_str}")
 
     # Step2: Listing target json files to load
-    for file_prefix in valid_files:
-        cur = start_date
-        prefix = f"imal_reporting/{file_prefix}_"
-        s3_client = boto3.client("s3")
-        while cur <= end_date:
-            res = s3_client.list_objects_v2(
-                Bucket=bucket_name, Prefix=prefix + cur.strftime("%Y%m%d")
-            )
-            if "Contents" in res:
-                for item in res["Contents"]:
-                    key = item["Key"]
-                    if (
-                        key.endswith(".json")
-                        and f'{prefix}{cur.strftime("%Y%m%d")}' in key
-                    ):
-                        objects_key.append(key)
-            cur += timedelta(days=1)
-
-    # Step3: Looping over each json file to load to s3_raw
-    logger.info(f"Loading backlog:{objects_key}")
-    for object_key in objects_key:
-        logger.info(f"Start loading:{object_key}")
-        filename = object_key.split("/")[1]
-        abs_path = f"s3://{bucket_name}/{object_key}"
-
-        match = filename.split("_")[0]
-        logger.info(f"filename: {filename}")
-        date_string = filename.split("_")[1][:8]
-        logger.info(f"s3-path: {abs_path}")
+    objects_key = list_imal_objects(bucket_name, valid_files, start_date, end_date)
 
-        # Define target table and partition columns
-        target_athena_glue_table = f"imal_reporting_{match.lower()}"
-        partition_columns = ["date"]
-
-        load_json_in_chunks(
-            abs_path,
-            target_athena_glue_table,
-            partition_columns,
-            s3_raw,
-            date_string,
-            chunk_size=1000000,
-        )
+    # Step3: Loading the json files to s3_raw, one worker per table at a time
+    logger.info(f"Loading backlog:{objects_key}")
+    plan = build_load_plan(objects_key, bucket_name)
+    summary = run_load_plan(
+        plan, s3_raw, max_workers, chunk_size=1000000, staged_write=staged_write
+    )
 
-        logger.info("Finished writing to: %s", target_athena_glue_table)
+    logger.info(
+        f"Load summary: {summary['loaded']} file(s) loaded, "
+        f"{len(summary['failed'])} failed, {summary['records']} records"
+    )
+    if summary["failed"]:
+        raise RuntimeError(f"Failed loading: {summary['failed']}")
 
     logger.info(f"[Success]: finishied loading: {objects_key}")
 
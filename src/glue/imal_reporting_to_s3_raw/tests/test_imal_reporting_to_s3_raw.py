@@ -0,0 +1,275 @@
+import sys
+import types
+
+# Mock awsglue.utils import getResolvedOptions
+if "awsglue" not in sys.modules:
+    awsglue_mod = types.ModuleType("awsglue")
+    awsglue_utils = types.ModuleType("awsglue.utils")
+
+    def _getResolvedOptions(argv, *names):
+        return {}
+
+    awsglue_utils.getResolvedOptions = _getResolvedOptions
+
+    sys.modules["awsglue"] = awsglue_mod
+    sys.modules["awsglue.utils"] = awsglue_utils
+
+# -----------------------
+# Import target module
+# -----------------------
+import os
+import importlib.util
+
+_THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# project root on sys.path so the "src.common" fallback import works
+_PROJECT_ROOT = os.path.abspath(os.path.join(_THIS_DIR, *[os.pardir] * 4))
+if _PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, _PROJECT_ROOT)
+_MODULE_PATH = os.path.join(_THIS_DIR, os.pardir, "imal_reporting_to_s3_raw.py")
+
+spec = importlib.util.spec_from_file_location("imal_glue_under_test", _MODULE_PATH)
+lf = importlib.util.module_from_spec(spec)
+assert spec.loader is not None
+spec.loader.exec_module(lf)
+sys.modules[lf.__name__] = lf
+
+################################################################
+# -----------------------
+# Unit tests
+# -----------------------
+################################################################
+import io
+import json
+import unittest
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.common import imal_utils
+
+
+def _s3_body(records):
+    return {"Body": io.BytesIO(json.dumps(records).encode())}
+
+
+class TestLoadPlan(unittest.TestCase):
+    def test_build_load_plan_groups_by_table_in_order(self):
+        keys = [
+            "imal_reporting/Cashback_20240101.json",
+            "imal_reporting/ArrearsDays_20240101.json",
+            "imal_reporting/Cashback_20240102.json",
+        ]
+        plan = lf.build_load_plan(keys, "landing")
+
+        self.assertEqual(
+            plan["imal_reporting_cashback"],
+            [
+                ("s3://landing/imal_reporting/Cashback_20240101.json", "20240101"),
+                ("s3://landing/imal_reporting/Cashback_20240102.json", "20240102"),
+            ],
+        )
+        self.assertEqual(len(plan["imal_reporting_arrearsdays"]), 1)
+
+    def test_run_load_plan_combines_summaries(self):
+        plan = {
+            "imal_reporting_cashback": [("s3://landing/a.json", "20240101")],
+            "imal_reporting_arrearsdays": [("s3://landing/b.json", "20240101")],
+        }
+
+        def fake_load(abs_path, *args, **kwargs):
+            return None if abs_path.endswith("b.json") else 3
+
+        with patch.object(lf, "ProcessPoolExecutor", ThreadPoolExecutor), patch.object(
+            lf, "load_json_in_chunks", side_effect=fake_load
+        ):
+            summary = lf.run_load_plan(plan, "raw", max_workers=4)
+
+        self.assertEqual(summary["loaded"], 1)
+        self.assertEqual(summary["records"], 3)
+        self.assertEqual(summary["failed"], ["s3://landing/b.json"])
+        self.assertEqual(set(summary["tables"]), set(plan))
+
+
+class TestListImalObjects(unittest.TestCase):
+    def _s3_mock(self, keys):
+        mock_s3 = MagicMock()
+
+        def paginate(Bucket, Prefix):
+            return [
+                {"Contents": [{"Key": k} for k in sorted(keys) if k.startswith(Prefix)]}
+            ]
+
+        mock_s3.get_paginator.return_value.paginate.side_effect = paginate
+        return mock_s3
+
+    def test_short_range_lists_one_prefix_per_day(self):
+        keys = [
+            "imal_reporting/Cashback_20240101.json",
+            "imal_reporting/Cashback_20240102.json",
+            "imal_reporting/Cashback_20240102.csv",
+            "imal_reporting/Cashback_20240105.json",
+        ]
+        mock_s3 = self._s3_mock(keys)
+        result = lf.list_imal_objects(
+            "landing", ["Cashback"], datetime(2024, 1, 1), datetime(2024, 1, 3), mock_s3
+        )
+
+        self.assertEqual(result, keys[:2])
+        self.assertEqual(mock_s3.get_paginator.return_value.paginate.call_count, 3)
+
+    def test_long_range_lists_each_report_once(self):
+        keys = [
+            "imal_reporting/ArrearsDays_20231231.json",
+            "imal_reporting/ArrearsDays_20240110.json",
+            "imal_reporting/Cashback_20240301.json",
+            "imal_reporting/Cashback_20240601.json",
+        ]
+        mock_s3 = self._s3_mock(keys)
+        result = lf.list_imal_objects(
+            "landing",
+            ["Cashback", "ArrearsDays"],
+            datetime(2024, 1, 1),
+            datetime(2024, 3, 31),
+            mock_s3,
+        )
+
+        self.assertEqual(
+            result,
+            [
+                "imal_reporting/Cashback_20240301.json",
+                "imal_reporting/ArrearsDays_20240110.json",
+            ],
+        )
+        self.assertEqual(mock_s3.get_paginator.return_value.paginate.call_count, 2)
+
+
+class TestLoadJsonInChunks(unittest.TestCase):
+    def setUp(self):
+        imal_utils._schema_registry.clear()
+        patcher = patch.object(lf.wr.catalog, "get_table_types", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_returns_record_count(self):
+        records = [{"id": i, "amount": i * 10} for i in range(5)]
+        mock_s3 = MagicMock()
+        mock_s3.get_object.return_value = _s3_body(records)
+
+        with patch.object(lf.boto3, "client", return_value=mock_s3), patch.object(
+            lf, "write_to_s3", return_value=True
+        ) as write_mock:
+            result = lf.load_json_in_chunks(
+                "s3://landing/key.json", "t", ["date"], "raw", "20240101", chunk_size=2
+            )
+
+        self.assertEqual(result, 5)
+        self.assertEqual(write_mock.call_count, 3)
+        # the schema of the first chunk is reused for the following ones
+        first_schema = write_mock.call_args_list[0].args[2]
+        last_schema = write_mock.call_args_list[-1].args[2]
+        self.assertEqual(first_schema["amount"], "int")
+        self.assertEqual(last_schema, first_schema)
+
+    def test_infers_date_columns_once_per_file(self):
+        records = [{"opened": f"0{i}/01/2024"} for i in range(1, 5)]
+        mock_s3 = MagicMock()
+        mock_s3.get_object.return_value = _s3_body(records)
+
+        with patch.object(lf.boto3, "client", return_value=mock_s3), patch.object(
+            lf, "write_to_s3", return_value=True
+        ), patch.object(
+            imal_utils, "is_date_column", wraps=imal_utils.is_date_column
+        ) as date_mock:
+            lf.load_json_in_chunks(
+                "s3://landing/key.json", "t", ["date"], "raw", "20240101", chunk_size=2
+            )
+
+        self.assertEqual(date_mock.call_count, 1)
+
+    def test_non_date_value_in_later_chunk_does_not_fail_file(self):
+        opened = ["01/01/2024", "02/01/2024", "N/A", "03/01/2024"]
+        records = [{"opened": value} for value in opened]
+        mock_s3 = MagicMock()
+        mock_s3.get_object.return_value = _s3_body(records)
+
+        with patch.object(lf.boto3, "client", return_value=mock_s3), patch.object(
+            lf, "write_to_s3", return_value=True
+        ) as write_mock:
+            result = lf.load_json_in_chunks(
+                "s3://landing/key.json", "t", ["date"], "raw", "20240101", chunk_size=2
+            )
+
+        self.assertEqual(result, 4)
+        last_df, _, last_schema = write_mock.call_args_list[-1].args[:3]
+        self.assertEqual(last_schema["opened"], "date")
+        self.assertTrue(last_df["opened"].isna().iloc[0])
+
+    def test_staged_write_updates_catalog_once_per_file(self):
+        records = [{"id": i, "opened": "01/02/2024"} for i in range(5)]
+        mock_s3 = MagicMock()
+        mock_s3.get_object.return_value = _s3_body(records)
+        uploaded = []
+
+        def upload_file(local_path, bucket, key):
+            parquet_file = pq.ParquetFile(local_path)
+            uploaded.append(
+                (
+                    key,
+                    parquet_file.metadata.num_row_groups,
+                    parquet_file.schema_arrow.field("timestamp_extracted").type,
+                )
+            )
+
+        mock_s3.upload_file.side_effect = upload_file
+
+        with patch.object(lf.boto3, "client", return_value=mock_s3), patch.object(
+            lf, "write_to_s3"
+        ) as write_mock, patch.object(
+            lf.wr.catalog, "create_parquet_table"
+        ) as create_mock, patch.object(
+            lf.wr.catalog, "add_parquet_partitions"
+        ) as partitions_mock:
+            result = lf.load_json_in_chunks(
+                "s3://landing/key.json",
+                "t",
+                ["date"],
+                "raw",
+                "20240101",
+                chunk_size=2,
+                staged_write=True,
+            )
+
+        self.assertEqual(result, 5)
+        write_mock.assert_not_called()
+        # three small chunks end up as one row group of a single file
+        self.assertEqual(len(uploaded), 1)
+        self.assertTrue(uploaded[0][0].startswith("t/date=2024-01-01/"))
+        self.assertEqual(uploaded[0][1], 1)
+        self.assertEqual(uploaded[0][2], pa.timestamp("ms"))
+        create_mock.assert_called_once()
+        self.assertEqual(
+            create_mock.call_args.kwargs["columns_types"],
+            {"id": "int", "opened": "date", "timestamp_extracted": "timestamp"},
+        )
+        partitions_mock.assert_called_once()
+
+    def test_failed_write_marks_file_failed(self):
+        mock_s3 = MagicMock()
+        mock_s3.get_object.return_value = _s3_body([{"id": 1}])
+
+        with patch.object(lf.boto3, "client", return_value=mock_s3), patch.object(
+            lf, "write_to_s3", return_value=False
+        ):
+            result = lf.load_json_in_chunks(
+                "s3://landing/key.json", "t", ["date"], "raw", "20240101", chunk_size=2
+            )
+
+        self.assertIsNone(result)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,4 +1,7 @@
 import sys
+import json
+import boto3
+from botocore.exceptions import ClientError
 from awsglue.context import GlueContext
 from awsglue.job import Job
 from awsglue.utils import getResolvedOptions
@@ -11,38 +14,104 @@ glueContext = GlueContext(sc)
 spark = glueContext.spark_session
 logger = glueContext.get_logger()
 
-# SQL Query for Athena
-athena_query = """
-SELECT
-    customernumber,
-    country,
-    glcode,
-    description,
-    balancedate,
-    currentvalueamountbalance,
-    timestamp_extracted,
-    isocurrencycode,
-    foreigncurrencyamountbalance,
-    date
+DATABASE = "datalake_raw"
+
+# Tables deduplicated by this job. Rows sharing the same natural key are
+# collapsed to the latest one according to the order_by column.
+DEDUP_TABLES = {
+    "imal_reporting_currentaccountbalancebyday": {
+        "natural_keys": [
+            "customernumber",
+            "country",
+            "glcode",
+            "description",
+            "balancedate",
+            "currentvalueamountbalance",
+            "isocurrencycode",
+            "foreigncurrencyamountbalance",
+        ],
+        "order_by": "timestamp_extracted",
+    },
+}
+
+
+def build_dedup_query(table_name: str, natural_keys: list, order_by: str, dates: list = None) -> str:
+    """
+    Builds the ROW_NUMBER() dedup query for a table, keeping the latest row per
+    natural key inside each 'date' partition. When dates are given only those
+    partitions are read.
+    """
+    partition_by = ",\n                            ".join(natural_keys + ["date"])
+    where_clause = ""
+    if dates:
+        date_list = ", ".join(f"DATE '{d}'" for d in dates)
+        where_clause = f"\n    WHERE date IN ({date_list})"
+
+    return f"""
+SELECT *
 FROM (
     SELECT *,
            ROW_NUMBER() OVER (
-               PARTITION BY customernumber,
-                            country,
-                            glcode,
-                            description,
-                            balancedate,
-                            currentvalueamountbalance,
-                            isocurrencycode,
-                            foreigncurrencyamountbalance,
-                            date
-               ORDER BY timestamp_extracted DESC
+               PARTITION BY {partition_by}
+               ORDER BY {order_by} DESC
            ) AS row_num
-    FROM datalake_raw.imal_reporting_currentaccountbalancebyday
+    FROM {DATABASE}.{table_name}{where_clause}
 )
 WHERE row_num = 1
 """
 
+
+def read_watermark(state_path: str, table_name: str):
+    """
+    Reads the last processed order_by value for a table from the state path.
+    Returns None when the table has never been processed.
+    """
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/{table_name}.json"
+    try:
+        response = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+        return json.loads(response["Body"].read()).get("watermark")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            logger.info(f"No watermark found for {table_name}, running a full rebuild.")
+            return None
+        raise
+
+
+def write_watermark(state_path: str, table_name: str, watermark: str):
+    """
+    Persists the last processed order_by value for a table to the state path.
+    """
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/{table_name}.json"
+    boto3.client("s3").put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps({"table": table_name, "watermark": watermark}),
+    )
+    logger.info(f"Watermark for {table_name} set to {watermark}.")
+
+
+def get_touched_dates(table_name: str, order_by: str, watermark: str = None):
+    """
+    Returns the 'date' partitions holding rows newer than the watermark, along
+    with the new watermark (the max order_by value seen).
+    """
+    where_clause = f"WHERE {order_by} > CAST('{watermark}' AS TIMESTAMP)" if watermark else ""
+    rows = spark.sql(
+        f"""
+        SELECT CAST(date AS STRING) AS date, CAST(MAX({order_by}) AS STRING) AS max_value
+        FROM {DATABASE}.{table_name}
+        {where_clause}
+        GROUP BY date
+        """
+    ).collect()
+
+    dates = sorted(row["date"] for row in rows if row["date"] is not None)
+    new_watermark = max((row["max_value"] for row in rows if row["max_value"]), default=watermark)
+    return dates, new_watermark
+
+
 # Function to Read Data from Athena
 def read_athena(sql: str) -> DataFrame:
     """
@@ -54,36 +123,60 @@ def read_athena(sql: str) -> DataFrame:
     logger.info("Successfully read data from Athena.")
     return df
 
+
+def estimate_size_bytes(df: DataFrame):
+    """
+    Estimates the size of a DataFrame from the optimized logical plan statistics.
+    For Parquet sources this is driven by the input file sizes, so no data is
+    scanned. Returns None when Spark has no real estimate for the plan.
+    """
+    try:
+        stats = df._jdf.queryExecution().optimizedPlan().stats()
+        size_bytes = int(stats.sizeInBytes().toString())
+    except Exception as e:
+        logger.warn(f"Could not read plan statistics: {e}")
+        return None
+
+    # Spark falls back to spark.sql.defaultSizeInBytes (Long.MaxValue) when unknown
+    if size_bytes <= 0 or size_bytes >= sys.maxsize:
+        return None
+    return size_bytes
+
+
 # Function to Write Data as Parquet to S3 with Partitioning
-def write_as_parquet_s3(df: DataFrame, s3_bucket: str, target_file_size_mb: int = 127):
+def write_as_parquet_s3(df: DataFrame, s3_bucket: str, table_name: str, target_file_size_mb: int = 127):
     """
     Writes the DataFrame to Parquet files in the specified S3 bucket, partitioned by 'date'.
+    Only the partitions present in the DataFrame are replaced (dynamic partition overwrite).
     """
-    table_name = "imal_reporting_currentaccountbalancebyday"
     output_path = f"s3://{s3_bucket}/{table_name}"
     try:
         logger.info(f"Writing data to S3 bucket at: {output_path}")
 
         # Estimate total data size in bytes
-        total_data_size_bytes = df.rdd.map(lambda row: len(str(row))).sum()
-        total_data_size_mb = total_data_size_bytes / (1024 * 1024)  # Convert to MB
-        logger.info(f"Estimated total data size: {total_data_size_mb:.2f} MB.")
-
-        # Calculate the optimal number of partitions
-        num_partitions = max(1, int(total_data_size_bytes / (target_file_size_mb * 1024 * 1024)))
-        logger.info(f"Calculated partitions: {num_partitions}, target file size: {target_file_size_mb} MB.")
-
-        # Repartition the DataFrame
-        if num_partitions < df.rdd.getNumPartitions():
-            logger.info("Reducing partitions using coalesce to achieve larger file sizes.")
-            df = df.coalesce(num_partitions)
+        total_data_size_bytes = estimate_size_bytes(df)
+        if total_data_size_bytes is None:
+            logger.info("No usable size statistics, keeping the current partitioning.")
         else:
-            logger.info("Increasing partitions using repartition for better data distribution.")
-            df = df.repartition(num_partitions)
+            total_data_size_mb = total_data_size_bytes / (1024 * 1024)  # Convert to MB
+            logger.info(f"Estimated total data size: {total_data_size_mb:.2f} MB.")
+
+            # Calculate the optimal number of partitions
+            num_partitions = max(1, int(total_data_size_bytes / (target_file_size_mb * 1024 * 1024)))
+            logger.info(f"Calculated partitions: {num_partitions}, target file size: {target_file_size_mb} MB.")
+
+            # Repartition the DataFrame
+            if num_partitions < df.rdd.getNumPartitions():
+                logger.info("Reducing partitions using coalesce to achieve larger file sizes.")
+                df = df.coalesce(num_partitions)
+            elif num_partitions > df.rdd.getNumPartitions():
+                logger.info("Increasing partitions using repartition for better data distribution.")
+                df = df.repartition(num_partitions)
 
         # Write the DataFrame to S3 in Parquet format, partitioned by 'date'
         df.write \
             .mode("overwrite") \
+            .option("partitionOverwriteMode", "dynamic") \
             .option("compression", "snappy") \
             .partitionBy("date") \
             .parquet(output_path)
@@ -94,11 +187,47 @@ def write_as_parquet_s3(df: DataFrame, s3_bucket: str, target_file_size_mb: int
         raise
 
 
+def process_table(table_name: str, s3_bucket: str, state_path: str, full_refresh: bool = False):
+    """
+    Deduplicates the 'date' partitions of a table touched since the last run and
+    rewrites only those partitions.
+    """
+    config = DEDUP_TABLES[table_name]
+    order_by = config["order_by"]
+
+    watermark = None if full_refresh else read_watermark(state_path, table_name)
+    dates, new_watermark = get_touched_dates(table_name, order_by, watermark)
+    if not dates:
+        logger.info(f"No partitions changed in {table_name} since {watermark}, skipping.")
+        return
+
+    logger.info(f"Reprocessing {len(dates)} partition(s) of {table_name}: {dates}")
+    # A full rebuild reads every partition anyway, so skip the IN filter
+    query_dates = dates if watermark else None
+    athena_df = read_athena(
+        build_dedup_query(table_name, config["natural_keys"], order_by, query_dates)
+    ).drop("row_num")
+    # Ensure 'date' column is available and used for partitioning
+    if "date" not in athena_df.columns:
+        logger.error(f"'date' column not found in {table_name}.")
+        raise ValueError("The required column 'date' is missing.")
+
+    write_as_parquet_s3(athena_df, s3_bucket, table_name, target_file_size_mb=127)
+    write_watermark(state_path, table_name, new_watermark)
+
+
 # Main Job Execution
 if __name__ == "__main__":
-    # @params: [JOB_NAME, S3_RAW]
-    args = getResolvedOptions(sys.argv, ["JOB_NAME", "S3_RAW"])
+    # @params: [JOB_NAME, S3_RAW, STATE_PATH, TABLES, FULL_REFRESH]
+    args = getResolvedOptions(sys.argv, ["JOB_NAME", "S3_RAW", "STATE_PATH", "TABLES", "FULL_REFRESH"])
     s3_bucket = args["S3_RAW"]
+    state_path = args["STATE_PATH"]
+    full_refresh = args["FULL_REFRESH"].lower() == "true"
+    tables = [t.strip() for t in args["TABLES"].split(",") if t.strip()] or list(DEDUP_TABLES)
+
+    unknown_tables = [t for t in tables if t not in DEDUP_TABLES]
+    if unknown_tables:
+        raise ValueError(f"No dedup configuration for tables: {unknown_tables}")
 
     # Initialize Glue Job
     job = Job(glueContext)
@@ -110,14 +239,9 @@ if __name__ == "__main__":
 
     # Process Data
     try:
-        logger.info("Starting data processing pipeline.")
-        athena_df = read_athena(athena_query)
-        # Ensure 'date' column is available and used for partitioning
-        if "date" in athena_df.columns:
-            write_as_parquet_s3(athena_df, s3_bucket, target_file_size_mb=127)
-        else:
-            logger.error("'date' column not found in the DataFrame.")
-            raise ValueError("The required column 'date' is missing.")
+        logger.info(f"Starting data processing pipeline for tables: {tables}")
+        for table_name in tables:
+            process_table(table_name, s3_bucket, state_path, full_refresh)
         logger.info("Data processing completed successfully.")
     except Exception as e:
         logger.error(f"Error during job execution: {e}")
@@ -9,6 +9,13 @@ from datetime import datetime, date
 import boto3
 from botocore.exceptions import ClientError
 
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from s3_utils import list_s3_keys
+
+# Case2: Local or test execution
+else:
+    from src.common.s3_utils import list_s3_keys
 
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
@@ -121,12 +128,9 @@ def _iter_csv_keys(bucket: str, prefix: str) -> Iterable[str]:
     Yield S3 keys ending with .csv under the given prefix.
     Uses a paginator so it works for 10k+ objects.
     """
-    paginator = S3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            key = obj["Key"]
-            if key.lower().endswith(".csv"):
-                yield key
+    return list_s3_keys(
+        bucket, prefix, s3_client=S3, key_filter=lambda key: key.lower().endswith(".csv")
+    )
 
 
 def _run_backfill(
@@ -283,7 +283,7 @@ schemas = {
         "created_at": "timestamp",
         "updated_at": "timestamp",
         "identification_type": "string",
-        "identification_value": "double",
+        "identification_value": "string",
         "short_reference": "string",
         "api_trading": "boolean",
         "online_trading": "boolean",
@@ -2,13 +2,21 @@ import io
 import json
 import logging
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
 from datetime import datetime
+from datetime import timedelta
 
 import awswrangler as wr
 import boto3
 import pandas as pd
 import requests
+from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import data_catalog
 
 # import currencycloud
@@ -18,7 +26,6 @@ import data_catalog
 # import base64
 
 # from flatten_json import flatten
-# from botocore.exceptions import ClientError
 # import time
 
 
@@ -48,17 +55,8 @@ base_url = "https://devapi.currencycloud.com/"
 token_url = "v2/authenticate/api"
 fullurl = base_url + token_url
 secret_name = "data/currencycloud/api"
-
-
-api_credentials = get_secret(secret_name)
-login_id = list(api_credentials.keys())[0]
-api_key = api_credentials[login_id]
-
-data = {"login_id": login_id, "api_key": api_key}
-response = requests.post(fullurl, data=data)
-logger.info("Checking API Authentication: %s", response)
-
-token = response.json()["auth_token"]
+# Tokens expire after 30 minutes of inactivity, renew a little before that
+TOKEN_TTL_SECONDS = 25 * 60
 
 balance_url = "v2/balances/find"
 accounts_url = "v2/accounts/find"
@@ -111,202 +109,328 @@ ccy_pairs = [
     {"currency_pair": "USDHKD"},
 ]
 
+# Bounds the threads used for endpoints, funding currencies and rate pairs
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+
+# Endpoints extracted incrementally, with the API filter taking their watermark
+INCREMENTAL_FILTERS = {
+    transactions_url: "updated_at_from",
+    payments_url: "updated_at_from",
+    conversions_url: "updated_at_from",
+    transfers_url: "updated_at_from",
+}
+# Incremental endpoints are fully extracted again once this many days have passed
+FULL_REFRESH_DAYS = int(os.environ.get("FULL_REFRESH_DAYS", "7"))
+REQUEST_TIMEOUT = 60
 
-def parse_currency_cloud(base_url, url, token):
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=MAX_WORKERS * 2):
     """
-    Extract parse and enrich data from a single non-parameterized endpoint in the currency cloud API.
-    Construct the API endpoints, extract data & source names from all pages and store results in the empty dataframe
+    Returns the shared requests Session used for all API calls.
+    Its connection pool is sized for the worker threads so keep-alive connections
+    are reused, and throttled or failed GETs are retried with backoff.
+    :param pool_size: Maximum number of pooled connections to the API host
+    :return: requests.Session
     """
-    extract_url = base_url + url
-    logger.info(extract_url)
-    response = requests.get(extract_url, headers={"X-Auth-Token": token})
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+_token = None
+_token_expires_at = 0.0
+_token_lock = threading.Lock()
+
+
+def get_token(force_refresh=False):
+    """
+    Returns the API auth token, authenticating on first use only.
+    The token is kept for warm invocations of the Lambda until it is about to expire,
+    so neither the secret nor the authenticate endpoint are called at import time.
+    :param force_refresh: Authenticate again even if the cached token is still valid
+    :return: API auth token
+    """
+    global _token, _token_expires_at
+    with _token_lock:
+        if force_refresh or _token is None or time.monotonic() >= _token_expires_at:
+            api_credentials = get_secret(secret_name)
+            if not api_credentials:
+                raise RuntimeError(f"Could not retrieve secret {secret_name}")
+            login_id = list(api_credentials.keys())[0]
+            api_key = api_credentials[login_id]
+
+            data = {"login_id": login_id, "api_key": api_key}
+            response = get_session().post(fullurl, data=data, timeout=REQUEST_TIMEOUT)
+            logger.info("Checking API Authentication: %s", response)
+            response.raise_for_status()
+
+            _token = response.json()["auth_token"]
+            _token_expires_at = time.monotonic() + TOKEN_TTL_SECONDS
+    return _token
+
+
+def fetch_all_records(session, extract_url, data_name, token, params=None):
+    """
+    Collect the records of every page of a paginated endpoint.
+    The first response is page 1, so only the remaining pages are requested.
+    :param session: requests Session to use
+    :param extract_url: Endpoint URL
+    :param data_name: Key of the records in the response body
+    :param token: API auth token
+    :param params: Extra query parameters, e.g. the currency
+    :return: List of records of all pages
+    """
+    params = dict(params or {})
+    headers = {"X-Auth-Token": token}
+    response = session.get(
+        extract_url, headers=headers, params=params, timeout=REQUEST_TIMEOUT
+    )
     data = response.json()
-    pages = data["pagination"]
-    total_pages = pages["total_pages"]
-    if total_pages < 1:
-        total_pages = 1
-    else:
-        total_pages
-    data_name = url.split("/")[1].strip()
-    df = pd.json_normalize(data[data_name])
-    df = pd.DataFrame(columns=df.columns)
+    records = list(data[data_name])
+    total_pages = max(data["pagination"]["total_pages"], 1)
+
     # pagination of data returned from API
-    for i in range(total_pages):
-        i = i + 1
-        page = f"?page={i}"
-        page_url = extract_url + page
-        response = requests.get(
-            page_url,
-            headers={
-                "X-Auth-Token": token,
-            },
+    for page in range(2, total_pages + 1):
+        response = session.get(
+            extract_url,
+            headers=headers,
+            params={**params, "page": page},
+            timeout=REQUEST_TIMEOUT,
         )
-        page_data = response.json()
+        records.extend(response.json()[data_name])
+
+    return records
+
+
+def add_metadata(df, extract_url):
+    """
+    Enrich an extracted dataframe with the metadata columns, once for all its rows.
+    :param df: Pandas DF of the extracted records
+    :param extract_url: Endpoint URL the records came from
+    :return: Enriched DF and its Athena table name
+    """
+    table_name = "currencycloud_" + extract_url.split("/")[-2]
+    df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    df["record_format"] = "application/json"
+    df["extract_url"] = extract_url
+    df["table_name"] = table_name
+    df["date"] = date.today().strftime("%Y%m%d")  # str(date.today())
+    df = df.infer_objects()
+    return df.reset_index(drop=True), table_name
+
 
-        page_data[data_name]
-        df1 = pd.json_normalize(page_data[data_name])
-        df = pd.concat([df, df1])
-        # enrich with metadata and enforce datatypes on dataframe
-        df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[
-            :-3
-        ]
-        df["record_format"] = "application/json"
-        df["extract_url"] = extract_url
-        currencycloud = "currencycloud_"
-        table_name = currencycloud + extract_url.split("/")[-2]
-        df["table_name"] = table_name
-        df["date"] = date.today().strftime("%Y%m%d")  # str(date.today())
-        df = df.infer_objects()
-
-    df = df.reset_index()
-    df = df.drop("index", axis=1)
-    # correct nulls to ensure correct datatypes on dataframe
+# Sample used to classify columns missing from data_catalog.schemas
+COERCION_SAMPLE_SIZE = 1000
+ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+# "date" is the partition column, set by get_currencycloud_schema
+PARTITION_COLUMNS = {"date"}
+
+
+def to_string_column(series):
+    """
+    Serialise the non string values of an object column (nested lists and dicts as JSON)
+    so the column can be written as an Athena string.
+    """
+    mask = series.notna() & ~series.map(lambda value: isinstance(value, str))
+    if not mask.any():
+        return series
+    series = series.copy()
+    series[mask] = series[mask].map(
+        lambda value: (
+            json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+        )
+    )
+    return series
+
+
+def cast_column(series, athena_type):
+    """
+    Cast a column once to the pandas dtype matching its Athena type.
+    Values that do not fit the type become null, see coerce_to_schema.
+    :param series: Column to cast
+    :param athena_type: Athena type from data_catalog.schemas
+    :return: Casted column
+    """
+    if athena_type in ("int", "bigint", "double", "float"):
+        numbers = pd.to_numeric(series, errors="coerce")
+        if athena_type in ("int", "bigint") and (numbers.dropna() % 1 == 0).all():
+            return numbers.astype("Int64")
+        return numbers.astype("float64")
+    if athena_type == "boolean":
+        if pd.api.types.is_bool_dtype(series):
+            return series
+        lowered = series.astype("string").str.lower()
+        return lowered.map({"true": True, "false": False}).astype("boolean")
+    if athena_type in ("timestamp", "date"):
+        timestamps = pd.to_datetime(
+            series, errors="coerce", format="ISO8601", utc=True
+        ).dt.tz_localize(None)
+        if athena_type == "date":
+            return timestamps.dt.date.where(timestamps.notna(), None)
+        return timestamps
+    return to_string_column(series)
+
+
+def classify_column(series):
+    """
+    Guess the Athena type of a column missing from the catalog, from a sample of its values.
+    Uses vectorized masks instead of trying casts until one does not raise.
+    :param series: Non-empty object column
+    :return: Athena type
+    """
+    sample = series.dropna()
+    sample = sample.iloc[:COERCION_SAMPLE_SIZE]
+    if sample.map(lambda value: isinstance(value, bool)).all():
+        return "boolean"
+    is_str = sample.map(lambda value: isinstance(value, str))
+    if not is_str.all():
+        return "string"
+    if pd.to_numeric(sample, errors="coerce").notna().all():
+        return "double"
+    if sample.str.match(ISO_DATE_PATTERN).all() and (
+        pd.to_datetime(sample, errors="coerce", format="ISO8601", utc=True)
+        .notna()
+        .all()
+    ):
+        return "timestamp"
+    return "string"
+
+
+def coerce_to_schema(df, athena_table):
+    """
+    Enforce datatypes on an extracted dataframe in a single pass.
+    Column types come from data_catalog.schemas, columns missing from the catalog
+    are classified from a sample. Empty columns are left untouched.
+    A column with values that do not fit its type is logged and left uncast, so
+    the write fails loudly (and goes to the fallback) rather than losing them.
+    :param df: Pandas DF of the extracted records
+    :param athena_table: Table name, key of data_catalog.schemas
+    :return: DF with every column casted once
+    """
+    schema = data_catalog.schemas.get(athena_table, {})
     for col in df.columns:
-        if (
-            df[col].isnull().values.all()
-            or df[col].values.all() == ""
-            or df[col].values.all() == []
-        ):
-            empty_col = 1
-        else:
-            empty_col = 0
-        if df[col].dtype == "object" and empty_col == 0:
-            try:
-                df[col] = pd.to_numeric(df[col], downcast="integer")
-            except Exception:
-                try:
-                    df[col] = pd.to_datetime(df[col], format="%Y%m%d")
-                except Exception:
-                    df[col] = df[col]
+        if col in PARTITION_COLUMNS or df[col].isna().all():
+            continue
+        athena_type = schema.get(wr.catalog.sanitize_column_name(col))
+        if athena_type is None:
+            if df[col].dtype != "object":
+                continue
+            athena_type = classify_column(df[col])
+            logger.info(
+                "Column %s.%s not in catalog, using %s", athena_table, col, athena_type
+            )
+        casted = cast_column(df[col], athena_type)
+        has_value = df[col].notna() & df[col].ne("")
+        lost = int((has_value & casted.isna()).sum())
+        if lost:
+            logger.warning(
+                "%s value(s) of %s.%s do not fit %s, leaving the column uncast",
+                lost,
+                athena_table,
+                col,
+                athena_type,
+            )
+            continue
+        df[col] = casted
+    return df
+
+
+def parse_currency_cloud(base_url, url, token, session=None, params=None):
+    """
+    Extract parse and enrich data from a single non-parameterized endpoint in the currency cloud API.
+    Records of all pages are collected first and normalized into a single dataframe.
+    Optional params filter the records, e.g. on updated_at_from for incremental extracts.
+    """
+    session = session or get_session()
+    extract_url = base_url + url
+    logger.info(extract_url)
+    data_name = url.split("/")[1].strip()
+    records = fetch_all_records(session, extract_url, data_name, token, params=params)
+
+    # enrich with metadata and enforce datatypes on dataframe
+    df, table_name = add_metadata(pd.json_normalize(records), extract_url)
+    df = coerce_to_schema(df, table_name)
 
     return df, table_name
 
 
-def parse_funding_cloud(base_url, funding_url, ccys, token):
+def fetch_funding_records(base_url, funding_url, ccy, token, session=None):
     """
-    Extract parse and enrich funding account details from currency cloud API.
-    Construct the API endpoint, extract data & source name and store results in the empty dataframe
+    Extract the funding account records of a single currency from currency cloud API.
     """
+    session = session or get_session()
     extract_url = base_url + funding_url
+    logger.info(extract_url + "_" + ccy["currency"])
     data_name = funding_url.split("/")[1].strip()
-    df_final = pd.DataFrame()
+    return fetch_all_records(session, extract_url, data_name, token, params=ccy)
 
-    # Get funding data for all pages and all currencies inscope
-    for ccy in ccys:
-        logger.info(extract_url + "_" + ccy["currency"])
-        response = requests.get(
-            extract_url, headers={"X-Auth-Token": token}, params=ccy
+
+def parse_funding_cloud(base_url, funding_url, ccys, token, session=None):
+    """
+    Extract parse and enrich funding account details from currency cloud API.
+    All currencies inscope are requested concurrently and normalized together in their listed order.
+    """
+    session = session or get_session()
+    extract_url = base_url + funding_url
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(ccys))) as executor:
+        results = executor.map(
+            lambda ccy: fetch_funding_records(
+                base_url, funding_url, ccy, token, session
+            ),
+            ccys,
         )
-        data = response.json()
-        pages = data["pagination"]
-        total_pages = pages["total_pages"]
-        if total_pages < 1:
-            total_pages = 1
-        else:
-            total_pages
-        data_name = funding_url.split("/")[1].strip()
-        df = pd.json_normalize(data[data_name])
-        df = pd.DataFrame(columns=df.columns)
-
-        for i in range(total_pages):
-            i = i + 1
-            page = f"?page={i}"
-            page_url = extract_url + page
-            response = requests.get(
-                page_url, headers={"X-Auth-Token": token}, params=ccy
-            )
-            page_data = response.json()
-            page_data[data_name]
-            df1 = pd.json_normalize(page_data[data_name])
-            df = pd.concat([df, df1])
-
-            # enrich with metadata and enforce datatypes on dataframe
-            df["timestamp_extracted"] = datetime.utcnow().strftime(
-                "%Y-%m-%d %H:%M:%S.%f"
-            )[:-3]
-            df["record_format"] = "application/json"
-            df["extract_url"] = extract_url
-            currencycloud = "currencycloud_"
-            table_name = currencycloud + extract_url.split("/")[-2]
-            df["table_name"] = table_name
-            df["date"] = date.today().strftime("%Y%m%d")  # str(date.today())
-            df = df.infer_objects()
-
-        df = df.reset_index()
-        df = df.drop("index", axis=1)
-        # correct nulls to ensure correct datatypes on dataframe
-        for col in df.columns:
-            if (
-                df[col].isnull().values.all()
-                or df[col].values.all() == ""
-                or df[col].values.all() == []
-            ):
-                empty_col = 1
-            else:
-                empty_col = 0
-            if df[col].dtype == "object" and empty_col == 0:
-                try:
-                    df[col] = pd.to_numeric(df[col], downcast="integer")
-                except Exception:
-                    try:
-                        df[col] = pd.to_datetime(df[col], format="%Y%m%d")
-                    except Exception:
-                        df[col] = df[col]
-
-        df_final = pd.concat([df_final, df])
-
-    logger.info(df_final.dtypes)
-
-    return df_final, table_name
-
-
-def parse_rates_cloud(base_url, rates_url, ccy_pairs, token):
+        records = [record for ccy_records in results for record in ccy_records]
+
+    # enrich with metadata and enforce datatypes on dataframe
+    df, table_name = add_metadata(pd.json_normalize(records), extract_url)
+    df = coerce_to_schema(df, table_name)
+
+    logger.info(df.dtypes)
+
+    return df, table_name
+
+
+def parse_rates_cloud(base_url, rates_url, ccy_pairs, token, session=None):
     """
     Extract parse and enrich exchange rate details from currency cloud API.
     Construct the API endpoint, extract data & source name and store results in the empty dataframe
     """
+    session = session or get_session()
     extract_url = base_url + rates_url
     data_name = rates_url.split("/")[1].strip()
-    df = pd.DataFrame()
-    # Get exchage rates data all currency pairs inscope
-    for pair in ccy_pairs:
+
+    def fetch_pair(pair):
         logger.info(extract_url + "_" + pair["currency_pair"])
-        response = requests.get(
-            extract_url, headers={"X-Auth-Token": token}, params=pair
+        response = session.get(
+            extract_url,
+            headers={"X-Auth-Token": token},
+            params=pair,
+            timeout=REQUEST_TIMEOUT,
         )
         page_data = response.json()
-        page_data[data_name]
-        df1 = pd.json_normalize(page_data[data_name])
-        df = pd.concat([df, df1], axis=1)
+        return pd.json_normalize(page_data[data_name])
+
+    # Get exchage rates data all currency pairs inscope, one column block per pair
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(ccy_pairs))) as executor:
+        df = pd.concat(list(executor.map(fetch_pair, ccy_pairs)), axis=1)
     # enrich with metadata and enforce datatypes on dataframe
-    df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    df["record_format"] = "application/json"
-    df["extract_url"] = extract_url
-    currencycloud = "currencycloud_"
-    table_name = currencycloud + extract_url.split("/")[-2]
-    df["table_name"] = table_name
-    df["date"] = date.today().strftime("%Y%m%d")  # str(date.today())
-    df = df.infer_objects()
-    df = df.reset_index()
-    df = df.drop("index", axis=1)
-    # correct nulls to ensure correct datatypes on dataframe
-    for col in df.columns:
-        if (
-            df[col].isnull().values.all()
-            or df[col].values.all() == ""
-            or df[col].values.all() == []
-        ):
-            empty_col = 1
-        else:
-            empty_col = 0
-        if df[col].dtype == "object" and empty_col == 0:
-            try:
-                df[col] = pd.to_numeric(df[col], downcast="integer")
-            except Exception:
-                try:
-                    df[col] = pd.to_datetime(df[col], format="%Y%m%d")
-                except Exception:
-                    df[col] = df[col]
+    df, table_name = add_metadata(df, extract_url)
+    df = coerce_to_schema(df, table_name)
 
     logger.info(df.dtypes)
 
@@ -322,9 +446,9 @@ def get_currencycloud_schema(df):
             athena_schema[col] = "timestamp"
         elif str(df.dtypes[col])[:5] == "float":
             athena_schema[col] = "double"
-        elif str(df.dtypes[col])[:3] == "int":
+        elif str(df.dtypes[col]).lower()[:3] == "int":
             athena_schema[col] = "int"
-        elif df.dtypes[col] == "bool":
+        elif str(df.dtypes[col]).lower()[:4] == "bool":
             athena_schema[col] = "boolean"
         else:
             athena_schema[col] = "string"
@@ -339,7 +463,9 @@ def get_currencycloud_schema(df):
     return df, athena_schema
 
 
-def fallback_write_to_s3(tempdf: pd.DataFrame, athena_table: str, s3_bucket: str):
+def fallback_write_to_s3(
+    tempdf: pd.DataFrame, athena_table: str, s3_bucket: str, boto3_session=None
+):
     """
     Fallback Boto3 writing to S3.
     :param tempdf: Pandas DF to write to S3
@@ -348,6 +474,7 @@ def fallback_write_to_s3(tempdf: pd.DataFrame, athena_table: str, s3_bucket: str
     :type athena_table: str
     :param s3_bucket: The S3 Bucket to write to
     :type s3_bucket: str
+    :param boto3_session: boto3 Session to use, a new one is created if None
     """
 
     dt = datetime.utcnow()
@@ -356,7 +483,7 @@ def fallback_write_to_s3(tempdf: pd.DataFrame, athena_table: str, s3_bucket: str
 
     csv_buffer = io.StringIO()
     tempdf.to_csv(csv_buffer)
-    s3_resource = boto3.resource("s3")
+    s3_resource = (boto3_session or boto3.Session()).resource("s3")
 
     fallback_path = f"{athena_table}_fallback/{date}/{time}.csv"
     logger.info(
@@ -382,6 +509,8 @@ def write_to_s3(tempdf, athena_table, athena_schema, partition_columns, s3_bucke
     logger.info("Pandas DF shape:  %s", tempdf.shape)
     path = "s3://" + s3_bucket + "/" + athena_table + "/"
     logger.info("Uploading to S3 location:  %s", path)
+    # boto3 sessions are not thread safe, each concurrent write gets its own
+    boto3_session = boto3.Session()
 
     try:
         # issue write command to s3
@@ -401,6 +530,7 @@ def write_to_s3(tempdf, athena_table, athena_schema, partition_columns, s3_bucke
             glue_table_settings=wr.typing.GlueTableSettings(
                 columns_comments=data_catalog.column_comments[athena_table]
             ),
+            boto3_session=boto3_session,
         )
         return res, path
     except Exception as e:
@@ -410,33 +540,22 @@ def write_to_s3(tempdf, athena_table, athena_schema, partition_columns, s3_bucke
 
         try:
             logger.info("Writing to fallback...")
-            fallback_write_to_s3(tempdf, athena_table, s3_bucket)
+            fallback_write_to_s3(tempdf, athena_table, s3_bucket, boto3_session)
         except Exception as e2:
             logger.error(f"Failed fallback with Exception: {e2}")
 
         return e
 
 
-def get_currency_cloud_data(currency_cloud_urls):
-    for url in currency_cloud_urls:
-        logger.info("Request data from:  %s", url)
-        df, target_athena_glue_table = parse_currency_cloud(base_url, url, token)
-        final_df, athena_schema = get_currencycloud_schema(df)
-        partition_columns = ["date"]
-        logger.info("Now writing to: %s", target_athena_glue_table)
-        logger.info("Initiating write to s3 routine...")
-
-        res = write_to_s3(
-            final_df, target_athena_glue_table, athena_schema, partition_columns
-        )
-        logger.info("Result:  %s", res)
-        logger.info("Finished processing event.")
-        logger.info("Finished writing to: %s", target_athena_glue_table)
-
-    df, target_athena_glue_table = parse_funding_cloud(
-        base_url, funding_url, ccys, token
-    )
+def write_table(df, target_athena_glue_table):
+    """
+    Write an extracted table to S3 and the Glue catalog.
+    :param df: Pandas DF of the extracted table
+    :param target_athena_glue_table: Table to write to
+    :return: Write result, the exception if the write failed
+    """
     final_df, athena_schema = get_currencycloud_schema(df)
+    partition_columns = ["date"]
     logger.info("Now writing to: %s", target_athena_glue_table)
     logger.info("Initiating write to s3 routine...")
 
@@ -444,24 +563,186 @@ def get_currency_cloud_data(currency_cloud_urls):
         final_df, target_athena_glue_table, athena_schema, partition_columns
     )
     logger.info("Result:  %s", res)
-    logger.info("Finished processing event.")
     logger.info("Finished writing to: %s", target_athena_glue_table)
+    return res
+
+
+def extract_and_write(parse, *args):
+    """
+    Extract a single table with the given parse function and write it to S3,
+    so each table is written as soon as its own requests are done.
+    :param parse: One of the parse_*_cloud functions
+    :param args: Arguments of the parse function
+    :return: Table name and write result
+    """
+    df, target_athena_glue_table = parse(*args)
+    return target_athena_glue_table, write_table(df, target_athena_glue_table)
 
-    df, target_athena_glue_table = parse_rates_cloud(
-        base_url, rates_url, ccy_pairs, token
+
+def read_state(state_path, table_name):
+    """
+    Reads the incremental extraction state of a table from the state path.
+    :param state_path: S3 URI holding one JSON state file per table
+    :param table_name: Athena table of the endpoint
+    :return: State dict, empty when the table has no watermark yet
+    """
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/{table_name}.json"
+    try:
+        response = boto3.Session().client("s3").get_object(Bucket=bucket, Key=key)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            logger.info(
+                "No watermark found for %s, running a full extract.", table_name
+            )
+            return {}
+        raise
+
+
+def write_state(state_path, table_name, state):
+    """
+    Persists the incremental extraction state of a table to the state path.
+    :param state_path: S3 URI holding one JSON state file per table
+    :param table_name: Athena table of the endpoint
+    :param state: State dict with the watermark and the date of the last full refresh
+    """
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/{table_name}.json"
+    boto3.Session().client("s3").put_object(
+        Bucket=bucket, Key=key, Body=json.dumps(state)
     )
-    final_df, athena_schema = get_currencycloud_schema(df)
-    logger.info("Now writing to: %s", target_athena_glue_table)
-    logger.info("Initiating write to s3 routine...")
+    logger.info("Watermark for %s set to %s", table_name, state["watermark"])
 
-    res = write_to_s3(
-        final_df, target_athena_glue_table, athena_schema, partition_columns
+
+def get_incremental_params(url, state, full_refresh=False):
+    """
+    Returns the filter pulling only the records updated since the watermark,
+    or None when the endpoint has to be fully extracted: there is no watermark yet,
+    a full refresh was requested or the last one is FULL_REFRESH_DAYS old.
+    :param url: Incremental endpoint
+    :param state: State of the endpoint table
+    :param full_refresh: Force a full extract
+    :return: Query parameters or None
+    """
+    watermark = state.get("watermark")
+    last_full_refresh = state.get("last_full_refresh")
+    if full_refresh or not watermark or not last_full_refresh:
+        return None
+    age = date.today() - date.fromisoformat(last_full_refresh)
+    if age >= timedelta(days=FULL_REFRESH_DAYS):
+        return None
+    return {INCREMENTAL_FILTERS[url]: watermark}
+
+
+def get_watermark(df, previous=None):
+    """
+    Returns the latest updated_at of an extracted table in the API date format,
+    never moving back from the previous watermark.
+    """
+    if "updated_at" not in df.columns or df["updated_at"].isna().all():
+        return previous
+    latest = pd.to_datetime(df["updated_at"], utc=True).max()
+    watermark = latest.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return max(watermark, previous) if previous else watermark
+
+
+def extract_endpoint(url, token, session, state_path=None, full_refresh=False):
+    """
+    Extract a non-parameterized endpoint and write it to S3.
+    With a state path, endpoints in INCREMENTAL_FILTERS only pull the records
+    updated since their watermark, which is moved forward once the write succeeded.
+    :param url: Endpoint to extract
+    :param token: API auth token
+    :param session: requests Session to use
+    :param state_path: S3 URI of the watermarks, incremental mode is off if None
+    :param full_refresh: Force a full extract of incremental endpoints
+    :return: Table name and write result
+    """
+    if not state_path or url not in INCREMENTAL_FILTERS:
+        return extract_and_write(parse_currency_cloud, base_url, url, token, session)
+
+    table_name = "currencycloud_" + url.split("/")[1]
+    state = read_state(state_path, table_name)
+    params = get_incremental_params(url, state, full_refresh)
+    logger.info("Extracting %s with filter %s", table_name, params)
+
+    df, table_name = parse_currency_cloud(base_url, url, token, session, params)
+    if df.empty:
+        logger.info("No records updated in %s since %s", table_name, params)
+        return table_name, None
+
+    res = write_table(df, table_name)
+    if isinstance(res, Exception):
+        # keep the watermark, the next run pulls the same records again
+        return table_name, res
+
+    write_state(
+        state_path,
+        table_name,
+        {
+            "table": table_name,
+            "watermark": get_watermark(df, state.get("watermark")),
+            "last_full_refresh": (
+                state.get("last_full_refresh") if params else date.today().isoformat()
+            ),
+        },
     )
-    logger.info("Result:  %s", res)
+    return table_name, res
+
+
+def get_currency_cloud_data(
+    currency_cloud_urls, max_workers=MAX_WORKERS, state_path=None, full_refresh=False
+):
+    """
+    Extract all endpoints, funding accounts and rates concurrently over a shared session.
+    Writes overlap with the requests still in flight, so the run takes about as long as
+    the slowest endpoint.
+    :param currency_cloud_urls: Non-parameterized endpoints to extract
+    :param max_workers: Maximum number of tables extracted at the same time
+    :param state_path: S3 URI of the incremental watermarks, defaults to STATE_PATH env
+    :param full_refresh: Force a full extract of the incremental endpoints
+    """
+    if state_path is None:
+        state_path = os.environ.get("STATE_PATH")
+    session = get_session()
+    token = get_token()
+    jobs = [
+        (url, extract_endpoint, (url, token, session, state_path, full_refresh))
+        for url in currency_cloud_urls
+    ]
+    jobs.append(
+        (
+            funding_url,
+            extract_and_write,
+            (parse_funding_cloud, base_url, funding_url, ccys, token, session),
+        )
+    )
+    jobs.append(
+        (
+            rates_url,
+            extract_and_write,
+            (parse_rates_cloud, base_url, rates_url, ccy_pairs, token, session),
+        )
+    )
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        futures = {executor.submit(job, *args): url for url, job, args in jobs}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Failed extracting %s: %s", url, e)
+                failed.append(url)
+
     logger.info("Finished processing event.")
-    logger.info("Finished writing to: %s", target_athena_glue_table)
+    if failed:
+        raise RuntimeError(f"Currency Cloud extraction failed for: {failed}")
 
 
 def lambda_handler(event, context):
-    get_currency_cloud_data(currency_cloud_urls)
+    full_refresh = bool((event or {}).get("full_refresh", False))
+    get_currency_cloud_data(currency_cloud_urls, full_refresh=full_refresh)
     return {"statusCode": 200, "body": json.dumps("Hello from Lambda!")}
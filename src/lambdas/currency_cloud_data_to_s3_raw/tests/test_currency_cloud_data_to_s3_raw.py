@@ -0,0 +1,352 @@
+import logging
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+import lambda_function as lf
+
+
+@pytest.fixture(autouse=True)
+def cached_token():
+    lf._token = "token"
+    lf._token_expires_at = lf.time.monotonic() + lf.TOKEN_TTL_SECONDS
+    yield
+    lf._token = None
+    lf._token_expires_at = 0.0
+
+
+def _parse_stub(*args):
+    url = args[1]
+    return pd.DataFrame({"id": ["1"]}), "currencycloud_" + url.split("/")[1]
+
+
+def test_get_session_is_shared_and_pooled():
+    lf._session = None
+    first = lf.get_session(pool_size=4)
+    assert lf.get_session() is first
+    assert first.get_adapter("https://devapi.currencycloud.com/")._pool_maxsize == 4
+    lf._session = None
+
+
+def test_get_token_authenticates_once_until_expiry():
+    lf._token = None
+    session = MagicMock()
+    session.post.return_value.json.side_effect = [
+        {"auth_token": "first"},
+        {"auth_token": "second"},
+    ]
+    with patch("lambda_function.get_secret", return_value={"login": "key"}), patch(
+        "lambda_function.get_session", return_value=session
+    ):
+        assert lf.get_token() == "first"
+        assert lf.get_token() == "first"
+        session.post.assert_called_once()
+        assert session.post.call_args.kwargs["data"] == {
+            "login_id": "login",
+            "api_key": "key",
+        }
+
+        lf._token_expires_at = lf.time.monotonic() - 1
+        assert lf.get_token() == "second"
+
+
+def test_get_token_fails_without_secret():
+    lf._token = None
+    with patch("lambda_function.get_secret", return_value=False):
+        with pytest.raises(RuntimeError, match="data/currencycloud/api"):
+            lf.get_token()
+
+
+def _paged_session(data_name, pages, page_size):
+    """Session returning `pages` synthetic pages of `page_size` records each."""
+
+    def get(url, headers=None, params=None, timeout=None):
+        page = (params or {}).get("page", 1)
+        records = [
+            {"id": f"{page}-{i}", "amount": str(i), "currency": params.get("currency")}
+            for i in range(page_size)
+        ]
+        response = MagicMock()
+        response.json.return_value = {
+            data_name: records,
+            "pagination": {"total_pages": pages},
+        }
+        return response
+
+    session = MagicMock()
+    session.get.side_effect = get
+    return session
+
+
+def test_fetch_all_records_requests_each_page_once():
+    session = _paged_session("payments", pages=3, page_size=2)
+    records = lf.fetch_all_records(
+        session, lf.base_url + lf.payments_url, "payments", "token"
+    )
+
+    assert [r["id"] for r in records] == ["1-0", "1-1", "2-0", "2-1", "3-0", "3-1"]
+    pages = [call.kwargs["params"].get("page") for call in session.get.call_args_list]
+    assert pages == [None, 2, 3]
+
+
+def test_add_metadata_builds_one_frame():
+    records = [{"id": "1", "account": {"name": "a"}}, {"id": "2"}]
+    df, table_name = lf.add_metadata(
+        pd.json_normalize(records), lf.base_url + lf.payments_url
+    )
+
+    assert table_name == "currencycloud_payments"
+    assert list(df.index) == [0, 1]
+    assert set(df["table_name"]) == {"currencycloud_payments"}
+    assert df["timestamp_extracted"].nunique() == 1
+    assert "account.name" in df.columns
+
+
+def test_fetch_funding_records_keeps_currency_filter():
+    session = _paged_session("funding_accounts", pages=2, page_size=1)
+    records = lf.fetch_funding_records(
+        lf.base_url, lf.funding_url, {"currency": "EUR"}, "token", session
+    )
+
+    assert [r["currency"] for r in records] == ["EUR", "EUR"]
+    assert session.get.call_args_list[-1].kwargs["params"] == {
+        "currency": "EUR",
+        "page": 2,
+    }
+
+
+def test_parse_funding_cloud_keeps_currency_order():
+    session = _paged_session("funding_accounts", pages=2, page_size=1)
+    df, table_name = lf.parse_funding_cloud(
+        lf.base_url, lf.funding_url, lf.ccys, "token", session
+    )
+
+    assert table_name == "currencycloud_funding_accounts"
+    # two pages per currency
+    expected = [ccy["currency"] for ccy in lf.ccys for _ in range(2)]
+    assert list(df["currency"]) == expected
+
+
+def test_parse_rates_cloud_has_one_column_per_pair():
+    session = MagicMock()
+
+    def get(url, headers=None, params=None, timeout=None):
+        response = MagicMock()
+        rates = {params["currency_pair"]: ["1.1", "1.2"]}
+        response.json.return_value = {"rates": rates}
+        return response
+
+    session.get.side_effect = get
+    df, table_name = lf.parse_rates_cloud(
+        lf.base_url, lf.rates_url, lf.ccy_pairs, "token", session
+    )
+
+    assert table_name == "currencycloud_rates"
+    pairs = [pair["currency_pair"] for pair in lf.ccy_pairs]
+    assert [col for col in df.columns if col.isupper()] == pairs
+    # catalog type is string, nested lists are serialised
+    assert df.loc[0, "EURUSD"] == '["1.1", "1.2"]'
+
+
+def test_coerce_to_schema_uses_catalog_types():
+    df = pd.DataFrame(
+        {
+            "amount": ["10.5", None],
+            "created_at": ["2024-01-01T10:00:00+00:00", None],
+            "api_trading": ["true", "false"],
+            "identification_value": ["123", "AB1234567"],
+            "date": ["20240101", "20240101"],
+            "empty": ["", ""],
+        }
+    )
+    df = lf.coerce_to_schema(df, "currencycloud_accounts")
+
+    # amount is not in the accounts schema, numeric strings become numbers
+    assert df["amount"].tolist()[0] == 10.5
+    assert str(df["created_at"].dtype) == "datetime64[ns]"
+    assert df["api_trading"].tolist() == [True, False]
+    # passport numbers are kept as strings
+    assert df["identification_value"].tolist() == ["123", "AB1234567"]
+    assert df["date"].tolist() == ["20240101", "20240101"]
+    assert df["empty"].tolist() == ["", ""]
+
+
+def test_coerce_to_schema_keeps_values_that_do_not_fit():
+    df = pd.DataFrame({"balance_amount": ["10.5", "n/a", None, ""]})
+    with patch.object(lf.data_catalog, "schemas", {"t": {"balance_amount": "double"}}):
+        with patch.object(lf.logger, "warning") as warning:
+            df = lf.coerce_to_schema(df, "t")
+
+    # the column is left as is for the write to fail loudly
+    assert df["balance_amount"].tolist() == ["10.5", "n/a", None, ""]
+    assert warning.call_args.args[1:] == (1, "t", "balance_amount", "double")
+
+
+def test_coerce_to_schema_classifies_from_a_sample():
+    df = pd.DataFrame({"reference": [f"ref-{i}" for i in range(5000)]})
+    with patch.object(lf.pd, "to_numeric", wraps=pd.to_numeric) as to_numeric:
+        df = lf.coerce_to_schema(df, "currencycloud_unknown")
+
+    assert len(to_numeric.call_args.args[0]) == lf.COERCION_SAMPLE_SIZE
+    assert df["reference"].iloc[-1] == "ref-4999"
+
+
+def _count_frame_builds(pages, page_size=50):
+    """Frames built and rows normalized while extracting `pages` pages."""
+    session = _paged_session("payments", pages=pages, page_size=page_size)
+    with patch.object(lf.pd, "concat", wraps=pd.concat) as concat, patch.object(
+        lf.pd, "json_normalize", wraps=pd.json_normalize
+    ) as normalize, patch.object(lf.data_catalog, "schemas", {}):
+        start = time.perf_counter()
+        df, _ = lf.parse_currency_cloud(
+            lf.base_url, lf.payments_url, "token", session=session
+        )
+        elapsed = time.perf_counter() - start
+    assert len(df) == pages * page_size
+    logging.getLogger(__name__).info("Extracted %d pages in %.3f s", pages, elapsed)
+    rows_normalized = sum(len(c.args[0]) for c in normalize.call_args_list)
+    return concat.call_count, normalize.call_count, rows_normalized
+
+
+def test_pagination_builds_one_frame_regardless_of_page_count():
+    # regression benchmark: concatenating per page made this O(pages^2),
+    # records of all pages must be normalized into a frame once
+    assert _count_frame_builds(10) == (0, 1, 10 * 50)
+    assert _count_frame_builds(200) == (0, 1, 200 * 50)
+
+
+@patch("lambda_function.parse_rates_cloud", side_effect=_parse_stub)
+@patch("lambda_function.parse_funding_cloud", side_effect=_parse_stub)
+@patch("lambda_function.parse_currency_cloud", side_effect=_parse_stub)
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_get_currency_cloud_data_writes_every_table(write_mock, *parse_mocks):
+    lf.get_currency_cloud_data(lf.currency_cloud_urls)
+
+    written = {call.args[1] for call in write_mock.call_args_list}
+    assert written == {
+        "currencycloud_" + url.split("/")[1] for url in lf.currency_cloud_urls
+    } | {"currencycloud_funding_accounts", "currencycloud_rates"}
+
+
+@patch("lambda_function.parse_rates_cloud", side_effect=_parse_stub)
+@patch("lambda_function.parse_funding_cloud", side_effect=_parse_stub)
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_endpoints_are_fetched_concurrently(write_mock, *parse_mocks):
+    urls = lf.currency_cloud_urls[:3]
+    # only passes if the three endpoints are in flight at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def parse(base_url, url, token, session):
+        barrier.wait()
+        return _parse_stub(base_url, url)
+
+    with patch("lambda_function.parse_currency_cloud", side_effect=parse):
+        lf.get_currency_cloud_data(urls, max_workers=5)
+
+    assert write_mock.call_count == 5
+
+
+@patch("lambda_function.parse_rates_cloud", side_effect=_parse_stub)
+@patch("lambda_function.parse_funding_cloud", side_effect=_parse_stub)
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_failed_endpoint_does_not_stop_the_others(write_mock, *parse_mocks):
+    def parse(base_url, url, token, session):
+        if "payments" in url:
+            raise ConnectionError("boom")
+        return _parse_stub(base_url, url)
+
+    with patch("lambda_function.parse_currency_cloud", side_effect=parse):
+        with pytest.raises(RuntimeError, match="v2/payments/find"):
+            lf.get_currency_cloud_data(lf.currency_cloud_urls)
+
+    assert write_mock.call_count == len(lf.currency_cloud_urls) + 1
+
+
+def test_get_incremental_params():
+    state = {"watermark": "2024-01-01T10:00:00Z", "last_full_refresh": None}
+    assert lf.get_incremental_params(lf.payments_url, state) is None
+
+    state["last_full_refresh"] = lf.date.today().isoformat()
+    assert lf.get_incremental_params(lf.payments_url, state) == {
+        "updated_at_from": "2024-01-01T10:00:00Z"
+    }
+    assert lf.get_incremental_params(lf.payments_url, state, full_refresh=True) is None
+
+    old = lf.date.today() - lf.timedelta(days=lf.FULL_REFRESH_DAYS)
+    state["last_full_refresh"] = old.isoformat()
+    assert lf.get_incremental_params(lf.payments_url, state) is None
+
+
+def test_get_watermark_never_moves_back():
+    df = pd.DataFrame({"updated_at": pd.to_datetime(["2024-01-02 10:00:00", None])})
+    assert lf.get_watermark(df) == "2024-01-02T10:00:00Z"
+    assert lf.get_watermark(df, "2024-02-01T00:00:00Z") == "2024-02-01T00:00:00Z"
+    assert lf.get_watermark(df.iloc[1:], "2024-01-01T00:00:00Z") == (
+        "2024-01-01T00:00:00Z"
+    )
+
+
+def _updated_frame(*updated_at):
+    return (
+        pd.DataFrame({"updated_at": pd.to_datetime(list(updated_at))}),
+        "currencycloud_payments",
+    )
+
+
+@patch("lambda_function.write_state")
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_extract_endpoint_pulls_changes_since_watermark(write_mock, state_mock):
+    state = {
+        "watermark": "2024-01-01T00:00:00Z",
+        "last_full_refresh": lf.date.today().isoformat(),
+    }
+    with patch("lambda_function.read_state", return_value=state), patch(
+        "lambda_function.parse_currency_cloud",
+        return_value=_updated_frame("2024-01-03 08:00:00"),
+    ) as parse_mock:
+        lf.extract_endpoint(lf.payments_url, "token", MagicMock(), "s3://state/cc/")
+
+    assert parse_mock.call_args.args[4] == {"updated_at_from": "2024-01-01T00:00:00Z"}
+    written_state = state_mock.call_args.args[2]
+    assert written_state["watermark"] == "2024-01-03T08:00:00Z"
+    assert written_state["last_full_refresh"] == state["last_full_refresh"]
+
+
+@patch("lambda_function.write_state")
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_extract_endpoint_full_refresh_without_watermark(write_mock, state_mock):
+    with patch("lambda_function.read_state", return_value={}), patch(
+        "lambda_function.parse_currency_cloud",
+        return_value=_updated_frame("2024-01-03 08:00:00"),
+    ) as parse_mock:
+        lf.extract_endpoint(lf.payments_url, "token", MagicMock(), "s3://state/cc/")
+
+    assert parse_mock.call_args.args[4] is None
+    assert state_mock.call_args.args[2]["last_full_refresh"] == (
+        lf.date.today().isoformat()
+    )
+
+
+@patch("lambda_function.write_state")
+@patch("lambda_function.write_to_s3", return_value=ValueError("failed"))
+def test_failed_write_keeps_watermark(write_mock, state_mock):
+    with patch("lambda_function.read_state", return_value={}), patch(
+        "lambda_function.parse_currency_cloud",
+        return_value=_updated_frame("2024-01-03 08:00:00"),
+    ):
+        lf.extract_endpoint(lf.payments_url, "token", MagicMock(), "s3://state/cc/")
+
+    state_mock.assert_not_called()
+
+
+@patch("lambda_function.read_state")
+@patch("lambda_function.write_to_s3", return_value=True)
+def test_non_incremental_endpoints_ignore_state(write_mock, state_mock):
+    with patch("lambda_function.parse_currency_cloud", side_effect=_parse_stub):
+        lf.extract_endpoint(lf.accounts_url, "token", MagicMock(), "s3://state/cc/")
+
+    state_mock.assert_not_called()
+    write_mock.assert_called_once()
@@ -1,6 +1,7 @@
 import logging
 import os
 from datetime import date
+from functools import partial
 from typing import Any
 
 import awswrangler as wr
@@ -9,6 +10,14 @@ import pandas as pd
 import config
 import data_catalog
 
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from athena_utils import read_sql, run_athena_pipeline
+
+# Case2: Local or test execution
+else:
+    from src.common.athena_utils import read_sql, run_athena_pipeline
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -20,34 +29,13 @@ def log_error(log_string: str):
         logger.error(log_string)
 
 
-def read_sql_from_athena(sql_path: str, input_database: str) -> pd.DataFrame:
-    logger.info("Reading sql file... ")
-    with open(sql_path, "r") as sql_file:
-        sql = sql_file.read()
-
-    logger.info("Reading from Athena... ")
-    try:
-        df = wr.athena.read_sql_query(
-            sql=sql,
-            database=input_database,
-            workgroup="datalake_workgroup",
-            ctas_approach=False,
-        )
-
-        return True, df
-
-    except Exception as e:
-        log_error("Failed reading from Athena")
-        log_error(f"Exception occurred:  {e}")
-        return False, None
-
-
 def write_to_s3(
     output_df: pd.DataFrame,
     athena_table: str,
     database_name: str,
     partition_cols: Any,
     s3_bucket: str = None,
+    mode: str = None,
 ) -> dict:
     if s3_bucket is None:
         s3_bucket = os.environ["S3_CURATED"]
@@ -66,7 +54,7 @@ def write_to_s3(
                 dataset=True,
                 database=database_name,
                 table=athena_table,
-                mode="overwrite",
+                mode=mode or "overwrite",
                 schema_evolution="true",
                 compression="snappy",
                 partition_cols=partition_cols,
@@ -81,8 +69,7 @@ def write_to_s3(
         except Exception as e:
             log_error(f"Failed uploading to S3 location:  {path}")
             log_error(f"Exception occurred:  {e}")
-
-            return e
+            raise
     else:
         try:
             res = wr.s3.to_csv(
@@ -92,7 +79,7 @@ def write_to_s3(
                 dataset=True,
                 database=database_name,
                 table=athena_table,
-                mode="overwrite",
+                mode=mode or "overwrite",
                 schema_evolution="true",
                 dtype=data_catalog.schemas[athena_table],
                 glue_table_settings=wr.typing.GlueTableSettings(
@@ -105,8 +92,7 @@ def write_to_s3(
         except Exception as e:
             log_error(f"Failed uploading to S3 location:  {path}")
             log_error(f"Exception occurred:  {e}")
-
-            return e
+            raise
 
 
 def lambda_handler(event, context):
@@ -116,18 +102,30 @@ def lambda_handler(event, context):
     sql_path = config.config["customer_timeline_detail"]["sql_path"]
 
     athena_table = "customer_timeline_detail"
-    res, df = read_sql_from_athena(sql_path, input_database)
+    run_date = date.today().strftime("%Y%m%d")
 
-    if res and df is not None:
-        # Safely add a new column to the DataFrame
-        df["date"] = date.today().strftime("%Y%m%d")
+    def add_date(df):
+        df["date"] = run_date
+        return df
 
-        write_output = write_to_s3(
-            output_df=df,
-            athena_table=athena_table,
-            database_name="datalake_curated",
+    try:
+        rows = run_athena_pipeline(
+            sql=read_sql(sql_path),
+            database=input_database,
+            s3_output="s3://" + os.environ["S3_ATHENA"],
+            write=partial(
+                write_to_s3,
+                athena_table=athena_table,
+                database_name="datalake_curated",
+                partition_cols=partition_cols,
+            ),
+            transform=add_date,
+            mode="overwrite",
             partition_cols=partition_cols,
+            workgroup="datalake_workgroup",
         )
-        logger.info(f"Result: {write_output}")
-    else:
-        log_error("Failed to retrieve data from Athena. Exiting function....")
+        logger.info(f"Result: {rows} rows written to {athena_table}")
+
+    except Exception as e:
+        log_error(f"Failed loading {athena_table}:  {e}")
+        log_error("Exiting function...")
@@ -5,34 +5,12 @@ from unittest.mock import patch, mock_open, MagicMock
 import pandas as pd
 
 sys.path.append(os.path.abspath("../"))
-from lambda_function import read_sql_from_athena, write_to_s3, lambda_handler
+# project root on sys.path so the "src.common" fallback import works
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, *[os.pardir] * 5)))
+from lambda_function import write_to_s3, lambda_handler
 
 class TestLambdaFunctions(unittest.TestCase):
 
-    @patch("lambda_function.wr.athena.read_sql_query")
-    @patch("lambda_function.open", new_callable=mock_open, read_data="SELECT * FROM some_table;")
-    @patch("lambda_function.logger")
-    def test_read_sql_from_athena_success(self, mock_logger, mock_open, mock_read_sql_query):
-        mock_read_sql_query.return_value = pd.DataFrame({'col1': [1, 2], 'col2': [3, 4]})
-        success, df = read_sql_from_athena("data_path.sql", "data_database")
-        
-        self.assertTrue(success)
-        self.assertIsInstance(df, pd.DataFrame)
-        mock_open.assert_called_once_with("data_path.sql", "r")
-        mock_read_sql_query.assert_called_once()
-        mock_logger.info.assert_called_with("Reading from Athena... ")
-
-    @patch("lambda_function.wr.athena.read_sql_query")
-    @patch("lambda_function.open", new_callable=mock_open, read_data="SELECT * FROM some_table;")
-    @patch("lambda_function.logger")
-    def test_read_sql_from_athena_failure(self, mock_logger, mock_open, mock_read_sql_query):
-        mock_read_sql_query.side_effect = Exception("Some error")
-        success, df = read_sql_from_athena("data_path.sql", "data_database")
-        
-        self.assertFalse(success)
-        self.assertIsNone(df)
-        mock_logger.error.assert_any_call("Failed reading from Athena")
-
     @patch("lambda_function.data_catalog.schemas", {"data_table": {"col1": "int", "col2": "int"}})
     @patch("lambda_function.data_catalog.column_comments", {"data_table": {"col1": "Column 1", "col2": "Column 2"}})
     @patch("lambda_function.wr.s3.to_parquet")
@@ -50,12 +28,13 @@ class TestLambdaFunctions(unittest.TestCase):
     @patch("lambda_function.data_catalog.column_comments", {"data_table": {"col1": "Column 1", "col2": "Column 2"}})
     @patch("lambda_function.wr.s3.to_parquet")
     @patch("lambda_function.logger")
+    @patch.dict(os.environ, {"IS_SANDBOX": ""})
     def test_write_to_s3_failure_with_partition(self, mock_logger, mock_to_parquet):
         mock_to_parquet.side_effect = Exception("Upload error")
         df = pd.DataFrame({'col1': [1, 2], 'col2': [3, 4]})
         
-        res = write_to_s3(df, "data_table", "data_database", ["col1"], "data_bucket")
-        self.assertIsInstance(res, Exception)
+        with self.assertRaises(Exception):
+            write_to_s3(df, "data_table", "data_database", ["col1"], "data_bucket")
         mock_logger.error.assert_any_call("Failed uploading to S3 location:  s3://data_bucket/data_table/")
 
     @patch("lambda_function.data_catalog.schemas", {"data_table": {"col1": "int", "col2": "int"}})
@@ -71,22 +50,35 @@ class TestLambdaFunctions(unittest.TestCase):
         # mock_to_csv.assert_called_once()
         mock_logger.info.assert_any_call("Uploading to S3 bucket: data_bucket")
 
+    @patch.dict(os.environ, {"S3_ATHENA": "athena_bucket"})
     @patch("lambda_function.config.config", {"customer_timeline_detail": {"sql_path": "data_path.sql"}})
-    @patch("lambda_function.read_sql_from_athena")
-    @patch("lambda_function.write_to_s3")
+    @patch("lambda_function.read_sql", return_value="SELECT * FROM some_table;")
+    @patch("lambda_function.run_athena_pipeline", return_value=2)
     @patch("lambda_function.logger")
-    def test_lambda_handler_success(self, mock_logger, mock_write_to_s3, mock_read_sql_from_athena):
-        mock_read_sql_from_athena.return_value = (True, pd.DataFrame({'col1': [1, 2], 'col2': [3, 4]}))
-        mock_write_to_s3.return_value = {"paths": ["s3://data_path/"]}
-        
+    def test_lambda_handler_success(self, mock_logger, mock_run_athena_pipeline, mock_read_sql):
         event = {}
         context = {}
         lambda_handler(event, context)
-        
-        mock_read_sql_from_athena.assert_called_once_with("data_path.sql", "datalake_raw")
-        mock_write_to_s3.assert_called_once()
-        mock_logger.info.assert_any_call("Result: {'paths': ['s3://data_path/']}")
 
+        mock_read_sql.assert_called_once_with("data_path.sql")
+        kwargs = mock_run_athena_pipeline.call_args.kwargs
+        self.assertEqual(kwargs["database"], "datalake_raw")
+        self.assertEqual(kwargs["s3_output"], "s3://athena_bucket")
+        self.assertEqual(kwargs["mode"], "overwrite")
+        # each chunk gets the date partition before it is written
+        chunk = kwargs["transform"](pd.DataFrame({'col1': [1, 2]}))
+        self.assertEqual(chunk["date"].nunique(), 1)
+        mock_logger.info.assert_any_call("Result: 2 rows written to customer_timeline_detail")
+
+    @patch.dict(os.environ, {"S3_ATHENA": "athena_bucket"})
+    @patch("lambda_function.config.config", {"customer_timeline_detail": {"sql_path": "data_path.sql"}})
+    @patch("lambda_function.read_sql", return_value="SELECT * FROM some_table;")
+    @patch("lambda_function.run_athena_pipeline", side_effect=Exception("Some error"))
+    @patch("lambda_function.log_error")
+    def test_lambda_handler_failure(self, mock_log_error, mock_run_athena_pipeline, mock_read_sql):
+        lambda_handler({}, {})
+
+        mock_log_error.assert_any_call("Exiting function...")
 
 if __name__ == '__main__':
     unittest.main()
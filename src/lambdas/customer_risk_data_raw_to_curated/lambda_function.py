@@ -1,6 +1,6 @@
 import logging
 import os
-from datetime import date
+from functools import partial
 from typing import Any
 
 import awswrangler as wr
@@ -9,30 +9,20 @@ import pandas as pd
 import config
 import data_catalog
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from athena_utils import read_athena_query, read_sql, run_athena_pipeline
 
+# Case2: Local or test execution
+else:
+    from src.common.athena_utils import (
+        read_athena_query,
+        read_sql,
+        run_athena_pipeline,
+    )
 
-def read_sql_from_athena(sql_path: str, input_database: str) -> pd.DataFrame:
-    logger.info("Reading sql file... ")
-    with open(sql_path, "r") as sql_file:
-        sql = sql_file.read()
-
-    logger.info("Reading from Athena... ")
-    try:
-        df = wr.athena.read_sql_query(
-            sql=sql,
-            database=input_database,
-            workgroup="datalake_workgroup",
-            ctas_approach=False,
-        )
-
-        return True, df
-
-    except Exception as e:
-        logger.error("Failed reading from Athena")
-        logger.error(f"Exception occurred:  {e}")
-        return False, None
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 
 def write_to_s3(
@@ -41,6 +31,7 @@ def write_to_s3(
     database_name: str,
     partition_cols: Any,
     s3_bucket: str = None,
+    mode: str = None,
 ) -> dict:
     if s3_bucket is None:
         s3_bucket = os.environ["S3_CURATED"]
@@ -59,7 +50,7 @@ def write_to_s3(
                 dataset=True,
                 database=database_name,
                 table=athena_table,
-                mode="overwrite_partitions",
+                mode=mode or "overwrite_partitions",
                 schema_evolution="true",
                 compression="snappy",
                 partition_cols=partition_cols,
@@ -74,8 +65,7 @@ def write_to_s3(
         except Exception as e:
             logger.error(f"Failed uploading to S3 location:  {path}")
             logger.error(f"Exception occurred:  {e}")
-
-            return e
+            raise
     else:
         try:
             res = wr.s3.to_csv(
@@ -85,7 +75,7 @@ def write_to_s3(
                 dataset=True,
                 database=database_name,
                 table=athena_table,
-                mode="overwrite",
+                mode=mode or "overwrite",
                 schema_evolution="true",
             )
 
@@ -94,45 +84,48 @@ def write_to_s3(
         except Exception as e:
             logger.error(f"Failed uploading to S3 location:  {path}")
             logger.error(f"Exception occurred:  {e}")
-
-            return e
+            raise
 
 
 def lambda_handler(event, context):
     input_database = "datalake_raw"
     partition_cols = ["date"]
+    s3_output = "s3://" + os.environ["S3_ATHENA"]
 
     sql_path = config.config["customer_risk_form_data_raw_to_curated"]["sql_path"]
 
     athena_table = "dynamo_sls_customer_risk_form"
-    res, df = read_sql_from_athena(sql_path, input_database)
-
-    df["job_run_date"] = date.today().strftime("%Y%m%d")
 
-    if res:
-        column_names_series = df["column_name"]
-        columns = [column[:] for column in column_names_series]
-        column_str = ",".join(columns)
+    try:
+        df = read_athena_query(
+            read_sql(sql_path),
+            input_database,
+            s3_output,
+            workgroup="datalake_workgroup",
+        )
+        column_str = ",".join(df["column_name"])
         final_query = (
             "select "
             + column_str
             + '  FROM "datalake_raw"."dynamo_sls_customer_risk_form"'
         )
 
-        df_data = wr.athena.read_sql_query(
+        rows = run_athena_pipeline(
             sql=final_query,
             database=input_database,
-            workgroup="datalake_workgroup",
-            ctas_approach=False,
-        )
-
-        write_output = write_to_s3(
-            output_df=df_data,
-            athena_table=athena_table,
-            database_name="datalake_curated",
+            s3_output=s3_output,
+            write=partial(
+                write_to_s3,
+                athena_table=athena_table,
+                database_name="datalake_curated",
+                partition_cols=partition_cols,
+            ),
+            mode="overwrite_partitions",
             partition_cols=partition_cols,
+            workgroup="datalake_workgroup",
         )
-        logger.info(f"Result: {write_output}")
+        logger.info(f"Result: {rows} rows written to {athena_table}")
 
-    else:
+    except Exception as e:
+        logger.error(f"Failed loading {athena_table}:  {e}")
         logger.error("Exiting function...")
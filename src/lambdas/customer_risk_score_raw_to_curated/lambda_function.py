@@ -1,34 +1,21 @@
 import logging
 import os
 from datetime import datetime, timezone
+from functools import partial
 import awswrangler as wr
 import pandas as pd
 import config
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-
-def read_sql_from_athena(sql_path: str, input_database: str) -> pd.DataFrame:
-    logger.info("Reading sql file... ")
-    with open(sql_path, "r") as sql_file:
-        sql = sql_file.read()
-
-    logger.info("Reading from Athena... ")
-    try:
-        df = wr.athena.read_sql_query(
-            sql=sql,
-            database=input_database,
-            workgroup="datalake_workgroup",
-            ctas_approach=False,
-        )
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from athena_utils import read_sql, run_athena_pipeline
 
-        return True, df
+# Case2: Local or test execution
+else:
+    from src.common.athena_utils import read_sql, run_athena_pipeline
 
-    except Exception as e:
-        logger.error("Failed reading from Athena")
-        logger.error(f"Exception occurred:  {e}")
-        return False, None
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 
 def write_to_s3(
@@ -37,7 +24,7 @@ def write_to_s3(
     database_name: str,
     partition_cols: list,
     s3_bucket: str,
-    write_mode: str,
+    mode: str,
 ) -> dict:
 
     logger.info(f"Uploading to S3 bucket: {s3_bucket}")
@@ -53,7 +40,7 @@ def write_to_s3(
             dataset=True,
             database=database_name,
             table=athena_table,
-            mode=write_mode,
+            mode=mode,
             schema_evolution="true",
             compression="snappy",
             partition_cols=partition_cols,
@@ -65,8 +52,7 @@ def write_to_s3(
     except Exception as e:
         logger.error(f"Failed uploading to S3 location:  {path}")
         logger.error(f"Exception occurred:  {e}")
-
-        return e
+        raise
 
 
 def lambda_handler(event, context):
@@ -78,23 +64,35 @@ def lambda_handler(event, context):
     input_database = "datalake_raw"
     sql_path = config.config["customer_risk_score_data_raw_to_curated"]["sql_path"]
     athena_table = "dynamo_sls_riskscore"
-    res, df = read_sql_from_athena(sql_path, input_database)
 
     # STEP3: meta columns
     partition_cols = ["year", "month", "day"]
-    df[partition_cols] = df["date"].astype(str).str.split("-", expand=True)
-    df["timestamp_extracted"] = datetime.now(timezone.utc)
-
-    if res:
-        write_output = write_to_s3(
-            output_df=df,
-            athena_table=athena_table,
-            database_name="datalake_curated",
+    timestamp_extracted = datetime.now(timezone.utc)
+
+    def add_meta_columns(df):
+        df[partition_cols] = df["date"].astype(str).str.split("-", expand=True)
+        df["timestamp_extracted"] = timestamp_extracted
+        return df
+
+    try:
+        rows = run_athena_pipeline(
+            sql=read_sql(sql_path),
+            database=input_database,
+            s3_output="s3://" + os.environ["S3_ATHENA"],
+            write=partial(
+                write_to_s3,
+                athena_table=athena_table,
+                database_name="datalake_curated",
+                partition_cols=partition_cols,
+                s3_bucket=s3_bucket,
+            ),
+            transform=add_meta_columns,
+            mode=wr_write_mode,
             partition_cols=partition_cols,
-            s3_bucket=s3_bucket,
-            write_mode=wr_write_mode,
+            workgroup="datalake_workgroup",
         )
-        logger.info(f"Result: {write_output}")
+        logger.info(f"Result: {rows} rows written to {athena_table}")
 
-    else:
+    except Exception as e:
+        logger.error(f"Failed loading {athena_table}:  {e}")
         logger.error("Exiting function...")
@@ -3,22 +3,46 @@ import os
 
 sys.path.append(os.path.abspath("../"))
 parent_directory = os.path.abspath(os.path.join(os.getcwd(), ".."))
+# project root on sys.path so the "src.common" fallback import works
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, *[os.pardir] * 5)))
 import config
 import unittest
 from unittest.mock import Mock, patch
-from lambda_function import write_to_s3, read_sql_from_athena
+import pandas as pd
+from lambda_function import write_to_s3, lambda_handler
 
 
 class TestReadSqlFromAthena(unittest.TestCase):
-    @patch("lambda_function.wr.athena.read_sql_query")
-    def test_read_sql_from_athena_success(self, mock_read_sql_query):
+    @patch.dict(
+        os.environ,
+        {
+            "S3_CURATED": "bb2-sandbox-datalake-curated",
+            "WRANGLER_WRITE_MODE": "overwrite_partitions",
+            "S3_ATHENA": "athena_bucket",
+        },
+    )
+    @patch("lambda_function.read_sql", return_value="Mocked SQL")
+    @patch("lambda_function.run_athena_pipeline", return_value=2)
+    def test_lambda_handler_runs_pipeline(
+        self, mock_run_athena_pipeline, mock_read_sql
+    ):
 
-        mock_read_sql_query.return_value = "Mocked DataFrame"
-        sql_path = os.path.join(parent_directory, "customer_riskscore_data.sql")
-        input_database = "datalake_raw"
-        result, df = read_sql_from_athena(sql_path, input_database)
-        self.assertTrue(result)
-        self.assertEqual(df, "Mocked DataFrame")
+        lambda_handler({}, {})
+
+        kwargs = mock_run_athena_pipeline.call_args.kwargs
+        self.assertEqual(kwargs["database"], "datalake_raw")
+        self.assertEqual(kwargs["mode"], "overwrite_partitions")
+        self.assertEqual(kwargs["partition_cols"], ["year", "month", "day"])
+
+        # every chunk of a run gets the same extraction timestamp
+        first = kwargs["transform"](pd.DataFrame({"date": ["2024-01-02"]}))
+        second = kwargs["transform"](pd.DataFrame({"date": ["2024-02-03"]}))
+        self.assertEqual(
+            list(first[["year", "month", "day"]].iloc[0]), ["2024", "01", "02"]
+        )
+        self.assertEqual(
+            first["timestamp_extracted"].iloc[0], second["timestamp_extracted"].iloc[0]
+        )
 
     @patch("lambda_function.wr.s3.to_parquet")
     def test_write_to_s3_with_partition(self, mock_to_parquet):
@@ -28,7 +52,7 @@ class TestReadSqlFromAthena(unittest.TestCase):
         database_name = "datalake_raw"
         partition_cols = ["date"]
         s3_bucket = "bb2-sandbox-datalake-curated"
-        write_mode = "overwrite_partitions"
+        mode = "overwrite_partitions"
 
         result = write_to_s3(
             output_df,
@@ -36,7 +60,7 @@ class TestReadSqlFromAthena(unittest.TestCase):
             database_name,
             partition_cols,
             s3_bucket,
-            write_mode,
+            mode,
         )
 
         mock_to_parquet.assert_called_once_with(
@@ -2,32 +2,17 @@ import logging
 import os
 from datetime import datetime
 import awswrangler as wr
-import pandas as pd
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-
-def read_sql_from_athena(sql_path: str, input_database: str) -> pd.DataFrame:
-    logger.info("Reading sql file... ")
-    with open(sql_path, "r") as sql_file:
-        sql = sql_file.read()
-
-    logger.info("Reading from Athena... ")
-    try:
-        df = wr.athena.read_sql_query(
-            sql=sql,
-            database=input_database,
-            workgroup="datalake_workgroup",
-            ctas_approach=False,
-        )
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from athena_utils import read_athena_query, read_sql
 
-        return True, df
+# Case2: Local or test execution
+else:
+    from src.common.athena_utils import read_athena_query, read_sql
 
-    except Exception as e:
-        logger.error("Failed reading from Athena")
-        logger.error(f"Exception occurred:  {e}")
-        return False, None
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 
 def write_to_s3(tempdf, athena_table, s3_bucket=None):
@@ -60,16 +45,23 @@ def write_to_s3(tempdf, athena_table, s3_bucket=None):
     except Exception as e:
         logger.error("Failed uploading to S3 location:  %s", path)
         logger.error("Exception occurred:  %s", e)
+        raise
 
 
 def process_income_wealth_data():
     sql_path = "customer_curated.sql"
     input_database = "datalake_curated"
-    res, result_df = read_sql_from_athena(sql_path, input_database)
-    logger.info("Data Frame read from Athena with Shape: ")
+    athena_table = "income_wealth_DataLake"
 
-    if res:
-        athena_table = "income_wealth_DataLake"
+    try:
+        # not chunked: the SFMC export is picked up as a single CSV file
+        result_df = read_athena_query(
+            read_sql(sql_path),
+            input_database,
+            "s3://" + os.environ["S3_ATHENA"],
+            workgroup="datalake_workgroup",
+        )
+        logger.info("Data Frame read from Athena with Shape: %s", result_df.shape)
         res, path = write_to_s3(result_df, athena_table)
 
         file_name = res["paths"][0]
@@ -77,7 +69,8 @@ def process_income_wealth_data():
         logger.info(
             "Final file written in aws s3 under path with full name :  %s", file_name
         )
-    else:
+    except Exception as e:
+        logger.error("Exception occurred:  %s", e)
         logger.error("Exiting function...")
 
 
@@ -2,22 +2,29 @@ import sys
 import os
 sys.path.append(os.path.abspath("../"))
 parent_directory = os.path.abspath(os.path.join(os.getcwd(), ".."))
+# project root on sys.path so the "src.common" fallback import works
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, *[os.pardir] * 5)))
 import unittest
 from unittest.mock import Mock, patch,MagicMock
-from lambda_function import write_to_s3,read_sql_from_athena
+from lambda_function import write_to_s3,process_income_wealth_data
 import pandas as pd
 from datetime import datetime
 
 class TestReadSqlFromAthena(unittest.TestCase):
-    @patch('lambda_function.wr.athena.read_sql_query')    
-    def test_read_sql_from_athena_success(self, mock_read_sql_query):
-
-        mock_read_sql_query.return_value = 'Mocked DataFrame'
-        sql_path = os.path.join(parent_directory, 'customer_curated.sql')
-        input_database = 'datalake_raw'
-        result, df = read_sql_from_athena(sql_path, input_database)
-        self.assertTrue(result)
-        self.assertEqual(df, 'Mocked DataFrame')
+    @patch.dict(os.environ, {"S3_ATHENA": "athena_bucket"})
+    @patch('lambda_function.write_to_s3', return_value=({'paths': ['s3://raw/file.csv']}, 's3://raw/'))
+    @patch('lambda_function.read_athena_query')
+    def test_process_income_wealth_data(self, mock_read_athena_query, mock_write_to_s3):
+
+        with patch('lambda_function.read_sql', return_value='Mocked SQL') as mock_read_sql:
+            process_income_wealth_data()
+
+        mock_read_sql.assert_called_once_with('customer_curated.sql')
+        mock_read_athena_query.assert_called_once_with(
+            'Mocked SQL', 'datalake_curated', 's3://athena_bucket', workgroup='datalake_workgroup'
+        )
+        # the whole result goes to S3 as one CSV file
+        mock_write_to_s3.assert_called_once_with(mock_read_athena_query.return_value, 'income_wealth_DataLake')
 
     @patch("awswrangler.s3.to_csv")
     def test_write_to_s3(self, mock_to_csv):
@@ -1,61 +1,52 @@
 import logging
-from datetime import datetime
 import awswrangler as wr
-import pandas as pd
 import boto3
-import json
+import ijson
+import pandas as pd
+from botocore.exceptions import ClientError
 import os
 
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from imal_utils import (
+        StagedParquetWriter,
+        append_to_buffers,
+        apply_schema_registry,
+        buffers_to_frame,
+        get_registered_schema,
+        get_schema,
+    )
+
+# Case2: Local or test execution
+else:
+    from src.common.imal_utils import (
+        StagedParquetWriter,
+        append_to_buffers,
+        apply_schema_registry,
+        buffers_to_frame,
+        get_registered_schema,
+        get_schema,
+    )
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+try:
+    ijson_backend = ijson.get_backend("yajl2_c")
+except ImportError:
+    logger.warning("ijson yajl2_c backend not available, using %s", ijson.backend)
+    ijson_backend = ijson
 
-def is_date_column(series):
-    for item in series.dropna().unique():
-        try:
-            parsed_date = pd.to_datetime(str(item))
-            if parsed_date.time() != pd.Timestamp(0).time():
-                return False
-        except ValueError:
-            return False
-    return True
-
-
-def get_schema(df, date_string):
-    df = df.rename(columns=str.lower)
-    dtype_mapping = {
-        "int64": "int",
-        "int32": "int",
-        "float64": "double",
-        "float32": "double",
-        "bool": "boolean",
-        "object": "string",
-        "datetime64": "timestamp",
-        "timedelta": "string",
-        "category": "string",
-    }
-    athena_schema = {}
-    for col in df.columns:
-        dtype = str(df[col].dtype)
-        if dtype == "object" and is_date_column(df[col]):
-            athena_schema[col] = "date"
-        elif dtype.startswith("datetime64") or dtype.startswith("timedelta"):
-            dtype = dtype.split("[")[0]
-            athena_schema[col] = dtype_mapping.get(dtype, "string")
-        else:
-            athena_schema[col] = dtype_mapping.get(dtype, "string")
-
-    for col in df.columns:
-        if athena_schema[col] in ("date", "timestamp"):
-            df[col] = pd.to_datetime(df[col], dayfirst=True)
-
-    df["date"] = date_string
-    athena_schema["date"] = "date"
-
-    df["timestamp_extracted"] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    athena_schema["timestamp_extracted"] = "timestamp"
-
-    return athena_schema, df
+# Size of each ranged GET issued while streaming the source object
+RANGE_SIZE = 8 * 1024 * 1024
+# Memory a single chunk may take; peak usage is roughly 3x the DataFrame size
+MAX_MEMORY_MB = int(os.environ.get("max_memory_mb", "512"))
+MEMORY_OVERHEAD_FACTOR = 3
+# Rows measured before the first chunk is sized, and the largest chunk allowed
+SAMPLE_ROWS = 10
+MAX_CHUNK_SIZE = 100_000
+# Write each source file as a few large Parquet files with one catalog update
+STAGED_WRITE = os.environ.get("staged_write", "false").lower() == "true"
 
 
 def write_to_s3(df, athena_table, athena_schema, partition_columns, s3_bucket):
@@ -82,30 +73,145 @@ def write_to_s3(df, athena_table, athena_schema, partition_columns, s3_bucket):
         return False
 
 
-def process_chunk(df, date_string, athena_table, partition_columns, s3_bucket):
-    schema, df = get_schema(df, date_string)
+def process_chunk(
+    df, date_string, athena_table, partition_columns, s3_bucket, writer=None
+):
+    registry = get_registered_schema(athena_table)
+    schema, df = get_schema(df, date_string, registry, athena_table)
+    schema, df = apply_schema_registry(df, schema, registry, athena_table)
+    if writer is not None:
+        return writer.write(df, schema)
     return write_to_s3(df, athena_table, schema, partition_columns, s3_bucket)
 
 
+class S3RangeReader:
+    # File-like reader that streams an S3 object through ranged GETs, so a
+    # large object is never held in memory and no connection stays open for
+    # the whole run.
+    def __init__(self, s3_client, bucket, key, range_size=RANGE_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.range_size = range_size
+        self.size = None
+        self._fetched = 0
+        self._block = b""
+        self._offset = 0
+
+    def _fetch_next_block(self):
+        if self.size is not None and self._fetched >= self.size:
+            return False
+        end = self._fetched + self.range_size - 1
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.key, Range=f"bytes={self._fetched}-{end}"
+            )
+        except ClientError as e:
+            # An empty object has no satisfiable range
+            if e.response["Error"]["Code"] == "InvalidRange":
+                self.size = self._fetched
+                return False
+            raise
+        # ContentRange looks like "bytes 0-8388607/123456789"
+        self.size = int(response["ContentRange"].split("/")[-1])
+        self._block = response["Body"].read()
+        self._offset = 0
+        self._fetched += len(self._block)
+        return bool(self._block)
+
+    def read(self, size=-1):
+        remaining = size if size is not None and size >= 0 else None
+        pieces = []
+        while remaining is None or remaining > 0:
+            if self._offset >= len(self._block) and not self._fetch_next_block():
+                break
+            end = len(self._block) if remaining is None else self._offset + remaining
+            piece = self._block[self._offset : end]
+            self._offset += len(piece)
+            if remaining is not None:
+                remaining -= len(piece)
+            pieces.append(piece)
+        return b"".join(pieces)
+
+
+def fit_chunk_size(df, chunk_size, max_memory_mb=MAX_MEMORY_MB):
+    # Size chunks from the rows seen so far so a chunk fills max_memory_mb
+    if df.empty:
+        return chunk_size
+    bytes_per_row = df.memory_usage(deep=True).sum() / len(df) * MEMORY_OVERHEAD_FACTOR
+    fitted = max(
+        1, min(MAX_CHUNK_SIZE, int(max_memory_mb * 1024 * 1024 / bytes_per_row))
+    )
+    if fitted != chunk_size:
+        logger.info(f"Resizing chunk from {chunk_size} to {fitted} rows")
+    return fitted
+
+
 def load_json_in_chunks(
-    abs_path, athena_table, s3_bucket, date_string, chunk_size=1000
+    abs_path,
+    athena_table,
+    s3_bucket,
+    date_string,
+    chunk_size=1000,
+    max_memory_mb=MAX_MEMORY_MB,
+    staged_write=STAGED_WRITE,
 ):
     s3_client = boto3.client("s3")
     bucket, key = abs_path.replace("s3://", "").split("/", 1)
-    content = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
-
-    data = json.loads(content)
-    chunk = []
-    for item in data:
-        chunk.append(item)
-        if len(chunk) >= chunk_size:
-            df = pd.DataFrame(chunk)
-            process_chunk(df, date_string, athena_table, ["date"], s3_bucket)
-            chunk.clear()
-
-    if chunk:
-        df = pd.DataFrame(chunk)
-        process_chunk(df, date_string, athena_table, ["date"], s3_bucket)
+    content = S3RangeReader(s3_client, bucket, key)
+    writer = (
+        StagedParquetWriter(s3_bucket, athena_table, date_string)
+        if staged_write
+        else None
+    )
+
+    buffers = {}
+    row_count = 0
+    arrow_schema = None
+    sampled = False
+    try:
+        for item in ijson_backend.items(content, "item", use_float=True):
+            append_to_buffers(buffers, item, row_count)
+            row_count += 1
+            if not sampled and row_count == SAMPLE_ROWS:
+                # Size the first chunk from a sample instead of a full chunk
+                sample = pd.DataFrame(buffers)
+                chunk_size = fit_chunk_size(sample, chunk_size, max_memory_mb)
+                del sample
+                sampled = True
+            if row_count >= chunk_size:
+                sampled = True
+                df, arrow_schema = buffers_to_frame(buffers, arrow_schema)
+                chunk_size = fit_chunk_size(df, chunk_size, max_memory_mb)
+                if (
+                    not process_chunk(
+                        df, date_string, athena_table, ["date"], s3_bucket, writer
+                    )
+                    and writer is not None
+                ):
+                    raise RuntimeError(f"Staging failed for {abs_path}")
+                # Reuse the column lists for the next chunk
+                del df
+                for column in buffers.values():
+                    column.clear()
+                row_count = 0
+
+        if row_count:
+            df, arrow_schema = buffers_to_frame(buffers, arrow_schema)
+            if (
+                not process_chunk(
+                    df, date_string, athena_table, ["date"], s3_bucket, writer
+                )
+                and writer is not None
+            ):
+                raise RuntimeError(f"Staging failed for {abs_path}")
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None and not writer.commit():
+        raise RuntimeError(f"Commit failed for {abs_path}")
 
     logger.info(f"Done processing {abs_path}")
 
@@ -5,40 +5,36 @@ import sys
 import unittest
 from unittest.mock import patch, MagicMock
 
+import pytest
+
 import pandas as pd
+import pyarrow.parquet as pq
 import awswrangler as wr
-import base64
 import json
 from datetime import datetime
 from datetime import date
-from datetime import timezone
 
 sys.path.append(os.path.abspath("../"))
+# project root on sys.path so the "src.common" fallback import works
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, *[os.pardir] * 5)))
 from lambda_function import (
-    is_date_column,
-    get_schema,
     write_to_s3,
     process_chunk,
     load_json_in_chunks,
-    lambda_handler
+    lambda_handler,
+    S3RangeReader,
+    fit_chunk_size,
+    MAX_CHUNK_SIZE,
+    get_registered_schema,
 )
+from src.common import imal_utils
 
 
-def test_is_date_column_true():
-    series = pd.Series(["2024-04-01", "2024-04-02"])
-    assert is_date_column(series) is True
-
-
-def test_get_schema_structure():
-    df = pd.DataFrame({
-        "id": [1, 2],
-        "created_at": ["2024-04-01", "2024-04-02"]
-    })
-    schema, new_df = get_schema(df, "20240401")
-    assert schema["id"] == "int"
-    assert schema["created_at"] == "date"
-    assert "date" in schema
-    assert "timestamp_extracted" in schema
+@pytest.fixture(autouse=True)
+def empty_schema_registry():
+    imal_utils._schema_registry.clear()
+    with patch("lambda_function.wr.catalog.get_table_types", return_value=None):
+        yield
 
 
 @patch("lambda_function.wr.s3.to_parquet")
@@ -67,6 +63,20 @@ def test_process_chunk(mock_write_to_s3, mock_get_schema):
     assert result is True
 
 
+def ranged_s3_mock(payload):
+    mock_s3 = MagicMock()
+
+    def get_object(Bucket, Key, Range):
+        start, end = (int(x) for x in Range.replace("bytes=", "").split("-"))
+        return {
+            "Body": MagicMock(read=MagicMock(return_value=payload[start:end + 1])),
+            "ContentRange": f"bytes {start}-{end}/{len(payload)}",
+        }
+
+    mock_s3.get_object.side_effect = get_object
+    return mock_s3
+
+
 @patch("lambda_function.boto3.client")
 @patch("lambda_function.process_chunk")
 def test_load_json_in_chunks(mock_process_chunk, mock_boto3):
@@ -74,11 +84,7 @@ def test_load_json_in_chunks(mock_process_chunk, mock_boto3):
         {"id": 1, "amount": 100},
         {"id": 2, "amount": 200}
     ]
-    mock_s3 = MagicMock()
-    mock_boto3.return_value = mock_s3
-    mock_s3.get_object.return_value = {
-        "Body": MagicMock(read=MagicMock(return_value=json.dumps(sample_data).encode()))
-    }
+    mock_boto3.return_value = ranged_s3_mock(json.dumps(sample_data).encode())
 
     load_json_in_chunks(
         abs_path="s3://source-bucket/key.json",
@@ -89,6 +95,120 @@ def test_load_json_in_chunks(mock_process_chunk, mock_boto3):
     )
 
     assert mock_process_chunk.call_count == 2
+    df = mock_process_chunk.call_args_list[1].args[0]
+    assert df.to_dict("records") == [{"id": 2, "amount": 200}]
+
+
+@patch("lambda_function.wr.catalog.add_parquet_partitions")
+@patch("lambda_function.wr.catalog.create_parquet_table")
+@patch("lambda_function.write_to_s3")
+@patch("lambda_function.boto3.client")
+def test_load_json_in_chunks_staged_write(
+    mock_boto3, mock_write_to_s3, mock_create_table, mock_add_partitions
+):
+    sample_data = [{"id": i, "amount": i * 1.5} for i in range(5)]
+    mock_s3 = ranged_s3_mock(json.dumps(sample_data).encode())
+    mock_boto3.return_value = mock_s3
+    uploaded = []
+    mock_s3.upload_file.side_effect = lambda path, bucket, key: uploaded.append(
+        (
+            key,
+            pq.ParquetFile(path).metadata.num_rows,
+            pq.ParquetFile(path).schema_arrow.field("timestamp_extracted").type,
+        )
+    )
+
+    load_json_in_chunks(
+        abs_path="s3://source-bucket/key.json",
+        athena_table="test_table",
+        s3_bucket="dest-bucket",
+        date_string="20240401",
+        chunk_size=2,
+        staged_write=True,
+    )
+
+    mock_write_to_s3.assert_not_called()
+    assert len(uploaded) == 1
+    assert uploaded[0][0].startswith("test_table/date=2024-04-01/")
+    assert uploaded[0][1] == 5
+    assert str(uploaded[0][2]) == "timestamp[ms]"
+    mock_create_table.assert_called_once()
+    mock_add_partitions.assert_called_once()
+
+
+@patch("lambda_function.write_to_s3")
+def test_process_chunk_casts_to_registered_schema(mock_write_to_s3):
+    with patch(
+        "lambda_function.wr.catalog.get_table_types",
+        return_value={"amount": "double", "date": "date"},
+    ):
+        registry = get_registered_schema("test_table")
+
+    df = pd.DataFrame({"amount": [None], "note": [None], "ref": ["a"]})
+    process_chunk(df, "20240401", "test_table", ["date"], "dest-bucket")
+
+    written_df, _, schema = mock_write_to_s3.call_args.args[:3]
+    assert schema["amount"] == "double"
+    assert "note" not in schema and "note" not in written_df.columns
+    assert registry == {"amount": "double", "ref": "string"}
+
+
+def test_s3_range_reader_reads_across_ranges():
+    payload = b"0123456789" * 5
+    reader = S3RangeReader(ranged_s3_mock(payload), "bucket", "key", range_size=8)
+
+    assert reader.read(3) == b"012"
+    assert reader.read(10) == b"3456789012"
+    assert reader.read() == payload[13:]
+    assert reader.read(1) == b""
+
+
+def test_fit_chunk_size_follows_memory_budget():
+    df = pd.DataFrame({"text": ["x" * 1000] * 10})
+    assert fit_chunk_size(df, 1_000_000, max_memory_mb=1) < 1000
+    assert 5 < fit_chunk_size(df, 5, max_memory_mb=1) < 1000
+    assert fit_chunk_size(pd.DataFrame({"id": [1]}), 1000) == MAX_CHUNK_SIZE
+
+
+@patch("lambda_function.boto3.client")
+@patch("lambda_function.process_chunk")
+def test_load_json_in_chunks_shrinks_chunks_of_large_rows(
+    mock_process_chunk, mock_boto3
+):
+    sample_data = [{"id": i, "text": "x" * 10_000} for i in range(200)]
+    mock_boto3.return_value = ranged_s3_mock(json.dumps(sample_data).encode())
+
+    load_json_in_chunks(
+        abs_path="s3://source-bucket/key.json",
+        athena_table="test_table",
+        s3_bucket="dest-bucket",
+        date_string="20240401",
+        max_memory_mb=1,
+    )
+
+    sizes = [len(c.args[0]) for c in mock_process_chunk.call_args_list]
+    # ~30 KB per row against a 1 MB budget, sized before the first chunk fills
+    assert sum(sizes) == 200
+    assert 1 < len(sizes) and max(sizes) < 50
+
+
+@patch("lambda_function.boto3.client")
+@patch("lambda_function.process_chunk")
+def test_load_json_in_chunks_grows_chunks_of_small_rows(
+    mock_process_chunk, mock_boto3
+):
+    sample_data = [{"id": i} for i in range(3000)]
+    mock_boto3.return_value = ranged_s3_mock(json.dumps(sample_data).encode())
+
+    load_json_in_chunks(
+        abs_path="s3://source-bucket/key.json",
+        athena_table="test_table",
+        s3_bucket="dest-bucket",
+        date_string="20240401",
+    )
+
+    assert mock_process_chunk.call_count == 1
+    assert len(mock_process_chunk.call_args.args[0]) == 3000
 
 
 @patch.dict(os.environ, {"dest_bucket": "dest-bucket"})
@@ -0,0 +1,16 @@
+with customers as (
+select COALESCE(dynamodb_keys_id_s,dynamodb_key_id_s) as user_id,
+dynamodb_new_image_updated_at_n,
+dynamodb_new_image_individual_m_address_m_status_s,
+row_number() over(partition by COALESCE(dynamodb_keys_id_s,dynamodb_key_id_s) order by dynamodb_new_image_updated_at_n desc) as rn_last
+from datalake_curated.dynamo_scv_sls_customers
+where dynamodb_new_image_individual_m_address_m_country_code_s='ARE'
+)
+select user_id from customers
+where dynamodb_new_image_updated_at_n >= timestamp '{watermark}'
+-- the weeks waiting for a QR scan grow without any new record
+or (rn_last = 1 and dynamodb_new_image_individual_m_address_m_status_s = 'AWAITING_QR_SCAN')
+union
+select customer_reference_id__c from datalake_raw.salesforce_cases
+where status='Documents Requested'
+and type='High risk manual review'
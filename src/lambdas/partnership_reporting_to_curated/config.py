@@ -1,7 +1,6 @@
 config = {
     "queries": {
         "qq": "qq.sql",
-        "qid": "qid.sql",
-        "sfq": "sfq.sql",
+        "changed_users": "changed_users.sql",
     },
 }
\ No newline at end of file
@@ -1,7 +1,8 @@
-import io
+import json
 import logging
 import os
 import time
+from datetime import date
 from datetime import datetime
 from datetime import timedelta
 
@@ -9,12 +10,112 @@ import awswrangler as wr
 import boto3
 import numpy as np
 import pandas as pd
+from botocore.exceptions import ClientError
 
 import config
 
+# Case1: Execution inside AWS Lambda
+if "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    from athena_utils import read_athena_query
+
+# Case2: Local or test execution
+else:
+    from src.common.athena_utils import read_athena_query
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# identical queries reuse a result this recent, e.g. when the lambda is retried
+QUERY_CACHE_SECONDS = int(os.environ.get("QUERY_CACHE_SECONDS", "3600"))
+# S3 URI of the report state, incremental mode is off if not set
+STATE_PATH = os.environ.get("STATE_PATH")
+FULL_REFRESH_DAYS = int(os.environ.get("FULL_REFRESH_DAYS", "7"))
+# records land in the curated table after their updated_at, so incremental runs look
+# this far behind the watermark
+WATERMARK_LOOKBACK_HOURS = int(os.environ.get("WATERMARK_LOOKBACK_HOURS", "24"))
+
+IDV_STATUS = "dynamodb_new_image_individual_m_identity_verification_m_status_s"
+ADDRESS_STATUS = "dynamodb_new_image_individual_m_address_m_status_s"
+APPLICATION_STATUS = "dynamodb_new_image_status_s"
+
+IDV_INCOMPLETE = ["AWAITING_CUSTOMER_RETRY", "AWAITING_MANUAL_REVIEW", "PENDING"]
+POA_INCOMPLETE = [
+    "AWAITING_MANUAL_REVIEW",
+    "AWAITING_MANUAL_INPUT",
+    "AWAITING_DOCUMENT_UPLOAD",
+]
+
+FINAL_APPLICATION_STATUSES = [
+    "APPROVED",
+    "REJECTED",
+    "AWAITING_EXIT_PERIOD",
+    "CEASED",
+    "CLOSED",
+    "AWAITING_BANK_ACCOUNT_CREATION",
+]
+
+# Onboarding buckets as (Bucket_, IDV statuses, address statuses, application
+# statuses), evaluated in order on the latest record of each user. None matches
+# any status.
+AR_BUCKET_RULES = [
+    (
+        "[Complete IDV, Awaiting Address Review]",
+        ["PASSED"],
+        ["AWAITING_MANUAL_REVIEW"],
+        None,
+    ),
+    ("[Complete IDV, Awaiting QR Scan]", ["PASSED"], ["AWAITING_QR_SCAN"], None),
+    (
+        "[Complete IDV, Don't Complete POA]",
+        ["PASSED"],
+        ["AWAITING_MANUAL_INPUT", "AWAITING_DOCUMENT_UPLOAD"],
+        None,
+    ),
+    (
+        "[Complete IDV, Don't Start POA]",
+        ["PASSED"],
+        ["AWAITING_PROVIDER_SELECTION"],
+        None,
+    ),
+    (
+        "[Complete IDV, POA - Don't Submit]",
+        ["PASSED"],
+        ["VERIFIED"],
+        ["AWAITING_SUBMISSION"],
+    ),
+    (
+        "[Don't start IDV, POA]",
+        ["UNKNOWN"],
+        ["AWAITING_PROVIDER_SELECTION"],
+        ["AWAITING_SUBMISSION"],
+    ),
+    (
+        "[IDV incomplete, Awaiting Address Review]",
+        ["AWAITING_CUSTOMER_RETRY"],
+        ["AWAITING_MANUAL_REVIEW"],
+        ["AWAITING_MANUAL_REVIEW"],
+    ),
+    ("[IDV Incomplete, POA Complete]", IDV_INCOMPLETE, ["VERIFIED"], None),
+    ("[IDV incomplete, POA incomplete]", IDV_INCOMPLETE, POA_INCOMPLETE, None),
+    ("[IDV incomplete,Awaiting QR Scan]", IDV_INCOMPLETE, ["AWAITING_QR_SCAN"], None),
+    (
+        "[IDV incomplete. Don't Start POA]",
+        IDV_INCOMPLETE,
+        ["AWAITING_PROVIDER_SELECTION"],
+        None,
+    ),
+    ("[IDV Not Started, Awaiting QR Scan]", ["UNKNOWN"], ["AWAITING_QR_SCAN"], None),
+    ("[IDV Not Started, POA Incomplete]", ["UNKNOWN"], POA_INCOMPLETE, None),
+    ("[IDV Not Started, POA Complete]", ["UNKNOWN"], ["VERIFIED"], None),
+    (
+        "[Submit Application, Don't Submit EDD Docs]",
+        ["PASSED"],
+        ["VERIFIED"],
+        ["AWAITING_APPROVAL", "AWAITING_ADDITIONAL_DOCUMENTS"],
+    ),
+    ("[Submitted EDD Docs]", ["PASSED"], ["VERIFIED"], ["AWAITING_MANUAL_REVIEW"]),
+]
+
 
 def read_sql(sql_path):
     logger.info("Reading sql file... ")
@@ -24,433 +125,150 @@ def read_sql(sql_path):
 
 
 def run_query(query):
-    client = boto3.client("athena")
-    res = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": os.environ["DATABASE"]},
-        ResultConfiguration={
-            "OutputLocation": "s3://" + os.environ["S3_ATHENA"] + "/output/",
-        },
+    return read_athena_query(
+        query,
+        os.environ["DATABASE"],
+        "s3://" + os.environ["S3_ATHENA"],
+        max_cache_seconds=QUERY_CACHE_SECONDS,
     )
-    logger.info("Execution ID: " + res["QueryExecutionId"])
 
-    try:
-        query_status = None
-        while (
-            query_status == "QUEUED"
-            or query_status == "RUNNING"
-            or query_status is None
-        ):
-            query_status = client.get_query_execution(
-                QueryExecutionId=res["QueryExecutionId"]
-            )["QueryExecution"]["Status"]["State"]
-            logger.info(query_status)
-            if query_status == "FAILED" or query_status == "CANCELLED":
-                raise Exception(
-                    'Athena query with the string "{}" failed or was cancelled'.format(
-                        query
-                    )
-                )
-            time.sleep(10)
-        logger.info('Query "{}" finished.'.format(query))
-
-        resource = boto3.resource("s3")
-        res = (
-            resource.Bucket(os.environ["S3_CURATED"])
-            .Object(key=res["QueryExecutionId"] + ".csv")
-            .get()
-        )
-        df = pd.read_csv(io.BytesIO(res["Body"].read()), encoding="utf8")
-
-        return df
 
-    except Exception as e:
-        logger.info(e)
+def restrict_to_users(query, key_column, users_query):
+    return f"select * from ({query}) where {key_column} in ({users_query})"
 
 
-def circumstance_process(custI):
-    custI["Circumstance"] = custI["Circumstance"].str.rstrip(" |")
-    cc = custI[["dynamodb_new_image_customer_id_s", "Circumstance"]].drop_duplicates()
-    cc["SelfEmployed_OR_BusinessOwner"] = np.where(
-        cc["Circumstance"].astype(str).str.contains("SELF_EMPLOYED"),
-        "Y",
-        cc["Circumstance"],
-    )
-    cc["SelfEmployed_OR_BusinessOwner"] = np.where(
-        cc["Circumstance"].astype(str).str.contains("BUSINESS_OWNER"),
-        "Y",
-        cc["SelfEmployed_OR_BusinessOwner"],
-    )
-    cc["SelfEmployed_OR_BusinessOwner"] = np.where(
-        cc["SelfEmployed_OR_BusinessOwner"] != "Y",
-        "N",
-        cc["SelfEmployed_OR_BusinessOwner"],
+def read_state(state_path):
+    """
+    Reads the report state: the watermark JSON and the last report, keyed by user_id.
+    :param state_path: S3 URI holding state.json and report.parquet
+    :return: State dict and report, ({}, None) when there is no state yet
+    """
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/state.json"
+    try:
+        response = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            logger.info("No partnership report state found")
+            return {}, None
+        raise
+    state = json.loads(response["Body"].read())
+    report = wr.s3.read_parquet(f"{state_path.rstrip('/')}/report.parquet")
+    # back to the object columns a CSV report is read with
+    report = report.astype(object).where(report.notna(), np.nan)
+    return state, report
+
+
+def write_state(state_path, report, state):
+    """
+    Persists the report, sorted by user_id, and then the watermark JSON.
+    :param state_path: S3 URI holding state.json and report.parquet
+    :param report: Final report of this run
+    :param state: State dict with the watermark and the date of the last full refresh
+    """
+    report = report.sort_values("user_id").reset_index(drop=True)
+    wr.s3.to_parquet(
+        df=report.astype("string"), path=f"{state_path.rstrip('/')}/report.parquet"
     )
-    cc["SelfEmployed_OR_BusinessOwner"] = np.where(
-        cc["Circumstance"].isnull(), np.nan, cc["SelfEmployed_OR_BusinessOwner"]
+    bucket, prefix = state_path.replace("s3://", "").split("/", 1)
+    key = f"{prefix.rstrip('/')}/state.json"
+    boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=json.dumps(state))
+    logger.info("Partnership report watermark set to %s", state["watermark"])
+
+
+def is_incremental(state, report, full_refresh=False):
+    """
+    Only changed users are recomputed unless there is no state yet, a full refresh
+    was requested or the last one is FULL_REFRESH_DAYS old.
+    """
+    last_full_refresh = state.get("last_full_refresh")
+    if full_refresh or report is None or not state.get("watermark"):
+        return False
+    if not last_full_refresh:
+        return False
+    return date.today() - date.fromisoformat(last_full_refresh) < timedelta(
+        days=FULL_REFRESH_DAYS
     )
 
-    notnacc = cc[
-        (cc["SelfEmployed_OR_BusinessOwner"] == "Y")
-        | (cc["SelfEmployed_OR_BusinessOwner"] == "N")
-    ]
-    isnaacc = cc[cc["SelfEmployed_OR_BusinessOwner"].isna()]
 
-    fin = isnaacc[
-        ~isnaacc["dynamodb_new_image_customer_id_s"].isin(
-            notnacc["dynamodb_new_image_customer_id_s"]
-        )
-    ]
+def get_watermark(dataframe, previous=None):
+    """Returns the latest updated_at of the pulled rows, never moving back from previous."""
+    if dataframe.empty:
+        return previous
+    latest = pd.to_datetime(dataframe["dynamodb_new_image_updated_at_n"]).max()
+    if pd.isna(latest):
+        return previous
+    if latest.tzinfo is not None:
+        latest = latest.tz_convert("UTC").tz_localize(None)
+    watermark = latest.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    return max(watermark, previous) if previous else watermark
 
-    cc = pd.concat([notnacc, fin])
-    return cc
 
-
-def individual_process(dataframe):
-    dataframe["dynamodb_new_image_updated_at_n"] = pd.to_datetime(
-        dataframe["dynamodb_new_image_updated_at_n"]
-    )
-    get_min_date = (
-        dataframe.groupby(["user_id"])["dynamodb_new_image_updated_at_n"]
-        .min()
-        .reset_index()
-    )
-    get_min_date.rename(
-        columns={"dynamodb_new_image_updated_at_n": "join_Date"}, inplace=True
+def get_changed_since(watermark):
+    """Returns the watermark moved back by WATERMARK_LOOKBACK_HOURS, in the same format."""
+    since = datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S.%f") - timedelta(
+        hours=WATERMARK_LOOKBACK_HOURS
     )
+    return since.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
 
-    rel_users = get_min_date[get_min_date["join_Date"] >= "2023-04-16"][
-        "user_id"
-    ].unique()
 
-    df = dataframe[dataframe["user_id"].isin(rel_users)]
-    df = df.merge(get_min_date, on=["user_id"], how="left")
-    df["join_Date"] = df["join_Date"].dt.date
-
-    df[
-        "dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool"
-    ].unique()
-    df["PEP"] = np.where(
-        df[
-            "dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool"
-        ]
-        .astype(str)
-        .str.contains("False"),
-        "Y",
-        df[
-            "dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool"
-        ],
-    )
-    df["PEP"] = np.where(
-        df[
-            "dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool"
-        ]
-        .astype(str)
-        .str.contains("True"),
-        "N",
-        df["PEP"],
-    )
-    df["PEP"].unique()
-    return df
+def merge_state(report, changed):
+    """Replaces the rows of the changed users in the previous report."""
+    unchanged = report[~report["user_id"].isin(changed["user_id"])]
+    return pd.concat([unchanged, changed]).sort_values("user_id").reset_index(drop=True)
 
 
 def get_ar(df):
-    df_lr = df[df["rn_last"] == 1]
-    ar = []
-    for i in df_lr["user_id"]:
-        n_df = df_lr[df_lr["user_id"] == i]
-
-        if (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_REVIEW"
-        ):
-            ar.append([i, "[Complete IDV, Awaiting Address Review]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_QR_SCAN"
-        ):
-            ar.append([i, "[Complete IDV, Awaiting QR Scan]"])
-
-        elif n_df[
-            "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-        ].values == "PASSED" and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_INPUT"
-            or n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_DOCUMENT_UPLOAD"
-        ):
-            ar.append([i, "[Complete IDV, Don't Complete POA]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_PROVIDER_SELECTION"
-        ):
-            ar.append([i, "[Complete IDV, Don't Start POA]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "VERIFIED"
-            and n_df["dynamodb_new_image_status_s"].values == "AWAITING_SUBMISSION"
-        ):
-            ar.append([i, "[Complete IDV, POA - Don't Submit]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "UNKNOWN"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_PROVIDER_SELECTION"
-            and n_df["dynamodb_new_image_status_s"].values == "AWAITING_SUBMISSION"
-        ):
-            ar.append([i, "[Don't start IDV, POA]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_CUSTOMER_RETRY"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_REVIEW"
-            and n_df["dynamodb_new_image_status_s"].values == "AWAITING_MANUAL_REVIEW"
-        ):
-            ar.append([i, "[IDV incomplete, Awaiting Address Review]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_CUSTOMER_RETRY"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PENDING"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "VERIFIED"
-        ):
-            ar.append([i, "[IDV Incomplete, POA Complete]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_CUSTOMER_RETRY"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PENDING"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_INPUT"
-            or n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_DOCUMENT_UPLOAD"
+    df_lr = df[df["rn_last"] == 1].reset_index(drop=True)
+
+    conditions = []
+    for _, idv_statuses, address_statuses, application_statuses in AR_BUCKET_RULES:
+        condition = np.ones(len(df_lr), dtype=bool)
+        for column, statuses in (
+            (IDV_STATUS, idv_statuses),
+            (ADDRESS_STATUS, address_statuses),
+            (APPLICATION_STATUS, application_statuses),
         ):
-            ar.append([i, "[IDV incomplete, POA incomplete]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_CUSTOMER_RETRY"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PENDING"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_QR_SCAN"
-        ):
-            ar.append([i, "[IDV incomplete,Awaiting QR Scan]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_CUSTOMER_RETRY"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PENDING"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_PROVIDER_SELECTION"
-        ):
-            ar.append([i, "[IDV incomplete. Don't Start POA]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "UNKNOWN"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_QR_SCAN"
-        ):
-            ar.append([i, "[IDV Not Started, Awaiting QR Scan]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "UNKNOWN"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_REVIEW"
-            or n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_MANUAL_INPUT"
-            or n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "AWAITING_DOCUMENT_UPLOAD"
-        ):
-            ar.append([i, "[IDV Not Started, POA Incomplete]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "UNKNOWN"
-        ) and (
-            n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "VERIFIED"
-        ):
-            ar.append([i, "[IDV Not Started, POA Complete]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "VERIFIED"
-            and (
-                n_df["dynamodb_new_image_status_s"].values == "AWAITING_APPROVAL"
-                or n_df["dynamodb_new_image_status_s"].values
-                == "AWAITING_ADDITIONAL_DOCUMENTS"
-            )
-        ):
-            ar.append([i, "[Submit Application, Don't Submit EDD Docs]"])
-
-        elif (
-            n_df[
-                "dynamodb_new_image_individual_m_identity_verification_m_status_s"
-            ].values
-            == "PASSED"
-            and n_df["dynamodb_new_image_individual_m_address_m_status_s"].values
-            == "VERIFIED"
-            and n_df["dynamodb_new_image_status_s"].values == "AWAITING_MANUAL_REVIEW"
-        ):
-            ar.append([i, "[Submitted EDD Docs]"])
+            if statuses is not None:
+                condition &= df_lr[column].isin(statuses).to_numpy()
+        conditions.append(condition)
 
-        else:
-            ar.append([i, np.nan])
+    # the first matching rule wins, users matching none get no bucket
+    buckets = np.array([rule[0] for rule in AR_BUCKET_RULES] + [np.nan], dtype=object)
+    rule_index = np.select(conditions, np.arange(len(AR_BUCKET_RULES)), default=-1)
+    df_lr["Bucket_"] = buckets[rule_index]
+    return df_lr
 
-    bucket_final = pd.DataFrame(ar, columns=["user_id", "Bucket_"])
-    df1 = df_lr.merge(bucket_final, on=["user_id"], how="left")
-    return df1
 
-
-def get_qr_final(df, df1):
+def get_qr_final(df1):
     today = datetime.now()
-    df_lr = df[df["rn_last"] == 1]
-    waiting_qr = df_lr[
-        df_lr["dynamodb_new_image_individual_m_address_m_status_s"]
-        == "AWAITING_QR_SCAN"
-    ]
-    qr = df[df.user_id.isin(waiting_qr["user_id"])]
-    qr_first = qr[
-        (qr["rn_add_last"] == 1)
-        & (
-            qr["dynamodb_new_image_individual_m_address_m_status_s"]
-            == "AWAITING_QR_SCAN"
-        )
-    ]
-
-    def diff(start, end):
-        x = pd.to_datetime(end) - pd.to_datetime(start)
-        return int(x / np.timedelta64(1, "W"))
+    waited = today - pd.to_datetime(df1["qr_scan_since"])
+    three_weeks = waited // np.timedelta64(1, "W") >= 3
 
-    qr_first["no_weeks"] = qr_first.apply(
-        lambda row: diff(row["dynamodb_new_image_updated_at_n"], today), axis=1
+    df2 = df1.assign(
+        Weeks_Waiting_for_QR_Scan=pd.Series("3 weeks or more", index=df1.index).where(
+            three_weeks
+        )
     )
-
-    qr_first = qr_first[qr_first["no_weeks"] >= 3]
-
-    qr_first["Weeks_Waiting_for_QR_Scan"] = ["3 weeks or more"] * len(qr_first)
-
-    qr_final = qr_first[["user_id", "Weeks_Waiting_for_QR_Scan"]]
-    df2 = df1.merge(qr_final, on=["user_id"], how="left")
     return df2
 
 
-def customer_reference(salesforce, df2, cc):
-    sf = salesforce[["customer_reference_id__c"]].drop_duplicates()
-    sf["customer_reference_id__c"] = sf["customer_reference_id__c"].astype("object")
-    df3 = df2.merge(
-        sf, left_on=["user_id"], right_on=["customer_reference_id__c"], how="left"
-    )
-    df3["Rework_YN"] = np.where(df3["customer_reference_id__c"].isnull(), " ", "Y")
-    df3.drop(
-        ["rn_last", "rn_first", "rn_add_last", "rn", "customer_reference_id__c"],
-        axis=1,
-        inplace=True,
-    )
-    df3 = df3.merge(
-        cc[["dynamodb_new_image_customer_id_s", "SelfEmployed_OR_BusinessOwner"]],
-        left_on=["user_id"],
-        right_on=["dynamodb_new_image_customer_id_s"],
-        how="left",
-    )
-    return df3
-
-
-def get_partnership_report(df):
-    yesterday = datetime.now() - timedelta(days=1)
-    yday = yesterday.strftime("%d%m%y")
+def get_partnership_report(df, previous=None):
+    if previous is None:
+        yesterday = datetime.now() - timedelta(days=1)
+        yday = yesterday.strftime("%d%m%y")
 
-    filepath = (
-        "s3://"
-        + os.environ["S3_CURATED"]
-        + "/partnership_reporting/"
-        + "output_"
-        + yday
-        + "_EOD.csv"
-    )
-    o = wr.s3.read_csv(path=filepath)
+        filepath = (
+            "s3://"
+            + os.environ["S3_CURATED"]
+            + "/partnership_reporting/"
+            + "output_"
+            + yday
+            + "_EOD.csv"
+        )
+        o = wr.s3.read_csv(path=filepath)
+    else:
+        o = previous.copy()
 
     drop_list = [
         "Nickname",
@@ -499,34 +317,9 @@ def get_partnership_report(df):
 
     o1["Rework Y/N"] = np.where(o1["Rework_YN"] == "Y", "Y", o1["Rework Y/N"])
     o1.drop(["Latest_Bucket"], axis=1, inplace=True)
+    # closed or onboarded applications report their status instead of a bucket
     o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "APPROVED",
-        o1["dynamodb_new_image_status_s"],
-        o1["Bucket_"],
-    )
-    o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "REJECTED",
-        o1["dynamodb_new_image_status_s"],
-        o1["Bucket_"],
-    )
-    o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "AWAITING_EXIT_PERIOD",
-        o1["dynamodb_new_image_status_s"],
-        o1["Bucket_"],
-    )
-    o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "CEASED",
-        o1["dynamodb_new_image_status_s"],
-        o1["Bucket_"],
-    )
-    o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "CLOSED",
-        o1["dynamodb_new_image_status_s"],
-        o1["Bucket_"],
-    )
-
-    o1["Bucket_"] = np.where(
-        o1["dynamodb_new_image_status_s"] == "AWAITING_BANK_ACCOUNT_CREATION",
+        o1["dynamodb_new_image_status_s"].isin(FINAL_APPLICATION_STATUSES),
         o1["dynamodb_new_image_status_s"],
         o1["Bucket_"],
     )
@@ -634,16 +427,30 @@ def get_partnership_report(df):
 def lambda_handler(event, context):
     begin = time.time()
 
-    dataframe = run_query(read_sql(config.config["queries"]["qq"]))
-    salesforce = run_query(read_sql(config.config["queries"]["sfq"]))
-    custI = run_query(read_sql(config.config["queries"]["qid"]))
-
-    df = individual_process(dataframe)
-    df1 = get_ar(df)
-    df2 = get_qr_final(df, df1)
-    cc = circumstance_process(custI)
-    df3 = customer_reference(salesforce, df2, cc)
-    final_df = get_partnership_report(df3)
+    state, report = read_state(STATE_PATH) if STATE_PATH else ({}, None)
+    incremental = is_incremental(state, report, event.get("full_refresh", False))
+
+    sql_files = config.config["queries"]
+    query = read_sql(sql_files["qq"])
+    if incremental:
+        since = get_changed_since(state["watermark"])
+        users = read_sql(sql_files["changed_users"]).format(watermark=since)
+        logger.info("Recomputing users changed since %s", since)
+        query = restrict_to_users(query, "user_id", users)
+    # one row per user, joined with the risk form and Salesforce cases in Athena
+    dataframe = run_query(query)
+
+    if incremental and dataframe.empty:
+        logger.info("No users changed since the last run")
+        final_df = report
+    else:
+        df1 = get_ar(dataframe)
+        df3 = get_qr_final(df1)
+        if incremental:
+            previous = report[report["user_id"].isin(df3["user_id"])]
+            final_df = merge_state(report, get_partnership_report(df3, previous))
+        else:
+            final_df = get_partnership_report(df3, report)
 
     tod = datetime.now().strftime("%d%m%y")
     output_filename = "output_" + tod + "_EOD.csv"
@@ -652,6 +459,20 @@ def lambda_handler(event, context):
     )
     wr.s3.to_csv(df=final_df, path=path)
 
+    if STATE_PATH:
+        write_state(
+            STATE_PATH,
+            final_df,
+            {
+                "watermark": get_watermark(dataframe, state.get("watermark")),
+                "last_full_refresh": (
+                    state.get("last_full_refresh")
+                    if incremental
+                    else date.today().isoformat()
+                ),
+            },
+        )
+
     end = time.time()
     logger.info(
         f"Total minutes taken for this Lambda to run: {float((end - begin) / 60):.2f}"
@@ -1,3 +1,4 @@
+with customers as (
 select  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s) as user_id,
 dynamodb_new_image_individual_m_address_m_status_s,
 dynamodb_new_image_individual_m_identity_verification_m_status_s, 
@@ -23,10 +24,73 @@ end as age_range,
     
 case when dynamodb_new_image_individual_m_gender_s like 'Female%' then 'Female' 
          when dynamodb_new_image_individual_m_gender_s like 'Male%' then 'Male' end as Male_Female,
-dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool,
+-- a failed PEP check means the customer is a PEP
+case cast(dynamodb_new_image_individual_m_individual_screening_m_result_m_pep_check_passed_bool as varchar)
+when 'true' then 'N'
+when 'false' then 'Y'
+end as PEP,
 row_number() over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s) order by dynamodb_new_image_updated_at_n desc) as rn_last,
-row_number() over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s),dynamodb_new_image_status_s order by dynamodb_new_image_updated_at_n asc) as rn_first,
-row_number() over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s),dynamodb_new_image_individual_m_address_m_status_s order by dynamodb_new_image_updated_at_n asc) as rn_add_last,
-row_number() over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s) order by dynamodb_new_image_updated_at_n asc) as rn
+min(dynamodb_new_image_updated_at_n) over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s)) as join_Date,
+-- first record awaiting a QR scan, the weeks waiting are counted from it
+min(case when dynamodb_new_image_individual_m_address_m_status_s = 'AWAITING_QR_SCAN' then dynamodb_new_image_updated_at_n end)
+   over(partition by  COALESCE(a.dynamodb_keys_id_s,a.dynamodb_key_id_s)) as qr_scan_since
 from datalake_curated.dynamo_scv_sls_customers a 
-where dynamodb_new_image_individual_m_address_m_country_code_s='ARE'
\ No newline at end of file
+where dynamodb_new_image_individual_m_address_m_country_code_s='ARE'
+),
+circumstances as (
+select dynamodb_new_image_customer_id_s,
+ case when Circumstance like '%SELF_EMPLOYED%' or Circumstance like '%BUSINESS_OWNER%' then 'Y' 
+      when Circumstance is null or ltrim(rtrim(Circumstance))='' then null
+      else 'N'
+ end as SelfEmployed_OR_BusinessOwner,
+ dynamodb_new_image_updated_at_n
+from (
+select dynamodb_new_image_customer_id_s, 
+dynamodb_new_image_updated_at_n, 
+concat(dynamodb_new_image_form_data_m_customer_circumstances_l_0_s,'| ',
+dynamodb_new_image_form_data_m_customer_circumstances_l_1_s, '| ',
+dynamodb_new_image_form_data_m_customer_circumstances_l_2_s,'| ',
+dynamodb_new_image_form_data_m_customer_circumstances_l_3_s,'| ',
+dynamodb_new_image_form_data_m_customer_circumstances_l_4_s,'| ',
+dynamodb_new_image_form_data_m_customer_circumstances_l_5_s) as Circumstance
+ from datalake_raw.dynamo_sls_customer_risk_form
+ )
+),
+self_employed as (
+-- the latest risk form that answered the circumstances
+select dynamodb_new_image_customer_id_s,
+max_by(SelfEmployed_OR_BusinessOwner, dynamodb_new_image_updated_at_n) as SelfEmployed_OR_BusinessOwner
+from circumstances
+where SelfEmployed_OR_BusinessOwner is not null
+group by dynamodb_new_image_customer_id_s
+),
+rework as (
+select distinct customer_reference_id__c from datalake_raw.salesforce_cases
+where  status='Documents Requested'
+and type='High risk manual review'
+)
+select c.user_id,
+c.dynamodb_new_image_individual_m_address_m_status_s,
+c.dynamodb_new_image_individual_m_identity_verification_m_status_s,
+c.Nickname,
+c.First_Name,
+c.Last_Name,
+c.dynamodb_new_image_email_s,
+c.dynamodb_new_image_phone_number_s,
+c.dynamodb_new_image_updated_at_n,
+c.dynamodb_new_image_status_s,
+c.dynamodb_new_image_individual_m_address_m_country_code_s,
+c.dynamodb_new_image_brand_id_s,
+c.age_range,
+c.Male_Female,
+c.PEP,
+c.rn_last,
+date(c.join_Date) as join_Date,
+case when c.dynamodb_new_image_individual_m_address_m_status_s = 'AWAITING_QR_SCAN' then c.qr_scan_since end as qr_scan_since,
+case when r.customer_reference_id__c is null then ' ' else 'Y' end as Rework_YN,
+s.SelfEmployed_OR_BusinessOwner
+from customers c
+left join rework r on c.user_id = r.customer_reference_id__c
+left join self_employed s on c.user_id = s.dynamodb_new_image_customer_id_s
+where c.rn_last = 1
+and c.join_Date >= timestamp '2023-04-16'
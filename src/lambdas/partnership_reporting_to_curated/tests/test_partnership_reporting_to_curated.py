@@ -0,0 +1,341 @@
+import os
+import sys
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# project root on sys.path so the "src.common" fallback import works
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, *[os.pardir] * 5)))
+
+import lambda_function as lf  # noqa: E402
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REPORT_COLUMNS = [
+    "user_id",
+    "First_Name",
+    "Last_Name",
+    "dynamodb_new_image_email_s",
+    "dynamodb_new_image_phone_number_s",
+    "age_range",
+    "Male_Female",
+    "Application Status",
+    "IDV Status",
+    "Address Status",
+    "Brand ID",
+    "Join Date",
+    "Original_Bucket",
+    "Weeks Waiting for QR Scan",
+    "Rework Y/N",
+    "PEP",
+    "SelfEmployed_OR_BusinessOwner",
+    "Called Y/N",
+    "Onboarded Y/N",
+    "Nickname",
+    "Latest_Bucket",
+    "Moved Y/N",
+]
+
+
+def synthetic_inputs(n_users, seed=0):
+    """qq.sql result and previous report for n_users with random onboarding statuses."""
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now().floor("s")
+
+    def pick(values):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), n_users)]
+
+    ids = np.asarray([f"u{i:07d}" for i in range(n_users)], dtype=object)
+    address = pick(
+        lf.POA_INCOMPLETE
+        + ["AWAITING_QR_SCAN", "AWAITING_PROVIDER_SELECTION", "VERIFIED"]
+    )
+    waiting = now - pd.to_timedelta(rng.integers(0, 60 * 24 * 3600, n_users), "s")
+    qq = pd.DataFrame(
+        {
+            "user_id": ids,
+            lf.ADDRESS_STATUS: address,
+            lf.IDV_STATUS: pick(lf.IDV_INCOMPLETE + ["PASSED", "UNKNOWN"]),
+            "Nickname": "nick",
+            "First_Name": "first",
+            "Last_Name": "last",
+            "dynamodb_new_image_email_s": "a@b.c",
+            "dynamodb_new_image_phone_number_s": "+971",
+            "dynamodb_new_image_updated_at_n": now,
+            lf.APPLICATION_STATUS: pick(
+                ["AWAITING_SUBMISSION", "AWAITING_MANUAL_REVIEW", "AWAITING_APPROVAL"]
+                + lf.FINAL_APPLICATION_STATUSES
+            ),
+            "dynamodb_new_image_individual_m_address_m_country_code_s": "ARE",
+            "dynamodb_new_image_brand_id_s": "nomo",
+            "age_range": pick(["17_to_23", "24_to_30", "46+"]),
+            "Male_Female": pick(["Male", "Female"]),
+            "PEP": pick(["Y", "N", np.nan]),
+            "rn_last": 1,
+            "join_Date": pd.Timestamp("2024-01-01").date(),
+            "qr_scan_since": pd.Series(waiting).where(address == "AWAITING_QR_SCAN"),
+            "Rework_YN": pick([" "] * 19 + ["Y"]),
+            "SelfEmployed_OR_BusinessOwner": pick(["Y", "N", np.nan]),
+        }
+    )
+
+    previous = pd.DataFrame(
+        {column: "N" for column in REPORT_COLUMNS}, index=range(n_users // 2)
+    )
+    previous["user_id"] = ids[: n_users // 2]
+    previous["Original_Bucket"] = "[IDV incomplete, POA incomplete]"
+    previous["Latest_Bucket"] = "[IDV incomplete, POA incomplete]"
+    previous["Weeks Waiting for QR Scan"] = np.nan
+    return qq, previous
+
+
+def build_report(qq, previous):
+    df1 = lf.get_ar(qq)
+    df3 = lf.get_qr_final(df1)
+    return lf.get_partnership_report(df3, previous)
+
+
+def _latest(idv, address, status, user_id="u1", rn_last=1):
+    return {
+        "user_id": user_id,
+        "rn_last": rn_last,
+        lf.IDV_STATUS: idv,
+        lf.ADDRESS_STATUS: address,
+        lf.APPLICATION_STATUS: status,
+    }
+
+
+@pytest.mark.parametrize(
+    "idv, address, status, bucket",
+    [
+        (
+            "PASSED",
+            "AWAITING_MANUAL_REVIEW",
+            "X",
+            "[Complete IDV, Awaiting Address Review]",
+        ),
+        (
+            "PASSED",
+            "AWAITING_DOCUMENT_UPLOAD",
+            "X",
+            "[Complete IDV, Don't Complete POA]",
+        ),
+        (
+            "PASSED",
+            "VERIFIED",
+            "AWAITING_SUBMISSION",
+            "[Complete IDV, POA - Don't Submit]",
+        ),
+        (
+            "UNKNOWN",
+            "AWAITING_PROVIDER_SELECTION",
+            "AWAITING_SUBMISSION",
+            "[Don't start IDV, POA]",
+        ),
+        # the address review rule is checked before the generic incomplete ones
+        (
+            "AWAITING_CUSTOMER_RETRY",
+            "AWAITING_MANUAL_REVIEW",
+            "AWAITING_MANUAL_REVIEW",
+            "[IDV incomplete, Awaiting Address Review]",
+        ),
+        ("PENDING", "AWAITING_MANUAL_REVIEW", "X", "[IDV incomplete, POA incomplete]"),
+        ("UNKNOWN", "AWAITING_MANUAL_INPUT", "X", "[IDV Not Started, POA Incomplete]"),
+        (
+            "PASSED",
+            "VERIFIED",
+            "AWAITING_ADDITIONAL_DOCUMENTS",
+            "[Submit Application, Don't Submit EDD Docs]",
+        ),
+        ("PASSED", "VERIFIED", "AWAITING_MANUAL_REVIEW", "[Submitted EDD Docs]"),
+    ],
+)
+def test_get_ar_buckets(idv, address, status, bucket):
+    df1 = lf.get_ar(pd.DataFrame([_latest(idv, address, status)]))
+    assert df1["Bucket_"].tolist() == [bucket]
+
+
+def test_get_ar_keeps_latest_records_and_leaves_unmatched_empty():
+    df = pd.DataFrame(
+        [
+            _latest("PASSED", "AWAITING_QR_SCAN", "X", user_id="u1", rn_last=2),
+            _latest("FAILED", "VERIFIED", "X", user_id="u1"),
+            _latest(np.nan, "AWAITING_QR_SCAN", np.nan, user_id="u2"),
+            _latest("UNKNOWN", "AWAITING_QR_SCAN", "X", user_id="u3"),
+        ]
+    )
+    df1 = lf.get_ar(df)
+
+    assert df1["user_id"].tolist() == ["u1", "u2", "u3"]
+    assert df1["Bucket_"].isna().tolist() == [True, True, False]
+    assert df1["Bucket_"].iloc[2] == "[IDV Not Started, Awaiting QR Scan]"
+
+
+def test_is_incremental_needs_state_and_a_recent_full_refresh():
+    report = pd.DataFrame({"user_id": ["u1"]})
+    today = lf.date.today()
+    state = {"watermark": "2024-01-01 00:00:00.000", "last_full_refresh": str(today)}
+
+    assert lf.is_incremental(state, report)
+    assert not lf.is_incremental(state, None)
+    assert not lf.is_incremental(state, report, full_refresh=True)
+    stale = dict(state, last_full_refresh=str(today - lf.timedelta(days=7)))
+    assert not lf.is_incremental(stale, report)
+
+
+def test_get_watermark_never_moves_back():
+    dataframe = pd.DataFrame(
+        {
+            "dynamodb_new_image_updated_at_n": [
+                "2024-01-02 10:00:00",
+                "2024-01-01 08:00:00",
+            ]
+        }
+    )
+
+    assert lf.get_watermark(dataframe) == "2024-01-02 10:00:00.000"
+    assert lf.get_watermark(dataframe, "2024-02-01 00:00:00.000") == (
+        "2024-02-01 00:00:00.000"
+    )
+    assert lf.get_watermark(pd.DataFrame(), "2024-02-01 00:00:00.000") == (
+        "2024-02-01 00:00:00.000"
+    )
+
+
+def test_merge_state_replaces_changed_users():
+    report = pd.DataFrame({"user_id": ["u3", "u1", "u2"], "Latest_Bucket": list("abc")})
+    changed = pd.DataFrame({"user_id": ["u1", "u4"], "Latest_Bucket": ["x", "y"]})
+
+    merged = lf.merge_state(report, changed)
+
+    assert merged["user_id"].tolist() == ["u1", "u2", "u3", "u4"]
+    assert merged["Latest_Bucket"].tolist() == ["x", "c", "a", "y"]
+
+
+@pytest.fixture
+def lambda_dir(monkeypatch):
+    # the handler reads its SQL files relative to the Lambda task root
+    monkeypatch.chdir(LAMBDA_DIR)
+
+
+def test_get_changed_since_looks_back_from_the_watermark():
+    with patch.object(lf, "WATERMARK_LOOKBACK_HOURS", 24):
+        assert lf.get_changed_since("2024-01-02 10:00:00.250") == (
+            "2024-01-01 10:00:00.250"
+        )
+
+
+def test_incremental_run_only_queries_changed_users(lambda_dir):
+    report = pd.DataFrame({"user_id": ["u1"], "Latest_Bucket": ["a"]})
+    state = {
+        "watermark": "2024-01-01 00:00:00.000",
+        "last_full_refresh": str(lf.date.today()),
+    }
+
+    with patch.object(lf, "STATE_PATH", "s3://curated/state/"), patch.object(
+        lf, "read_state", return_value=(state, report)
+    ), patch.object(
+        lf, "run_query", return_value=pd.DataFrame()
+    ) as run_mock, patch.object(
+        lf, "write_state"
+    ) as write_mock, patch.object(
+        lf.wr.s3, "to_csv"
+    ) as to_csv_mock, patch.dict(
+        os.environ, {"S3_CURATED": "curated"}
+    ):
+        lf.lambda_handler({}, None)
+
+    query = run_mock.call_args.args[0]
+    qq = lf.read_sql(os.path.join(LAMBDA_DIR, "qq.sql"))
+    assert query.startswith("select * from (" + qq)
+    # late records are picked up by looking back from the watermark
+    lookback = lf.get_changed_since(state["watermark"])
+    assert lookback < state["watermark"]
+    assert f"timestamp '{lookback}'" in query
+    assert to_csv_mock.call_args.kwargs["df"] is report
+    assert write_mock.call_args.args[2] == state
+
+
+def test_incremental_run_merges_changed_users_into_the_report(lambda_dir):
+    qq, report = synthetic_inputs(10)
+    qq[lf.APPLICATION_STATUS] = "AWAITING_SUBMISSION"
+    # two users already in the report and one new user changed since the watermark
+    changed = qq[qq["user_id"].isin(["u0000000", "u0000001", "u0000007"])]
+    state = {
+        "watermark": "2024-01-01 00:00:00.000",
+        "last_full_refresh": str(lf.date.today()),
+    }
+
+    with patch.object(lf, "STATE_PATH", "s3://curated/state/"), patch.object(
+        lf, "read_state", return_value=(state, report)
+    ), patch.object(lf, "run_query", return_value=changed), patch.object(
+        lf, "write_state"
+    ) as write_mock, patch.object(
+        lf.wr.s3, "to_csv"
+    ) as to_csv_mock, patch.dict(
+        os.environ, {"S3_CURATED": "curated"}
+    ):
+        lf.lambda_handler({}, None)
+
+    final_df = to_csv_mock.call_args.kwargs["df"].set_index("user_id")
+    assert final_df.index.tolist() == sorted(report["user_id"].tolist() + ["u0000007"])
+
+    # users that did not change keep their row of the previous report
+    unchanged = ["u0000002", "u0000003", "u0000004"]
+    pd.testing.assert_frame_equal(
+        final_df.loc[unchanged, REPORT_COLUMNS[1:]],
+        report.set_index("user_id").loc[unchanged, REPORT_COLUMNS[1:]],
+        check_dtype=False,
+    )
+
+    # changed users keep their original bucket and get the latest one recomputed
+    expected = lf.get_qr_final(lf.get_ar(changed)).set_index("user_id")["Bucket_"]
+    for user_id in ["u0000000", "u0000001"]:
+        assert final_df.loc[user_id, "Original_Bucket"] == (
+            "[IDV incomplete, POA incomplete]"
+        )
+        assert final_df.loc[user_id, "Latest_Bucket"] == expected[user_id]
+    assert final_df.loc["u0000007", "Original_Bucket"] == expected["u0000007"]
+
+    assert write_mock.call_args.args[1] is to_csv_mock.call_args.kwargs["df"]
+    assert write_mock.call_args.args[2] == {
+        "watermark": lf.get_watermark(changed, state["watermark"]),
+        "last_full_refresh": state["last_full_refresh"],
+    }
+
+
+def test_get_qr_final_flags_three_weeks_or_more():
+    now = pd.Timestamp.now()
+    df1 = pd.DataFrame(
+        {
+            "user_id": ["u1", "u2", "u3"],
+            "qr_scan_since": [
+                now - pd.Timedelta(days=22),
+                now - pd.Timedelta(days=20),
+                pd.NaT,
+            ],
+        }
+    )
+
+    df2 = lf.get_qr_final(df1)
+
+    assert df2["Weeks_Waiting_for_QR_Scan"].iloc[0] == "3 weeks or more"
+    assert df2["Weeks_Waiting_for_QR_Scan"].iloc[1:].isna().all()
+
+
+def test_report_pipeline_benchmark():
+    # synthetic run of the whole report, BENCHMARK_USERS=1000000 for the full-size run
+    n_users = int(os.environ.get("BENCHMARK_USERS", "20000"))
+    inputs = synthetic_inputs(n_users)
+
+    start = time.perf_counter()
+    report = build_report(*inputs)
+    elapsed = time.perf_counter() - start
+
+    assert list(report.columns) == REPORT_COLUMNS
+    assert report["user_id"].is_unique
+    # well under the per-user filtering the rules engine and weeks waiting replaced
+    assert elapsed < 30
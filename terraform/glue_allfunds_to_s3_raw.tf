@@ -41,6 +41,12 @@ resource "aws_glue_job" "glue_allfunds_to_s3_raw" {
     "--S3_RAW"                  = local.raw_datalake_bucket_name,
     "--NOMO_ALLFUNDS_READ_ONLY" = var.allfunds_auth_path,
     "--BASE_URL"                = var.allfunds_base_url,
+    "--MAX_WORKERS"             = "8",
+    "--REQUESTS_PER_SECOND"     = "10",
+    "--BATCH_SIZE"              = "25",
+    "--PERFORMANCE_DATE_RANGE"  = "false",
+    "--FLUSH_RECORDS"           = "100000",
+    "--STATE_PATH"              = "s3://${local.glue_assets_bucket_name}/${local.project_name}/state/allfunds/",
   }
 
   connections = ["${local.prefix}-vpc-private-connection"]
@@ -14,3 +14,19 @@ resource "aws_s3_object" "glue_api_client" {
   etag = filemd5("../src/common/api_client.py")
 }
 
+
+resource "aws_s3_object" "glue_s3_utils" {
+  bucket = local.glue_assets_bucket_name
+  key    = "${local.project_name}/scripts/common/s3_utils.py"
+  source = "../src/common/s3_utils.py"
+
+  etag = filemd5("../src/common/s3_utils.py")
+}
+
+resource "aws_s3_object" "glue_imal_utils" {
+  bucket = local.glue_assets_bucket_name
+  key    = "${local.project_name}/scripts/common/imal_utils.py"
+  source = "../src/common/imal_utils.py"
+
+  etag = filemd5("../src/common/imal_utils.py")
+}
@@ -21,6 +21,7 @@ resource "aws_glue_job" "datalake_imal_reporting_to_s3_raw" {
     "--enable-continuous-cloudwatch-log" = "true"
     "--enable-metrics"                   = "true"
     "--TempDir"                          = "s3://${local.glue_assets_bucket_name}/temporary/"
+    "--extra-py-files"                   = "s3://${local.glue_assets_bucket_name}/${aws_s3_object.glue_s3_utils.key},s3://${local.glue_assets_bucket_name}/${aws_s3_object.glue_imal_utils.key}"
     "--enable-glue-datacatalog"          = "true"
     "--S3_RAW"                           = local.raw_datalake_bucket_name
     "--bucket_name"                      = local.landing_datalake_bucket_name
@@ -28,6 +29,8 @@ resource "aws_glue_job" "datalake_imal_reporting_to_s3_raw" {
     "--start_date"                       = "2020-01-01"
     "--end_date"                         = "2020-01-01"
     "--valid_files"                      = "CardTransactions,CurrentAccountBalanceByDay,FixedTermDepositFeesAndProfit,CurrentAccountFTPandCompensation,FixedTermDepositsByDay,MortgageBalanceByDay,MortgageFeesAndExpenses,MortgageProfit,FixedTermDepositFTP,Cashback,CardChargesAndFees,CurrentAccountFeesAndProfit,MultiCurrencyFeesAndIncome,ArrearsDays,OvernightRates"
+    "--max_workers"                      = "2"
+    "--staged_write"                     = "true"
     "library-set"                        = "analytics"
     "--additional-python-modules"        = "ijson==3.3.0"
   }
@@ -34,6 +34,9 @@ resource "aws_glue_job" "util_glue" {
     "--job-language"                     = "python"
     "--TempDir"                          = "s3://${local.glue_assets_bucket_name}/temporary/"
     "--S3_RAW"                           = local.raw_datalake_bucket_name
+    "--STATE_PATH"                       = "s3://${local.glue_assets_bucket_name}/${local.project_name}/state/util_glue/"
+    "--TABLES"                           = "imal_reporting_currentaccountbalancebyday"
+    "--FULL_REFRESH"                     = "false"
     "--enable-auto-scaling"              = "true"
      "--continuous-log-logGroup"          = aws_cloudwatch_log_group.util_glue.name
     "--cloudwatch-log-stream-prefix"     = "util_glue"
@@ -13,6 +13,7 @@ module "lambda_cards_paymentology_data_to_s3" {
   layers        = [local.lambda_layer_aws_wrangler_arn]
 
   source_path = [
+    "${path.module}/../src/common/s3_utils.py",
     "${path.module}/../src/lambdas/cards_paymentology_data_to_s3_raw",
   ]
 
@@ -27,7 +27,10 @@ module "lambda_currency_cloud_data_to_s3" {
   ]
 
   environment_variables = {
-    S3_RAW = local.raw_datalake_bucket_name
+    S3_RAW            = local.raw_datalake_bucket_name
+    MAX_WORKERS       = "8"
+    STATE_PATH        = "s3://${local.glue_assets_bucket_name}/${local.project_name}/state/currency_cloud/"
+    FULL_REFRESH_DAYS = "7"
   }
 
   hash_extra   = "${local.prefix}-currency-cloud-api"
@@ -13,6 +13,7 @@ module "lambda_customer_captured_changes_to_s3_curated" {
   memory_size   = 10240
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     {
       path = "${path.module}/../src/lambdas/customer_captured_changes_to_s3_curated",
       patterns = [
@@ -29,6 +30,7 @@ module "lambda_customer_captured_changes_to_s3_curated" {
   environment_variables = {
     S3_CURATED = local.curated_datalake_bucket_name
     IS_SANDBOX = var.bespoke_account == "sandbox" ? "true" : "false"
+    S3_ATHENA  = local.athena_results_bucket_name
   }
 
   hash_extra   = "${local.prefix}-customer-captured-changes-to-s3-curated"
@@ -13,12 +13,14 @@ module "lambda_customer_detail_to_s3_curated" {
   memory_size   = 10240
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     "${path.module}/../src/lambdas/customer_detail_to_s3_curated",
   ]
 
   environment_variables = {
     S3_CURATED = local.curated_datalake_bucket_name
     IS_SANDBOX = var.bespoke_account == "sandbox" ? "true" : "false"
+    S3_ATHENA  = local.athena_results_bucket_name
   }
 
   hash_extra   = "${local.prefix}-customer-detail-to-s3-curated"
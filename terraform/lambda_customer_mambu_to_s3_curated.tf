@@ -14,12 +14,14 @@ module "lambda_customer_mambu_to_s3_curated" {
 
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     "${path.module}/../src/lambdas/customer_mambu_to_s3_curated",
   ]
 
   environment_variables = {
     S3_CURATED = local.curated_datalake_bucket_name
     IS_SANDBOX = var.bespoke_account == "sandbox" ? "true" : "false"
+    S3_ATHENA  = local.athena_results_bucket_name
   }
 
   hash_extra   = "${local.prefix}-customer-mambu-to-s3-curated"
@@ -13,11 +13,13 @@ module "lambda_customer_risk_form_data_to_s3_curated" {
   memory_size   = var.lambda_customer_risk_form_memory_size
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     "${path.module}/../src/lambdas/customer_risk_data_raw_to_curated",
   ]
 
   environment_variables = {
     S3_CURATED = local.curated_datalake_bucket_name
+    S3_ATHENA  = local.athena_results_bucket_name
   }
 
   hash_extra   = "${local.prefix}-customer-risk-form-data-to-s3-curated"
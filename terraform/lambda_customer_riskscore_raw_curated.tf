@@ -13,6 +13,7 @@ module "lambda_customer_riskscore_data_to_s3_curated" {
   memory_size   = var.lambda_customer_riskscore_memory_size
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     {
       path = "${path.module}/../src/lambdas/customer_risk_score_raw_to_curated",
       patterns = [
@@ -29,6 +30,7 @@ module "lambda_customer_riskscore_data_to_s3_curated" {
   environment_variables = {
     WRANGLER_WRITE_MODE = "overwrite_partitions"
     S3_CURATED          = local.curated_datalake_bucket_name
+    S3_ATHENA           = local.athena_results_bucket_name
   }
 
   hash_extra   = "${local.prefix}-customer-risk-score-data-to-s3-curated"
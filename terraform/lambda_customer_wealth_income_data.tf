@@ -13,6 +13,7 @@ module "lambda_customer_wealth_income_data" {
   layers        = [local.lambda_layer_aws_wrangler_arn]
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     {
       path = "${path.module}/../src/lambdas/customer_wealth_income_data",
       patterns = [
@@ -26,7 +27,8 @@ module "lambda_customer_wealth_income_data" {
   ]
 
   environment_variables = {
-    S3_RAW = var.sfmc_bucket,
+    S3_RAW    = var.sfmc_bucket,
+    S3_ATHENA = local.athena_results_bucket_name,
   }
 
   hash_extra               = "${local.prefix}-customer-wealth-income-data"
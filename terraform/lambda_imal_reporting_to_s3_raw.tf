@@ -13,12 +13,23 @@ module "lambda_imalreportingtos3" {
   layers        = [local.lambda_layer_aws_wrangler_arn]
   tracing_mode  = "Active"
 
-  source_path = [{
-    path = "${path.module}/../src/lambdas/imal_reporting_to_s3_raw/"
-  }]
+  source_path = [
+    "${path.module}/../src/common/imal_utils.py",
+    {
+      path             = "${path.module}/../src/lambdas/imal_reporting_to_s3_raw/"
+      pip_requirements = true
+      patterns = [
+        "!tests/.*",
+        "!.DS_Store",
+        "!.package/.*",
+      ]
+    },
+  ]
 
   environment_variables = {
-    dest_bucket = local.raw_datalake_bucket_name
+    dest_bucket   = local.raw_datalake_bucket_name
+    max_memory_mb = "512"
+    staged_write  = "true"
   }
 
   create_role              = false
@@ -13,13 +13,18 @@ module "lambda_partnership_reporting_to_curated" {
   memory_size   = 6144
 
   source_path = [
+    "${path.module}/../src/common/athena_utils.py",
     "${path.module}/../src/lambdas/partnership_reporting_to_curated",
   ]
 
   environment_variables = {
-    S3_CURATED = local.curated_datalake_bucket_name,
-    S3_ATHENA  = local.athena_results_bucket_name,
-    DATABASE   = "datalake_curated"
+    S3_CURATED               = local.curated_datalake_bucket_name,
+    S3_ATHENA                = local.athena_results_bucket_name,
+    DATABASE                 = "datalake_curated"
+    QUERY_CACHE_SECONDS      = "3600"
+    STATE_PATH               = "s3://${local.curated_datalake_bucket_name}/partnership_reporting/state/"
+    FULL_REFRESH_DAYS        = "7"
+    WATERMARK_LOOKBACK_HOURS = "24"
   }
 
   hash_extra   = "${local.prefix}-partnership-reporting-to-curated"
@@ -0,0 +1,292 @@
+import glob
+import io
+import json
+import os
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from src.common import athena_utils
+from src.common.athena_utils import (
+    read_athena_query,
+    read_sql,
+    run_athena_pipeline,
+    wait_for_query,
+)
+
+LAMBDAS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "src", "lambdas"
+)
+
+
+def _athena_client(*states):
+    mock_athena = MagicMock()
+    mock_athena.start_query_execution.return_value = {"QueryExecutionId": "qid-1"}
+    mock_athena.get_query_execution.side_effect = [
+        {"QueryExecution": {"Status": {"State": state}}} for state in states
+    ]
+    return mock_athena
+
+
+def _s3_client(marker=None):
+    mock_s3 = MagicMock()
+    if marker is None:
+        mock_s3.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+    else:
+        mock_s3.get_object.return_value = {
+            "Body": io.BytesIO(json.dumps(marker).encode())
+        }
+    return mock_s3
+
+
+class TestWaitForQuery(unittest.TestCase):
+    def test_polling_backs_off_until_finished(self):
+        mock_athena = _athena_client("QUEUED", "RUNNING", "RUNNING", "SUCCEEDED")
+
+        with patch.object(athena_utils.time, "sleep") as sleep_mock:
+            wait_for_query("qid-1", mock_athena, initial_delay=0.25, max_delay=1.0)
+
+        delays = [c.args[0] for c in sleep_mock.call_args_list]
+        self.assertEqual(delays, [0.25, 0.5, 1.0, 1.0])
+
+    def test_failed_query_raises(self):
+        mock_athena = _athena_client("RUNNING", "FAILED")
+
+        with patch.object(athena_utils.time, "sleep"):
+            with self.assertRaises(RuntimeError):
+                wait_for_query("qid-1", mock_athena)
+
+
+class TestReadAthenaQuery(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(athena_utils.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_query_is_unloaded_to_parquet(self):
+        mock_athena = _athena_client("SUCCEEDED")
+        mock_s3 = _s3_client()
+        df = pd.DataFrame({"id": [1, 2]})
+
+        with patch.object(athena_utils.wr.s3, "delete_objects"), patch.object(
+            athena_utils.wr.s3, "list_objects", return_value=["part-0"]
+        ), patch.object(
+            athena_utils.wr.s3, "read_parquet", return_value=df
+        ) as read_mock:
+            result = read_athena_query(
+                "select id from t",
+                "db",
+                "s3://results",
+                600,
+                None,
+                mock_athena,
+                mock_s3,
+            )
+
+        self.assertIs(result, df)
+        query = mock_athena.start_query_execution.call_args.kwargs["QueryString"]
+        self.assertTrue(
+            query.startswith("UNLOAD (select id from t) TO 's3://results/unload/")
+        )
+        self.assertIn("format = 'PARQUET'", query)
+        # the marker is written next to the result so a rerun can reuse it
+        marker_key = mock_s3.put_object.call_args.kwargs["Key"]
+        self.assertEqual(
+            read_mock.call_args.args[0], "s3://results/" + marker_key[:-5] + "/"
+        )
+
+    def _unload(self, sql):
+        mock_athena = _athena_client("SUCCEEDED")
+        with patch.object(athena_utils.wr.s3, "delete_objects"), patch.object(
+            athena_utils.wr.s3, "list_objects", return_value=[]
+        ):
+            read_athena_query(
+                sql,
+                "db",
+                "s3://results",
+                athena_client=mock_athena,
+                s3_client=_s3_client(),
+            )
+        return mock_athena.start_query_execution.call_args.kwargs["QueryString"]
+
+    def test_trailing_semicolon_is_dropped(self):
+        query = self._unload("select id from t;\n\n")
+
+        self.assertTrue(
+            query.startswith("UNLOAD (select id from t) TO 's3://results/unload/")
+        )
+
+    def test_lambda_sql_files_build_a_valid_unload(self):
+        sql_files = glob.glob(os.path.join(LAMBDAS_DIR, "customer_*", "*.sql"))
+        sql_files += glob.glob(
+            os.path.join(LAMBDAS_DIR, "partnership_reporting_to_curated", "*.sql")
+        )
+        self.assertGreaterEqual(len(sql_files), 8)
+
+        for sql_file in sql_files:
+            with self.subTest(sql_file=os.path.basename(sql_file)):
+                sql = read_sql(sql_file).replace(
+                    "{watermark}", "2024-01-01 00:00:00.000"
+                )
+                query = self._unload(sql)
+
+                self.assertTrue(query.startswith("UNLOAD ("))
+                inner = query[len("UNLOAD (") : query.rindex(") TO 's3://results/")]
+                self.assertEqual(inner, inner.strip())
+                self.assertNotIn(";", inner)
+                # a trailing line comment would swallow the closing parenthesis
+                self.assertNotIn("--", inner.splitlines()[-1])
+
+    def test_recent_identical_query_is_reused(self):
+        mock_athena = _athena_client()
+        marker = {"query_execution_id": "qid-0", "finished_at": time.time() - 60}
+
+        with patch.object(
+            athena_utils.wr.s3, "list_objects", return_value=["part-0"]
+        ), patch.object(athena_utils.wr.s3, "read_parquet") as read_mock:
+            read_athena_query(
+                "select 1",
+                "db",
+                "s3://results/athena",
+                600,
+                None,
+                mock_athena,
+                _s3_client(marker),
+            )
+
+        mock_athena.start_query_execution.assert_not_called()
+        read_mock.assert_called_once()
+
+    def test_stale_result_is_recomputed(self):
+        mock_athena = _athena_client("SUCCEEDED")
+        marker = {"query_execution_id": "qid-0", "finished_at": time.time() - 7200}
+
+        with patch.object(
+            athena_utils.wr.s3, "delete_objects"
+        ) as delete_mock, patch.object(
+            athena_utils.wr.s3, "list_objects", return_value=[]
+        ):
+            result = read_athena_query(
+                "select 1",
+                "db",
+                "s3://results",
+                600,
+                None,
+                mock_athena,
+                _s3_client(marker),
+            )
+
+        mock_athena.start_query_execution.assert_called_once()
+        delete_mock.assert_called_once()
+        self.assertTrue(result.empty)
+
+    def test_workgroup_is_passed_to_athena(self):
+        mock_athena = _athena_client("SUCCEEDED")
+
+        with patch.object(athena_utils.wr.s3, "delete_objects"), patch.object(
+            athena_utils.wr.s3, "list_objects", return_value=[]
+        ):
+            read_athena_query(
+                "select 1",
+                "db",
+                "s3://results",
+                athena_client=mock_athena,
+                s3_client=_s3_client(),
+                workgroup="datalake_workgroup",
+            )
+
+        self.assertEqual(
+            mock_athena.start_query_execution.call_args.kwargs["WorkGroup"],
+            "datalake_workgroup",
+        )
+
+
+class TestRunAthenaPipeline(unittest.TestCase):
+    def _run(self, chunks, **kwargs):
+        writes = []
+
+        def write(df, mode):
+            writes.append((df.reset_index(drop=True), mode))
+
+        with patch.object(
+            athena_utils, "read_athena_query", return_value=iter(chunks)
+        ) as read_mock:
+            rows = run_athena_pipeline(
+                "select 1", "db", "s3://results", write, **kwargs
+            )
+        return rows, writes, read_mock
+
+    def test_chunks_after_the_first_are_appended(self):
+        chunks = [pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})]
+
+        rows, writes, read_mock = self._run(
+            chunks, chunksize=2, workgroup="datalake_workgroup"
+        )
+
+        self.assertEqual(rows, 3)
+        self.assertEqual([mode for _, mode in writes], ["overwrite", "append"])
+        self.assertEqual(read_mock.call_args.kwargs["chunksize"], 2)
+        self.assertEqual(read_mock.call_args.kwargs["workgroup"], "datalake_workgroup")
+
+    def test_transform_is_applied_to_each_chunk(self):
+        chunks = [pd.DataFrame({"id": [1]}), pd.DataFrame({"id": [2]})]
+
+        def add_date(df):
+            df["date"] = "20240101"
+            return df
+
+        _, writes, _ = self._run(chunks, transform=add_date)
+
+        self.assertTrue(all(list(df["date"]) == ["20240101"] for df, _ in writes))
+
+    def test_partition_is_only_overwritten_by_its_first_chunk(self):
+        chunks = [
+            pd.DataFrame({"id": [1, 2], "date": ["d1", "d2"]}),
+            pd.DataFrame({"id": [3, 4], "date": ["d2", "d3"]}),
+        ]
+
+        rows, writes, _ = self._run(
+            chunks, mode="overwrite_partitions", partition_cols=["date"]
+        )
+
+        self.assertEqual(rows, 4)
+        self.assertEqual(
+            [(list(df["id"]), mode) for df, mode in writes],
+            [
+                ([1, 2], "overwrite_partitions"),
+                ([4], "overwrite_partitions"),
+                ([3], "append"),
+            ],
+        )
+
+    def test_failed_write_stops_the_run(self):
+        chunks = [pd.DataFrame({"id": [1]}), pd.DataFrame({"id": [2]})]
+        write = MagicMock(side_effect=Exception("Upload error"))
+
+        with patch.object(athena_utils, "read_athena_query", return_value=iter(chunks)):
+            with self.assertRaises(Exception):
+                run_athena_pipeline("select 1", "db", "s3://results", write)
+
+        write.assert_called_once()
+
+    def test_failed_overwrite_after_the_first_chunk_is_logged_as_partial(self):
+        chunks = [pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3]})]
+        write = MagicMock(side_effect=["ok", Exception("Upload error")])
+
+        with patch.object(athena_utils, "read_athena_query", return_value=iter(chunks)):
+            with self.assertLogs(athena_utils.logger, "ERROR") as logs:
+                with self.assertRaises(Exception):
+                    run_athena_pipeline("select 1", "db", "s3://results", write)
+
+        self.assertEqual(write.call_count, 2)
+        self.assertIn("after 2 rows were written (overwrite)", logs.output[0])
+        self.assertIn("partial result", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.common import imal_utils
+
+
+class TestIsDateColumn(unittest.TestCase):
+    def test_dates_without_time(self):
+        series = pd.Series(["01/01/2020", None, "13/01/2020"], dtype="object")
+        self.assertTrue(imal_utils.is_date_column(series))
+        self.assertTrue(imal_utils.is_date_column(pd.Series(["2024-04-01"])))
+
+    def test_datetimes_and_text_are_rejected(self):
+        self.assertFalse(
+            imal_utils.is_date_column(pd.Series(["01/01/2020", "2020-01-02 10:00:00"]))
+        )
+        self.assertFalse(imal_utils.is_date_column(pd.Series(["hello", "world"])))
+        self.assertFalse(imal_utils.is_date_column(pd.Series(["ACC-001", "ACC-002"])))
+
+    def test_large_text_column_is_rejected_on_sample(self):
+        series = pd.Series([f"ref-{i}" for i in range(5000)])
+        with patch.object(imal_utils.pd, "to_datetime") as to_datetime_mock:
+            self.assertFalse(imal_utils.is_date_column(series))
+        to_datetime_mock.assert_not_called()
+
+    def test_positive_verdict_is_rechecked_per_chunk(self):
+        key = ("imal_reporting_cache_test", "opened")
+        self.assertTrue(
+            imal_utils.is_date_column(pd.Series(["2024-01-01"]), cache_key=key)
+        )
+        self.assertFalse(imal_utils.is_date_column(pd.Series(["text"]), cache_key=key))
+
+    def test_negative_verdict_is_cached_per_table_column(self):
+        key = ("imal_reporting_cache_test", "reference")
+        self.assertFalse(imal_utils.is_date_column(pd.Series(["text"]), cache_key=key))
+        with patch.object(imal_utils.pd, "to_datetime") as to_datetime_mock:
+            self.assertFalse(
+                imal_utils.is_date_column(pd.Series(["2024-01-01"]), cache_key=key)
+            )
+        to_datetime_mock.assert_not_called()
+
+
+class TestGetSchema(unittest.TestCase):
+    def test_schema_structure(self):
+        df = pd.DataFrame({"id": [1, 2], "created_at": ["2024-04-01", "2024-04-02"]})
+
+        schema, df = imal_utils.get_schema(df, "20240401")
+
+        self.assertEqual(schema["id"], "int")
+        self.assertEqual(schema["created_at"], "date")
+        self.assertEqual(schema["date"], "date")
+        self.assertEqual(schema["timestamp_extracted"], "timestamp")
+
+    def test_unparseable_value_in_registered_date_column_is_nulled(self):
+        df = pd.DataFrame({"opened": ["N/A", "03/01/2024"]})
+
+        with self.assertLogs(imal_utils.logger, level="WARNING") as logs:
+            schema, df = imal_utils.get_schema(df, "20240101", {"opened": "date"})
+
+        self.assertEqual(schema["opened"], "date")
+        self.assertTrue(pd.isna(df["opened"][0]))
+        self.assertEqual(df["opened"][1], pd.Timestamp("2024-01-03"))
+        self.assertIn("opened: 1 value(s)", logs.output[0])
+
+
+class TestSchemaRegistry(unittest.TestCase):
+    def setUp(self):
+        imal_utils._schema_registry.clear()
+
+    def test_registry_is_seeded_from_catalog(self):
+        with patch.object(
+            imal_utils.wr.catalog,
+            "get_table_types",
+            return_value={"amount": "double", "date": "date"},
+        ) as types_mock:
+            self.assertEqual(
+                imal_utils.get_registered_schema("t"), {"amount": "double"}
+            )
+            imal_utils.get_registered_schema("t")
+        types_mock.assert_called_once()
+
+    def test_registered_type_wins_over_chunk_dtype(self):
+        registry = {"amount": "double"}
+        df = pd.DataFrame(
+            {"amount": [None, None], "note": [None, None], "ref": ["a", "b"]}
+        )
+        schema, df = imal_utils.get_schema(df, "20240101", registry, "t")
+        schema, df = imal_utils.apply_schema_registry(df, schema, registry, "t")
+
+        self.assertEqual(schema["amount"], "double")
+        self.assertNotIn("note", schema)
+        self.assertNotIn("note", df.columns)
+        self.assertEqual(registry, {"amount": "double", "ref": "string"})
+
+
+class TestToArrowType(unittest.TestCase):
+    def test_timestamps_are_written_in_milliseconds(self):
+        self.assertEqual(imal_utils.to_arrow_type("timestamp"), pa.timestamp("ms"))
+
+    def test_unknown_type_raises(self):
+        with self.assertRaises(ValueError):
+            imal_utils.to_arrow_type("decimal(10,2)")
+
+
+class TestStagedParquetWriter(unittest.TestCase):
+    schema = {"id": "int", "date": "date"}
+
+    def _stage(self, chunks, **kwargs):
+        mock_s3 = MagicMock()
+        row_groups = []
+
+        def upload_file(local_path, bucket, key):
+            metadata = pq.ParquetFile(local_path).metadata
+            row_groups.append(
+                [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+            )
+
+        mock_s3.upload_file.side_effect = upload_file
+        writer = imal_utils.StagedParquetWriter("raw", "t", "20240101", **kwargs)
+        with patch.object(
+            imal_utils.boto3, "client", return_value=mock_s3
+        ), patch.object(imal_utils.wr.catalog, "create_parquet_table"), patch.object(
+            imal_utils.wr.catalog, "add_parquet_partitions"
+        ):
+            for chunk in chunks:
+                self.assertTrue(writer.write(chunk, self.schema))
+            self.assertTrue(writer.commit())
+        return row_groups
+
+    @staticmethod
+    def _chunk(start, rows):
+        return pd.DataFrame({"id": range(start, start + rows), "date": "20240101"})
+
+    def test_small_chunks_are_buffered_into_row_groups(self):
+        chunks = [self._chunk(i * 2, 2) for i in range(5)]
+
+        row_groups = self._stage(chunks, row_group_rows=4)
+
+        self.assertEqual(row_groups, [[4, 4, 2]])
+
+    def test_chunks_below_the_row_group_size_make_one_row_group(self):
+        chunks = [self._chunk(i * 1000, 1000) for i in range(10)]
+
+        self.assertEqual(self._stage(chunks), [[10000]])
+
+    def test_abort_drops_buffered_chunks(self):
+        writer = imal_utils.StagedParquetWriter("raw", "t", "20240101")
+        writer.write(self._chunk(0, 2), self.schema)
+
+        writer.abort()
+
+        self.assertEqual(writer._pending, [])
+        self.assertIsNone(writer._writer)
+
+
+class TestColumnBuffers(unittest.TestCase):
+    def test_append_to_buffers_pads_missing_and_new_columns(self):
+        buffers = {}
+        imal_utils.append_to_buffers(buffers, {"a": 1}, 0)
+        imal_utils.append_to_buffers(buffers, {"b": "x"}, 1)
+        imal_utils.append_to_buffers(buffers, {"a": 3, "b": "y"}, 2)
+
+        self.assertEqual(buffers, {"a": [1, None, 3], "b": [None, "x", "y"]})
+
+    def test_buffers_to_frame_keeps_schema_of_first_chunk(self):
+        df, schema = imal_utils.buffers_to_frame(
+            {"amount": [1.5, 2.0], "name": [None, None]}
+        )
+        self.assertEqual(str(df["amount"].dtype), "float64")
+
+        # ints in a later chunk stay double, a null-only column gets its real type
+        df, schema = imal_utils.buffers_to_frame(
+            {"amount": [3, 4], "name": ["a", "b"]}, schema
+        )
+        self.assertEqual(str(df["amount"].dtype), "float64")
+        self.assertEqual(str(schema.field("amount").type), "double")
+        self.assertEqual(str(schema.field("name").type), "string")
+
+    def test_buffers_to_frame_mixed_values_fall_back_to_string(self):
+        df, schema = imal_utils.buffers_to_frame({"ref": [1, "A2"]})
+        self.assertEqual(list(df["ref"]), ["1", "A2"])
+        self.assertEqual(str(schema.field("ref").type), "string")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import MagicMock
+
+from src.common.s3_utils import list_s3_keys, list_s3_keys_concurrently
+
+
+def _paginating_client(keys_by_page):
+    mock_s3 = MagicMock()
+
+    def paginate(Bucket, Prefix):
+        return [
+            {"Contents": [{"Key": k} for k in page if k.startswith(Prefix)]}
+            for page in keys_by_page
+        ]
+
+    mock_s3.get_paginator.return_value.paginate.side_effect = paginate
+    return mock_s3
+
+
+class TestS3Utils(unittest.TestCase):
+    def test_list_s3_keys_follows_pages_and_filters(self):
+        mock_s3 = _paginating_client([["in/a.csv", "in/b.txt"], ["in/c.csv"], []])
+
+        keys = list(
+            list_s3_keys(
+                "bucket", "in/", mock_s3, key_filter=lambda k: k.endswith(".csv")
+            )
+        )
+
+        self.assertEqual(keys, ["in/a.csv", "in/c.csv"])
+        mock_s3.get_paginator.assert_called_once_with("list_objects_v2")
+
+    def test_list_s3_keys_concurrently_keeps_prefix_order(self):
+        mock_s3 = _paginating_client([["a/1", "a/2", "b/1", "c/1"]])
+
+        keys = list_s3_keys_concurrently("bucket", ["c/", "a/"], mock_s3, max_workers=2)
+
+        self.assertEqual(keys, ["c/1", "a/1", "a/2"])
+
+    def test_list_s3_keys_concurrently_without_prefixes(self):
+        self.assertEqual(list_s3_keys_concurrently("bucket", [], MagicMock()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()